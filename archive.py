@@ -0,0 +1,352 @@
+"""Холодный архив логов: старые строки переезжают из Postgres в сжатые сегменты на диске.
+
+Сегмент — неизменяемая пара файлов в LOG_ARCHIVE_DIR:
+
+    logs_<min_id>_<max_id>.ndjson.gz   строки logs, по одной JSON-строке, по возрастанию id
+    logs_<min_id>_<max_id>.idx.json    диапазон id, диапазон времени, число строк, набор eventName
+
+Архиватор (фоновая задача или `python archive.py`) раз в LOG_ARCHIVE_INTERVAL
+секунд переносит строки старше LOG_ARCHIVE_AFTER_DAYS дней: пишет сегмент,
+и только потом удаляет строки из базы. Эндпоинты чтения ищут через
+find_log_rows: строки из базы и из подходящих по индексу сегментов сливаются
+по id. Архив локальный, поэтому все воркеры, которые его читают, должны
+видеть один и тот же каталог.
+"""
+import argparse
+import asyncio
+import base64
+import fcntl
+import gzip
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional
+from sqlalchemy import delete
+import crud
+import models
+from database import AsyncSessionLocal
+from json_response import encode_json
+from storage import log_store
+
+env = os.environ
+
+LOG_ARCHIVE_DIR = env.get('LOG_ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive'))
+# 0 — архиватор выключен, чтение архива при этом продолжает работать
+LOG_ARCHIVE_AFTER_DAYS = int(env.get('LOG_ARCHIVE_AFTER_DAYS', 0))
+LOG_ARCHIVE_SEGMENT_ROWS = int(env.get('LOG_ARCHIVE_SEGMENT_ROWS', 50000))
+LOG_ARCHIVE_INTERVAL = float(env.get('LOG_ARCHIVE_INTERVAL', 3600))
+# Сколько id удаляется из базы одним DELETE после записи сегмента
+LOG_ARCHIVE_DELETE_BATCH = 1000
+
+SEGMENT_SUFFIX = '.ndjson.gz'
+INDEX_SUFFIX = '.idx.json'
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    # Время без зоны (SQLite) считаем UTC, как и в эндпоинтах
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def encode_row(row: Dict[str, Any]) -> bytes:
+    # raw_body (body_capture) — байты, в JSON-строке сегмента они в base64
+    if row.get('raw_body') is not None:
+        row = {**row, 'raw_body': base64.b64encode(row['raw_body']).decode()}
+    return encode_json(row)
+
+
+def decode_row(line: bytes) -> Dict[str, Any]:
+    row = json.loads(line)
+    row['timestamp'] = _parse_time(row.get('timestamp'))
+    if row.get('raw_body') is not None:
+        row['raw_body'] = base64.b64decode(row['raw_body'])
+    return row
+
+
+def _write_atomic(path: str, data: bytes):
+    # Файл появляется под своим именем только целиком записанным
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def in_purge_range(timestamp: Optional[datetime], start: Optional[datetime], end: Optional[datetime]) -> bool:
+    # Те же границы, что у partitions.purge_logs: [start, end); строка без времени — только без границ
+    if start is not None and (timestamp is None or timestamp < start):
+        return False
+    if end is not None and (timestamp is None or timestamp >= end):
+        return False
+    return True
+
+
+def segment_name(rows: List[Dict[str, Any]]) -> str:
+    return f"logs_{rows[0]['id']:012d}_{rows[-1]['id']:012d}"
+
+
+def write_segment(directory: str, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Пишет сегмент из строк, отсортированных по id; индекс пишется последним."""
+    name = segment_name(rows)
+    timestamps = [row['timestamp'] for row in rows if row.get('timestamp') is not None]
+    data = b''.join(encode_row(row) + b'\n' for row in rows)
+    _write_atomic(os.path.join(directory, name + SEGMENT_SUFFIX), gzip.compress(data, compresslevel=6))
+    index = {
+        'file': name + SEGMENT_SUFFIX,
+        'min_id': rows[0]['id'],
+        'max_id': rows[-1]['id'],
+        'start': min(timestamps).isoformat() if timestamps else None,
+        'end': max(timestamps).isoformat() if timestamps else None,
+        'count': len(rows),
+        'event_names': sorted({row['event_name'] for row in rows if row.get('event_name') is not None}),
+    }
+    _write_atomic(os.path.join(directory, name + INDEX_SUFFIX), encode_json(index))
+    return index
+
+
+class LogArchive:
+    """Чтение сегментов; индексы держим в памяти и перечитываем, когда меняется каталог."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._indexes: List[Dict[str, Any]] = []
+        self._mtime = None
+        self.segments_read = 0
+
+    def segments(self) -> List[Dict[str, Any]]:
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        if mtime != self._mtime:
+            indexes = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(INDEX_SUFFIX):
+                    with open(entry.path, 'rb') as f:
+                        index = json.loads(f.read())
+                    index['start'] = _parse_time(index['start'])
+                    index['end'] = _parse_time(index['end'])
+                    index['event_names'] = set(index['event_names'])
+                    indexes.append(index)
+            self._indexes = sorted(indexes, key=lambda index: index['min_id'])
+            self._mtime = mtime
+        return self._indexes
+
+    def candidates(self, filters: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Сегменты, которые по индексу могут содержать подходящие строки."""
+        result = []
+        event_name = (filters.get('fields') or {}).get('eventName')
+        for index in self.segments():
+            if filters.get('min_id') is not None and index['max_id'] < filters['min_id']:
+                continue
+            if filters.get('max_id') is not None and index['min_id'] > filters['max_id']:
+                continue
+            if filters.get('start') is not None and (index['end'] is None or index['end'] < filters['start']):
+                continue
+            if filters.get('end') is not None and (index['start'] is None or index['start'] >= filters['end']):
+                continue
+            if event_name is not None and event_name not in index['event_names']:
+                continue
+            result.append(index)
+        return result
+
+    def read_segment(self, index: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        self.segments_read += 1
+        with gzip.open(os.path.join(self.directory, index['file']), 'rb') as f:
+            for line in f:
+                yield decode_row(line)
+
+    def find_rows(self, filters: Dict[str, Any], order_desc: bool = True, limit: Optional[int] = None,
+                  segments: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """Подходящие строки архива в порядке id; сегменты читаются, пока они могут улучшить результат."""
+        segments = sorted(segments if segments is not None else self.candidates(filters),
+                          key=lambda index: index['min_id'], reverse=order_desc)
+        rows: List[Dict[str, Any]] = []
+        for index in segments:
+            if limit is not None and len(rows) >= limit:
+                worst = rows[limit - 1]['id']
+                if (index['max_id'] < worst) if order_desc else (index['min_id'] > worst):
+                    continue
+            rows.extend(self.read_matching(index, filters))
+            rows.sort(key=lambda row: row['id'], reverse=order_desc)
+            if limit is not None:
+                del rows[limit:]
+        return rows
+
+    def read_matching(self, index: Dict[str, Any], filters: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [row for row in self.read_segment(index) if crud.row_matches(row, filters)]
+
+    def purge(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> int:
+        """Удаляет из архива строки с timestamp в [start, end), как storage.log_store.purge.
+
+        Без границ удаляются все сегменты. Сегмент, задетый диапазоном, читается:
+        целиком попавший в диапазон удаляется, остальные переписываются без удалённых
+        строк. Архиватор в это время ждёт на той же блокировке.
+        """
+        if not os.path.isdir(self.directory):
+            return 0
+        lock_fd = os.open(os.path.join(self.directory, '.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            self._mtime = None
+            deleted = 0
+            for index in self.candidates({'start': start, 'end': end}):
+                if start is None and end is None:
+                    kept = []
+                else:
+                    rows = list(self.read_segment(index))
+                    kept = [row for row in rows if not in_purge_range(row.get('timestamp'), start, end)]
+                    if len(kept) == len(rows):
+                        continue
+                # Сначала индекс: без него сегмент уже не читается
+                name = index['file'][:-len(SEGMENT_SUFFIX)]
+                os.remove(os.path.join(self.directory, name + INDEX_SUFFIX))
+                if kept:
+                    write_segment(self.directory, kept)
+                if not kept or segment_name(kept) != name:
+                    os.remove(os.path.join(self.directory, index['file']))
+                deleted += index['count'] - len(kept)
+            self._mtime = None
+            return deleted
+        finally:
+            os.close(lock_fd)
+
+    def stats(self) -> Dict[str, Any]:
+        segments = self.segments()
+        return {
+            'directory': self.directory,
+            'segments': len(segments),
+            'rows': sum(index['count'] for index in segments),
+            'bytes': sum(os.path.getsize(os.path.join(self.directory, index['file'])) for index in segments),
+            'min_id': segments[0]['min_id'] if segments else None,
+            'max_id': max(index['max_id'] for index in segments) if segments else None,
+            'segments_read': self.segments_read,
+        }
+
+
+log_archive = LogArchive(LOG_ARCHIVE_DIR)
+
+
+async def find_log_rows(filters: Dict[str, Any], order_desc: bool = True,
+                        limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+    """Строки логов из хранилища (storage.log_store) и архива, слитые по id, как одна таблица.
+
+    filters — аргументы crud.log_filters. Архив читается, только если по индексам
+    в нём есть сегменты, способные попасть в первые offset + limit строк.
+    """
+    if not log_store.archived:
+        return await log_store.find(filters, order_desc=order_desc, limit=limit, offset=offset)
+    # Какие строки пропустить, известно только после слияния, поэтому обе части читаются с начала
+    wanted = None if limit is None else offset + limit
+    rows = await log_store.find(filters, order_desc=order_desc, limit=wanted)
+    segments = log_archive.candidates(filters)
+    if wanted is not None and len(rows) >= wanted:
+        last = rows[-1]['id']
+        segments = [index for index in segments
+                    if (index['max_id'] > last if order_desc else index['min_id'] < last)]
+    if not segments:
+        return rows[offset:]
+    archived = await asyncio.to_thread(log_archive.find_rows, filters, order_desc, wanted, segments)
+    # После сбоя между записью сегмента и удалением строка может быть в обоих местах
+    merged = {row['id']: row for row in archived}
+    merged.update((row['id'], row) for row in rows)
+    result = sorted(merged.values(), key=lambda row: row['id'], reverse=order_desc)
+    return result[offset:wanted]
+
+
+class Archiver:
+    """Переносит старые строки из logs в сегменты архива."""
+
+    def __init__(self, archive: LogArchive, after_days: int, segment_rows: int, interval: float):
+        self.archive = archive
+        self.after_days = after_days
+        self.segment_rows = segment_rows
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.segments_written = 0
+        self.rows_archived = 0
+        self.errors = 0
+
+    async def start(self):
+        # В памяти (LOG_STORAGE=memory) старые строки и так вытесняются, архивировать нечего
+        if self._task is None and self.after_days > 0 and log_store.archived:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run_once(self) -> int:
+        os.makedirs(self.archive.directory, exist_ok=True)
+        # Воркеры одной машины архивируют по очереди; занято — значит, уже работает другой
+        lock_fd = os.open(os.path.join(self.archive.directory, '.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            cutoff = datetime.now(timezone.utc) - timedelta(days=self.after_days)
+            archived = 0
+            while True:
+                async with AsyncSessionLocal() as db:
+                    rows = await crud.get_log_rows(db, models.Logs.timestamp < cutoff,
+                                                   order_desc=False, limit=self.segment_rows)
+                    if not rows:
+                        break
+                    index = await asyncio.to_thread(write_segment, self.archive.directory, rows)
+                    ids = [row['id'] for row in rows]
+                    for i in range(0, len(ids), LOG_ARCHIVE_DELETE_BATCH):
+                        await db.execute(
+                            delete(models.Logs)
+                            .where(models.Logs.id.in_(ids[i:i + LOG_ARCHIVE_DELETE_BATCH]))
+                            .execution_options(synchronize_session=False)
+                        )
+                        await db.commit()
+                self.segments_written += 1
+                self.rows_archived += len(rows)
+                archived += len(rows)
+                print(f"Archived logs {index['min_id']}..{index['max_id']} ({len(rows)} rows) to {index['file']}")
+                if len(rows) < self.segment_rows:
+                    break
+            return archived
+        finally:
+            os.close(lock_fd)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                print(f"Log archiver failed: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'after_days': self.after_days,
+            'segment_rows': self.segment_rows,
+            'segments_written': self.segments_written,
+            'rows_archived': self.rows_archived,
+            'errors': self.errors,
+            'archive': self.archive.stats(),
+        }
+
+
+archiver = Archiver(log_archive, after_days=LOG_ARCHIVE_AFTER_DAYS,
+                    segment_rows=LOG_ARCHIVE_SEGMENT_ROWS, interval=LOG_ARCHIVE_INTERVAL)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Move old logs into archive segments")
+    parser.add_argument('--after-days', type=int, default=LOG_ARCHIVE_AFTER_DAYS or 30)
+    parser.add_argument('--segment-rows', type=int, default=LOG_ARCHIVE_SEGMENT_ROWS)
+    args = parser.parse_args()
+    manual = Archiver(log_archive, args.after_days, args.segment_rows, interval=0)
+    print(f"Archived {asyncio.run(manual.run_once())} rows")
@@ -0,0 +1,82 @@
+"""Время холодного старта: от запуска процесса до первого принятого вебхука и до готовности (/readyz).
+
+Запуск из корня репозитория, база настроена как для сервиса:
+
+    python benchmarks/cold_start.py --runs 10 --output cold.json
+    python benchmarks/cold_start.py --command "gunicorn main:app -w 2 -b 127.0.0.1:{port}"
+
+Каждый прогон запускает сервер заново и шлёт вебхук, пока тот не будет
+принят; отдельно ждёт 200 от /readyz. Разбивка по этапам берётся из
+/x/stats/startup (импорт, lifespan, схема). compare.py сравнивает прогоны.
+"""
+import argparse
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import time
+import httpx
+from common import report, save_results, summarize
+from payloads import casavi_event
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_for(check, deadline: float) -> float:
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return time.monotonic()
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError("Server did not start in time")
+
+
+def run_once(args):
+    url = f'http://127.0.0.1:{args.port}'
+    headers, body = casavi_event(event_name='contact_updated')
+    started = time.monotonic()
+    server = subprocess.Popen(shlex.split(args.command.format(port=args.port)), cwd=root,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = started + args.timeout
+        accepted = wait_for(lambda: httpx.post(f'{url}/', json=body, headers=headers, timeout=5).is_success, deadline)
+        ready = wait_for(lambda: httpx.get(f'{url}/readyz', timeout=5).status_code == 200, deadline)
+        marks = httpx.get(f'{url}/x/stats/startup', timeout=5).json()['marks']
+        return accepted - started, ready - started, marks
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--command', default=f'{sys.executable} -m uvicorn main:app --port {{port}}',
+                        help='команда запуска, {port} подставляется')
+    parser.add_argument('--port', type=int, default=8110)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--output', help='JSON-файл с результатами для compare.py')
+    args = parser.parse_args()
+
+    first_webhook, readiness = [], []
+    for i in range(args.runs):
+        accepted, ready, marks = run_once(args)
+        first_webhook.append(accepted)
+        readiness.append(ready)
+        print(f"run {i + 1}: first webhook {accepted:.3f}s, ready {ready:.3f}s, marks {marks}")
+
+    duration = sum(first_webhook)
+    results = {
+        'first_webhook': summarize(first_webhook, 0, duration),
+        'ready': summarize(readiness, 0, sum(readiness)),
+    }
+    for name, result in results.items():
+        report(name, result)
+    save_results(args.output, 'cold_start', results, vars(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Общие функции скриптов benchmarks: перцентили, отчёт и файл результатов для compare.py."""
+import json
+import platform
+import statistics
+import subprocess
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def summarize(latencies: List[float], errors: int, duration: float) -> Dict[str, Any]:
+    """Задержки в секундах -> throughput и перцентили в миллисекундах."""
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / duration, 1) if duration else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'mean_ms': round((statistics.mean(latencies) if latencies else 0) * 1000, 3),
+    }
+
+
+def report(name: str, result: Dict[str, Any]):
+    print(f"{name:24} requests={result['requests']:8} errors={result['errors']:5} "
+          f"rps={result['rps']:10.1f} p50={result['p50_ms']:9.3f}ms "
+          f"p99={result['p99_ms']:9.3f}ms mean={result['mean_ms']:9.3f}ms")
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(path: Optional[str], suite: str, results: Dict[str, Dict[str, Any]], params: Dict[str, Any]):
+    """Файл одного прогона: {suite, revision, started, params, results: {имя: метрики}}."""
+    if not path:
+        return
+    data = {
+        'suite': suite,
+        'revision': git_revision(),
+        'started': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'params': params,
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    print(f"Results saved to {path}")
@@ -0,0 +1,72 @@
+"""Сравнивает два прогона (--output из concurrent_load.py или micro.py) и находит регрессии.
+
+    python benchmarks/compare.py baseline.json current.json --threshold 10
+
+Регрессия — p50/p99 выросли или rps упал больше чем на --threshold процентов.
+Разница в задержке меньше --min-ms считается шумом. При регрессии код выхода 1,
+поэтому сравнение можно поставить шагом перед деплоем.
+"""
+import argparse
+import json
+import sys
+
+# Метрика и направление: +1 — чем больше, тем хуже
+METRICS = [('rps', -1), ('p50_ms', 1), ('p99_ms', 1)]
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def change_percent(before, after):
+    if not before:
+        return 0.0
+    return (after - before) / before * 100
+
+
+def compare(baseline, current, threshold, min_ms):
+    regressions = []
+    print(f"{'name':24} {'metric':7} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name, before in baseline['results'].items():
+        after = current['results'].get(name)
+        if after is None:
+            print(f"{name:24} missing in current run")
+            continue
+        for metric, direction in METRICS:
+            change = change_percent(before[metric], after[metric])
+            worse = change * direction > threshold
+            if worse and metric.endswith('_ms') and abs(after[metric] - before[metric]) < min_ms:
+                worse = False
+            mark = '  REGRESSION' if worse else ''
+            print(f"{name:24} {metric:7} {before[metric]:12.3f} {after[metric]:12.3f} {change:+8.1f}%{mark}")
+            if worse:
+                regressions.append((name, metric, change))
+        if after.get('errors', 0) > before.get('errors', 0):
+            print(f"{name:24} errors  {before.get('errors', 0):12} {after['errors']:12}  REGRESSION")
+            regressions.append((name, 'errors', None))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=10.0, help='допустимое ухудшение, процентов')
+    parser.add_argument('--min-ms', type=float, default=0.05, help='разница задержки, которую не считаем')
+    args = parser.parse_args()
+
+    baseline, current = load(args.baseline), load(args.current)
+    if baseline.get('suite') != current.get('suite'):
+        sys.exit(f"Different suites: {baseline.get('suite')} vs {current.get('suite')}")
+    print(f"baseline {baseline.get('revision')} {baseline.get('started')}")
+    print(f"current  {current.get('revision')} {current.get('started')}")
+    regressions = compare(baseline, current, args.threshold, args.min_ms)
+    if regressions:
+        print(f"{len(regressions)} regressions over {args.threshold}%")
+        sys.exit(1)
+    print("No regressions")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Одновременная нагрузка на приём вебхуков и на эндпоинты просмотрщика логов.
+
+Запуск против поднятого сервера:
+
+    python benchmarks/concurrent_load.py --url http://localhost:8000 --duration 30 --output run.json
+
+Скрипт печатает throughput и p50/p99 отдельно для ingest и viewer. При
+синхронной сессии медленный /x/logs_for_period раздувает задержку ingest;
+с асинхронным слоем базы обе группы должны держать свои задержки.
+
+Вебхуки — смесь событий CASAVI из payloads.EVENT_MIX; ticket_* сервис
+пересылает в ELMA, поэтому для прогона его стоит направить на заглушку
+(stub_elma.py, FORWARD_DOMAINS). Файл --output сравнивается compare.py.
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta, timezone
+import httpx
+from common import report, save_results, summarize
+from payloads import casavi_event
+
+
+async def ingest_worker(client, deadline, latencies, errors, rng):
+    while time.monotonic() < deadline:
+        headers, body = casavi_event(rng)
+        started = time.monotonic()
+        try:
+            response = await client.post('/', json=body, headers=headers)
+            response.raise_for_status()
+            latencies.append(time.monotonic() - started)
+        except httpx.HTTPError:
+            errors.append(1)
+
+
+async def viewer_worker(client, deadline, latencies, errors):
+    end = datetime.now(timezone.utc)
+    start = end - timedelta(days=7)
+    period = {'start': start.isoformat(), 'end': end.isoformat()}
+    # Параметры через params: '+' в смещении зоны иначе превратится в пробел
+    requests = [
+        ('/x/logs_last_part', {}),
+        ('/x/logs_for_period', period),
+        ('/x/logs/page', {'limit': 100}),
+        ('/x/logs/search', {'eventName': 'ticket_updated', **period}),
+    ]
+    i = 0
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        try:
+            path, params = requests[i % len(requests)]
+            response = await client.get(path, params=params)
+            if response.status_code not in (200, 404):
+                response.raise_for_status()
+            latencies.append(time.monotonic() - started)
+        except httpx.HTTPError:
+            errors.append(1)
+        i += 1
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--ingest', type=int, default=20, help='параллельных отправителей вебхуков')
+    parser.add_argument('--viewers', type=int, default=5, help='параллельных клиентов просмотрщика')
+    parser.add_argument('--seed', type=int, default=1, help='зерно генератора вебхуков')
+    parser.add_argument('--output', help='JSON-файл с результатами для compare.py')
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    limits = httpx.Limits(max_connections=args.ingest + args.viewers)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as client:
+        deadline = time.monotonic() + args.duration
+        ingest_latencies, ingest_errors = [], []
+        viewer_latencies, viewer_errors = [], []
+        await asyncio.gather(
+            *[ingest_worker(client, deadline, ingest_latencies, ingest_errors, random.Random(rng.random()))
+              for _ in range(args.ingest)],
+            *[viewer_worker(client, deadline, viewer_latencies, viewer_errors) for _ in range(args.viewers)],
+        )
+
+    results = {
+        'ingest': summarize(ingest_latencies, len(ingest_errors), args.duration),
+        'viewer': summarize(viewer_latencies, len(viewer_errors), args.duration),
+    }
+    for name, result in results.items():
+        report(name, result)
+    save_results(args.output, 'load', results, vars(args))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+"""CPU на сериализацию одной страницы просмотрщика: старый путь против json_response.
+
+Запуск из корня репозитория, база не нужна:
+
+    python benchmarks/json_encoding.py --rows 100 --repeat 200
+
+Старый путь — replace_newlines, json.dumps(indent=4), json.loads и третья
+сериализация в JSONResponse. Новый — одна сериализация в байты (orjson, если
+установлен) с экранированием по байтам, отдельно замерен вариант с gzip.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Модули приложения читают настройки базы при импорте; соединение не открывается
+for name in ('DATABASE_USER', 'DATABASE_PASSWORD', 'DATABASE_HOST', 'DATABASE_NAME'):
+    os.environ.setdefault(name, 'benchmark')
+
+from starlette.responses import JSONResponse  # noqa: E402
+from event_meta import extract_event_meta  # noqa: E402
+from json_response import encode_json, escape_newlines, JSON_GZIP_LEVEL, orjson  # noqa: E402
+from routers.logs import flatten_page, replace_newlines  # noqa: E402
+from utils import default_serializer  # noqa: E402
+
+
+def fake_rows(count):
+    started = datetime.now(timezone.utc)
+    rows = []
+    for i in range(count):
+        headers = {'x-forwarded-for': '52.28.237.77', 'content-type': 'application/json', 'user-agent': 'casavi'}
+        body = {
+            'eventName': 'ticket_updated' if i % 2 else 'ticket_created',
+            'eventId': str(uuid.uuid4()),
+            'eventTimestamp': (started - timedelta(seconds=i)).isoformat(),
+            'isTriggeredViaApi': i % 2,
+            'payload': {
+                'ticketId': str(uuid.uuid4()),
+                'internalId': i,
+                'number': 1000 + i,
+                'title': 'Протечка в подъезде "А"',
+                'description': 'Первая строка\nвторая строка\nтретья строка ' * 5,
+            },
+        }
+        rows.append({
+            'id': i + 1,
+            'timestamp': started - timedelta(seconds=i),
+            'headers': headers,
+            'body': body,
+            'path_params': '{}',
+            'query_params': '{}',
+            **extract_event_meta(headers, body),
+        })
+    return rows
+
+
+def old_path(page):
+    processed = replace_newlines(page)
+    content = json.loads(json.dumps(processed, ensure_ascii=False, indent=4, default=default_serializer))
+    return JSONResponse(content).body
+
+
+def new_path(page):
+    return escape_newlines(encode_json(page))
+
+
+def new_path_gzip(page):
+    return gzip.compress(new_path(page), compresslevel=JSON_GZIP_LEVEL, mtime=0)
+
+
+def measure(fn, page, repeat):
+    fn(page)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        body = fn(page)
+    return (time.perf_counter() - started) / repeat, len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100, help='строк на странице')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    page = flatten_page(fake_rows(args.rows))
+    assert json.loads(old_path(page)) == json.loads(new_path(page))
+
+    print(f"encoder: {'orjson' if orjson is not None else 'json'}, rows={args.rows}")
+    baseline = None
+    for name, fn in (('old', old_path), ('new', new_path), ('new+gzip', new_path_gzip)):
+        seconds, size = measure(fn, page, args.repeat)
+        baseline = baseline or seconds
+        print(f"{name:9} {seconds * 1000:8.2f}ms/page {size:9} bytes  x{baseline / seconds:5.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Микробенчмарки горячих функций просмотрщика и приёма: разбор строк, сортировка колонок, сериализация, тело вебхука.
+
+Запуск из корня репозитория, база не нужна:
+
+    python benchmarks/micro.py --rows 100 --repeat 300 --output micro.json
+
+Каждый замер — одна страница из --rows строк; rps здесь — страниц в секунду.
+Строки — смесь событий CASAVI, половина с полями event_meta, половина без.
+Кейсы ingest_* берут закодированную страницу как одно большое тело вебхука:
+прежний путь (json.loads и обратная сериализация в jsonb) против body_capture
+(разбор для полей события и сжатие исходных байтов).
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Модули приложения читают настройки базы при импорте; соединение не открывается
+for name in ('DATABASE_USER', 'DATABASE_PASSWORD', 'DATABASE_HOST', 'DATABASE_NAME'):
+    os.environ.setdefault(name, 'benchmark')
+
+from common import report, save_results, summarize  # noqa: E402
+from body_capture import body_capture, parse_json, row_body  # noqa: E402
+from event_meta import extract_event_meta  # noqa: E402
+from flattening import flatten_rows, page_columns  # noqa: E402
+from json_response import encode_json, escape_newlines, JSON_GZIP_LEVEL  # noqa: E402
+from payloads import casavi_event  # noqa: E402
+from routers.logs import flatDbAnswerItem, flatten_page, sort_result_item, columnar_page  # noqa: E402
+
+
+def fake_rows(count, seed):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    rows = []
+    for i in range(count):
+        moment = now - timedelta(seconds=i)
+        headers, body = casavi_event(rng, moment=moment)
+        row = {
+            'id': count - i,
+            'timestamp': moment,
+            'httpmethod': 'POST',
+            'headers': headers,
+            'body': body,
+            'path_params': '{}',
+            'query_params': '{}',
+        }
+        if i % 2:
+            row.update(extract_event_meta(headers, body))
+        rows.append(row)
+    return rows
+
+
+def measure(fn, repeat):
+    fn()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        call_started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, 0, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100, help='строк на странице')
+    parser.add_argument('--repeat', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='JSON-файл с результатами для compare.py')
+    args = parser.parse_args()
+
+    rows = fake_rows(args.rows, args.seed)
+    flat = flatten_rows(rows)
+    page = flatten_page(rows)
+    encoded = encode_json(page)
+    raw_row = {'raw_body': body_capture.compress(encoded), 'body_encoding': body_capture.compression}
+    print(f"ingest body: {len(encoded)} bytes, jsonb text {len(json.dumps(json.loads(encoded)))}, "
+          f"raw_body {len(raw_row['raw_body'])} ({body_capture.compression})")
+
+    cases = {
+        'flatDbAnswerItem': lambda: [flatDbAnswerItem(row) for row in rows],
+        'flatten_rows': lambda: flatten_rows(rows),
+        'page_columns': lambda: page_columns(flat),
+        # sort_result_item меняет словарь на месте, поэтому сортируем копии
+        'sort_result_item': lambda: [sort_result_item(dict(item)) for item in flat],
+        'flatten_page': lambda: flatten_page(rows),
+        'columnar_page': lambda: columnar_page(flat),
+        'encode_json': lambda: encode_json(page),
+        'escape_newlines': lambda: escape_newlines(encoded),
+        'gzip': lambda: gzip.compress(encoded, compresslevel=JSON_GZIP_LEVEL, mtime=0),
+        'ingest_json_body': lambda: json.dumps(json.loads(encoded)),
+        'ingest_raw_body': lambda: (parse_json(encoded), body_capture.compress(encoded)),
+        'read_raw_body': lambda: row_body(raw_row),
+    }
+    results = {}
+    for name, fn in cases.items():
+        results[name] = measure(fn, args.repeat)
+        report(name, results[name])
+    save_results(args.output, 'micro', results, vars(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Вебхуки CASAVI, похожие на настоящие: общий источник для нагрузки, сидинга базы и микробенчмарков."""
+import random
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+CASAVI_HEADERS = {
+    'content-type': 'application/json',
+    'user-agent': 'casavi-webhooks/1.0',
+    'x-forwarded-for': '52.28.237.77',
+}
+
+# Доли событий примерно как в боевом трафике; первые четыре пересылаются в ELMA
+EVENT_MIX = [
+    ('ticket_updated', 45),
+    ('ticket_comment_created', 20),
+    ('ticket_created', 10),
+    ('ticket_comment_updated', 5),
+    ('document_downloaded', 10),
+    ('contact_updated', 10),
+]
+
+TITLES = ['Протечка в подъезде "А"', 'Не работает лифт', 'Шум от соседей', 'Замена счётчика', 'Уборка двора']
+STATES = ['open', 'in_progress', 'waiting', 'closed']
+
+
+def pick_event(rng: random.Random) -> str:
+    names, weights = zip(*EVENT_MIX)
+    return rng.choices(names, weights)[0]
+
+
+def casavi_event(rng: Optional[random.Random] = None, event_name: Optional[str] = None,
+                 moment: Optional[datetime] = None) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    """Заголовки и тело одного вебхука."""
+    rng = rng or random.Random()
+    event_name = event_name or pick_event(rng)
+    moment = moment or datetime.now(timezone.utc)
+    internal_id = rng.randint(1, 200000)
+    payload: Dict[str, Any] = {
+        'ticketId': str(uuid.UUID(int=rng.getrandbits(128))),
+        'internalId': internal_id,
+        'number': 100000 + internal_id,
+    }
+    if event_name.startswith('ticket_'):
+        payload.update(
+            title=rng.choice(TITLES),
+            state=rng.choice(STATES),
+            description='Первая строка\nвторая строка\n' * rng.randint(1, 10),
+            communityId=rng.randint(1, 500),
+            assignee={'id': rng.randint(1, 50), 'name': 'Иван Петров'},
+        )
+    if 'comment' in event_name:
+        payload['comment'] = {'id': rng.randint(1, 10 ** 6), 'text': 'Спасибо, приняли в работу.\n' * rng.randint(1, 3)}
+    if event_name == 'document_downloaded':
+        payload.update(documentId=rng.randint(1, 10 ** 6), fileName='protocol.pdf')
+    body = {
+        'eventName': event_name,
+        'eventId': str(uuid.UUID(int=rng.getrandbits(128))),
+        'eventTimestamp': moment.isoformat(),
+        'isTriggeredViaApi': rng.random() < 0.1,
+        'payload': payload,
+    }
+    return dict(CASAVI_HEADERS), body
@@ -0,0 +1,89 @@
+"""Заполняет базу миллионами строк logs для прогонов просмотрщика на реалистичном объёме.
+
+Запуск из корня репозитория против отдельной базы (настройки DATABASE_* как у сервиса):
+
+    python benchmarks/seed_logs.py --rows 2000000 --days 30
+
+Схема создаётся migrations.run, для секционированной logs заранее создаются
+партиции на весь диапазон. Строки пишутся через COPY пачками по --batch-size
+с возрастающим временем, как при обычной записи, и с заполненными полями
+event_meta, как у новых строк. В конце — ANALYZE.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncpg  # noqa: E402
+import migrations  # noqa: E402
+import partitions  # noqa: E402
+from database import URL_DATABASE, engine  # noqa: E402
+from event_meta import META_COLUMNS, extract_event_meta  # noqa: E402
+from payloads import casavi_event  # noqa: E402
+
+COLUMNS = ['timestamp', 'httpmethod', 'headers', 'body', 'path_params', 'query_params', *META_COLUMNS, 'meta_version']
+
+
+def make_batch(rng: random.Random, start: datetime, step: timedelta, first: int, count: int):
+    records = []
+    for i in range(first, first + count):
+        moment = start + step * i
+        headers, body = casavi_event(rng, moment=moment)
+        meta = extract_event_meta(headers, body)
+        records.append((
+            moment, 'POST', json.dumps(headers, ensure_ascii=False), json.dumps(body, ensure_ascii=False),
+            '{}', '{}', *(meta[column] for column in META_COLUMNS), meta['meta_version'],
+        ))
+    return records
+
+
+def prepare_schema(since: datetime):
+    migrations.run()
+    with engine.begin() as conn:
+        if partitions.is_partitioned(conn):
+            created = partitions.ensure_partitions(conn, partitions.LOG_PARTITION_INTERVAL,
+                                                   partitions.LOG_PARTITION_PREMAKE, since=since)
+            print(f"Created {len(created)} partitions")
+
+
+async def seed(args):
+    now = datetime.now(timezone.utc)
+    start = now - timedelta(days=args.days)
+    step = (now - start) / max(args.rows, 1)
+    prepare_schema(start)
+
+    rng = random.Random(args.seed)
+    conn = await asyncpg.connect(URL_DATABASE.render_as_string(hide_password=False))
+    try:
+        started = time.monotonic()
+        written = 0
+        while written < args.rows:
+            count = min(args.batch_size, args.rows - written)
+            records = make_batch(rng, start, step, written, count)
+            await conn.copy_records_to_table('logs', records=records, columns=COLUMNS)
+            written += count
+            elapsed = time.monotonic() - started
+            print(f"{written}/{args.rows} rows, {written / elapsed:.0f} rows/s")
+        await conn.execute('ANALYZE logs')
+    finally:
+        await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--days', type=float, default=30, help='на сколько дней назад растянуть строки')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(seed(args))
+
+
+if __name__ == '__main__':
+    main()
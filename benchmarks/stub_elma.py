@@ -0,0 +1,74 @@
+"""Локальная замена ELMA для нагрузочных прогонов: отвечает на скрипт расширения с заданной задержкой и долей ошибок.
+
+Запуск и направление пересылки сервиса на заглушку:
+
+    python benchmarks/stub_elma.py --port 9100 --latency-ms 80 --jitter-ms 40 --error-rate 0.02
+    FORWARD_DOMAINS=http://127.0.0.1:9100 uvicorn main:app
+
+GET /stats — сколько запросов пришло и сколько из них получили ошибку, по событиям.
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import uvicorn
+
+app = FastAPI()
+settings = argparse.Namespace(latency_ms=50.0, jitter_ms=0.0, error_rate=0.0, error_status=503, timeout_rate=0.0,
+                              timeout_s=30.0)
+received: Counter = Counter()
+failed: Counter = Counter()
+started = time.monotonic()
+
+
+@app.get('/stats')
+async def stats():
+    return {
+        'uptime_s': round(time.monotonic() - started, 1),
+        'received': sum(received.values()),
+        'failed': sum(failed.values()),
+        'by_event': dict(received),
+        'failed_by_event': dict(failed),
+        'settings': vars(settings),
+    }
+
+
+@app.api_route('/api/extensions/{extension}/script/{event}', methods=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'])
+async def script(extension: str, event: str, request: Request):
+    await request.body()
+    received[event] += 1
+    roll = random.random()
+    if roll < settings.timeout_rate:
+        # Зависший ответ: проверяет таймауты пула клиентов
+        failed[event] += 1
+        await asyncio.sleep(settings.timeout_s)
+        return JSONResponse(status_code=504, content={'success': False, 'error': 'stub timeout'})
+    delay = max(0.0, random.gauss(settings.latency_ms, settings.jitter_ms)) if settings.jitter_ms else settings.latency_ms
+    await asyncio.sleep(delay / 1000)
+    if roll < settings.timeout_rate + settings.error_rate:
+        failed[event] += 1
+        return JSONResponse(status_code=settings.error_status, content={'success': False, 'error': 'stub error'})
+    return {'success': True, 'event': event}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency-ms', type=float, default=50.0, help='средняя задержка ответа')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='стандартное отклонение задержки')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов с ошибкой, 0..1')
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='доля запросов, которые отвечают через --timeout-s')
+    parser.add_argument('--timeout-s', type=float, default=30.0)
+    args = parser.parse_args()
+    for name in vars(settings):
+        setattr(settings, name, getattr(args, name))
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Как throughput растёт с числом воркеров gunicorn: один и тот же прогон concurrent_load.py на 1, 2, 4... воркерах.
+
+Запуск из корня репозитория; база уже заполнена (seed_logs.py), заглушка
+ELMA поднята (stub_elma.py):
+
+    FORWARD_DOMAINS=http://127.0.0.1:9100 RATE_LIMIT_DOMAIN=100000/1 \\
+        python benchmarks/worker_scaling.py --workers 1,2,4,8 --duration 30 --output scaling.json
+
+Для каждого числа воркеров запускается gunicorn с gunicorn.conf.py, после
+прогона он останавливается через SIGTERM. В таблице — rps и задержки ingest
+и viewer и ускорение относительно первого варианта.
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from common import save_results
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+
+
+def wait_ready(url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f'{url}/x/stats/worker', timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} is not ready after {timeout}s")
+
+
+def run_once(args, workers: int):
+    url = f'http://127.0.0.1:{args.port}'
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', args.app, '-w', str(workers), '-b', f'127.0.0.1:{args.port}'],
+        cwd=root, env={**os.environ, 'ACCESS_LOG': ''},
+    )
+    try:
+        wait_ready(url, args.startup_timeout)
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            subprocess.run([
+                sys.executable, os.path.join(here, 'concurrent_load.py'), '--url', url,
+                '--duration', str(args.duration), '--ingest', str(args.ingest), '--viewers', str(args.viewers),
+                '--output', output.name,
+            ], check=True)
+            with open(output.name) as f:
+                return json.load(f)['results']
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', default='1,2,4', help='числа воркеров через запятую')
+    parser.add_argument('--app', default='main:app')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--ingest', type=int, default=50, help='параллельных отправителей вебхуков')
+    parser.add_argument('--viewers', type=int, default=10, help='параллельных клиентов просмотрщика')
+    parser.add_argument('--startup-timeout', type=float, default=60)
+    parser.add_argument('--output', help='JSON-файл с результатами для compare.py')
+    args = parser.parse_args()
+
+    runs = {}
+    for workers in [int(value) for value in args.workers.split(',')]:
+        runs[workers] = run_once(args, workers)
+
+    baseline = next(iter(runs.values()))
+    print(f"{'workers':>7} {'ingest rps':>11} {'p50':>9} {'p99':>9} {'viewer rps':>11} {'p50':>9} {'p99':>9} {'speedup':>8}")
+    for workers, results in runs.items():
+        ingest, viewer = results['ingest'], results['viewer']
+        speedup = ingest['rps'] / baseline['ingest']['rps'] if baseline['ingest']['rps'] else 0.0
+        print(f"{workers:7} {ingest['rps']:11.1f} {ingest['p50_ms']:8.1f}ms {ingest['p99_ms']:8.1f}ms "
+              f"{viewer['rps']:11.1f} {viewer['p50_ms']:8.1f}ms {viewer['p99_ms']:8.1f}ms {speedup:7.2f}x")
+
+    results = {f'{name}_w{workers}': result for workers, run in runs.items() for name, result in run.items()}
+    save_results(args.output, 'scaling', results, vars(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""Тело входящего вебхука: потоковое чтение с лимитом, сжатие больших тел, JSON по требованию.
+
+Тело читается из request.stream() до LOG_BODY_MAX_BYTES; что не влезло,
+отбрасывается, строка помечается body_truncated, и вебхук получает 413.
+Как тело попадает в logs:
+    JSON не больше LOG_BODY_COMPRESS_BYTES   в jsonb body, как раньше: ищется через @>
+    JSON больше порога, не JSON, обрезанное  исходные байты в raw_body, сжатые
+                                            (LOG_BODY_COMPRESSION: gzip или zstd),
+                                            если тело больше порога
+Поля события (event_meta) для всех строк извлекаются при записи, поэтому фильтры
+просмотрщика по eventName, ticketId и т.п. работают и для raw_body; поиск по
+содержимому тела (where, body_contains) — только по jsonb body. raw_body
+разжимается и разбирается только при чтении строки (row_body).
+"""
+import asyncio
+import base64
+import gzip
+import json
+import os
+from typing import Any, Dict, Optional, Tuple
+from fastapi import Request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+env = os.environ
+
+LOG_BODY_MAX_BYTES = int(env.get('LOG_BODY_MAX_BYTES', 10 * 1024 * 1024))
+# Тела больше порога сжимаются и хранятся в raw_body, а не в jsonb body
+LOG_BODY_COMPRESS_BYTES = int(env.get('LOG_BODY_COMPRESS_BYTES', 64 * 1024))
+LOG_BODY_COMPRESSION = env.get('LOG_BODY_COMPRESSION', 'gzip')
+# Низкий уровень: сжатие идёт на пути приёма, а JSON и так сжимается в разы
+LOG_BODY_COMPRESS_LEVEL = int(env.get('LOG_BODY_COMPRESS_LEVEL', 1))
+
+
+def parse_json(raw: bytes) -> Tuple[bool, Any]:
+    """(True, объект) для JSON, (False, None) для всего остального."""
+    try:
+        return True, orjson.loads(raw) if orjson is not None else json.loads(raw)
+    except ValueError:
+        return False, None
+
+
+def decompress(data: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == 'gzip':
+        return gzip.decompress(data)
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("raw_body is zstd-compressed, install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def row_body(row: Dict[str, Any]) -> Any:
+    """Тело строки logs: jsonb body или разобранное raw_body.
+
+    raw_body, которое не разбирается как JSON (не JSON или обрезанное), отдаётся
+    текстом, а не UTF-8 — словарём {"base64": ...}.
+    """
+    raw = row.get('raw_body')
+    if raw is None:
+        return row.get('body')
+    data = decompress(raw, row.get('body_encoding'))
+    is_json, parsed = parse_json(data)
+    if is_json:
+        return parsed
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return {'base64': base64.b64encode(data).decode()}
+
+
+class BodyCapture:
+    """Чтение тела вебхука и выбор, как его хранить; счётчики для /x/stats/body_capture."""
+
+    def __init__(self, max_bytes: int, compress_bytes: int, compression: str, level: int):
+        if compression == 'zstd' and zstandard is None:
+            print("LOG_BODY_COMPRESSION=zstd needs the zstandard package, using gzip")
+            compression = 'gzip'
+        self.max_bytes = max_bytes
+        self.compress_bytes = compress_bytes
+        self.compression = compression
+        self.level = level
+        self.bodies = 0
+        self.raw_bodies = 0
+        self.not_json = 0
+        self.truncated = 0
+        self.compressed_in = 0
+        self.compressed_out = 0
+
+    async def read(self, request: Request) -> Tuple[bytes, bool]:
+        """Байты тела не длиннее max_bytes и признак того, что тело было длиннее."""
+        chunks, size = [], 0
+        async for chunk in request.stream():
+            if size + len(chunk) > self.max_bytes:
+                chunks.append(chunk[:self.max_bytes - size])
+                return b''.join(chunks), True
+            chunks.append(chunk)
+            size += len(chunk)
+        return b''.join(chunks), False
+
+    def compress(self, raw: bytes) -> bytes:
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor(level=self.level).compress(raw)
+        return gzip.compress(raw, compresslevel=self.level, mtime=0)
+
+    async def columns(self, raw: bytes, is_json: bool, parsed: Any, truncated: bool) -> Dict[str, Any]:
+        """Колонки logs для тела: body для небольшого JSON, иначе raw_body."""
+        self.bodies += 1
+        if is_json and not truncated and len(raw) <= self.compress_bytes:
+            return {'body': parsed, 'body_size': len(raw)}
+        self.raw_bodies += 1
+        self.not_json += not is_json
+        self.truncated += truncated
+        encoding, data = None, raw
+        if len(raw) > self.compress_bytes:
+            # Сжатие больших тел не должно держать event loop
+            data = await asyncio.to_thread(self.compress, raw)
+            encoding = self.compression
+            self.compressed_in += len(raw)
+            self.compressed_out += len(data)
+        return {
+            'body': None,
+            'raw_body': data,
+            'body_encoding': encoding,
+            'body_size': len(raw),
+            'body_truncated': truncated or None,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'max_bytes': self.max_bytes,
+            'compress_bytes': self.compress_bytes,
+            'compression': self.compression,
+            'bodies': self.bodies,
+            'raw_bodies': self.raw_bodies,
+            'not_json': self.not_json,
+            'truncated': self.truncated,
+            'compressed_in': self.compressed_in,
+            'compressed_out': self.compressed_out,
+            'compression_ratio': round(self.compressed_in / self.compressed_out, 2) if self.compressed_out else None,
+        }
+
+
+body_capture = BodyCapture(
+    max_bytes=LOG_BODY_MAX_BYTES,
+    compress_bytes=LOG_BODY_COMPRESS_BYTES,
+    compression=LOG_BODY_COMPRESSION,
+    level=LOG_BODY_COMPRESS_LEVEL,
+)
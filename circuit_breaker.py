@@ -0,0 +1,254 @@
+"""Автомат защиты (circuit breaker) для каждого домена ELMA.
+
+Пока домен ELMA лежит или отвечает медленно, каждый вебхук ждал его до
+HTTP_CLIENT_TIMEOUT. Автомат считает по домену ошибки и задержку в скользящем
+окне BREAKER_WINDOW секунд и, когда домен явно нездоров, перестаёт его вызывать:
+
+    closed     запросы идут; в окне набралось BREAKER_MIN_REQUESTS запросов и доля
+               ошибок (сетевые, таймауты, 5xx, 429) >= BREAKER_ERROR_RATE или доля
+               медленных (дольше BREAKER_SLOW_MS) >= BREAKER_SLOW_RATE -> open
+    open       запросы к домену не отправляются BREAKER_OPEN_SECONDS секунд -> half_open
+    half_open  пропускается не больше BREAKER_HALF_OPEN_PROBES пробных запросов
+               одновременно; BREAKER_CLOSE_AFTER успешных подряд -> closed,
+               любая ошибка или медленный ответ -> снова open
+
+Что получает событие для открытого домена, задаёт BREAKER_OPEN_MODE:
+    fail   сразу ответ 503 для этого домена, остальные домены не ждут
+    defer  событие ставится в outbox и уйдёт, когда домен поправится (нужна база;
+           в FORWARD_MODE=outbox диспетчер откладывает строки открытого домена всегда)
+Состояние у каждого процесса своё, смотреть — /x/stats/breakers.
+"""
+import os
+import time
+from typing import Any, Dict, List, Optional
+from database import AsyncSessionLocal
+
+env = os.environ
+
+BREAKER_ENABLED = env.get('BREAKER_ENABLED', '1') == '1'
+BREAKER_WINDOW = float(env.get('BREAKER_WINDOW', 60))
+# Окно делится на корзины: запись O(1), старые корзины просто перезаписываются
+BREAKER_BUCKETS = int(env.get('BREAKER_BUCKETS', 12))
+BREAKER_MIN_REQUESTS = int(env.get('BREAKER_MIN_REQUESTS', 10))
+BREAKER_ERROR_RATE = float(env.get('BREAKER_ERROR_RATE', 0.5))
+BREAKER_SLOW_MS = float(env.get('BREAKER_SLOW_MS', 3000))
+BREAKER_SLOW_RATE = float(env.get('BREAKER_SLOW_RATE', 0.8))
+BREAKER_OPEN_SECONDS = float(env.get('BREAKER_OPEN_SECONDS', 30))
+BREAKER_HALF_OPEN_PROBES = int(env.get('BREAKER_HALF_OPEN_PROBES', 1))
+BREAKER_CLOSE_AFTER = int(env.get('BREAKER_CLOSE_AFTER', 2))
+BREAKER_OPEN_MODE = env.get('BREAKER_OPEN_MODE', 'fail')
+if BREAKER_OPEN_MODE == 'defer' and AsyncSessionLocal is None:
+    # Отложить событие для открытого домена некуда: сразу 503
+    print("BREAKER_OPEN_MODE=defer needs a database (LOG_STORAGE=memory), falling back to fail")
+    BREAKER_OPEN_MODE = 'fail'
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+def is_failure(status_code: Optional[int]) -> bool:
+    # 4xx кроме 429 — ошибка в самом событии, домен при этом жив
+    return status_code is None or status_code >= 500 or status_code == 429
+
+
+class RollingWindow:
+    """Счётчики запросов за последние window секунд, по корзинам фиксированной ширины."""
+
+    def __init__(self, window: float, buckets: int):
+        self.width = window / buckets
+        self.size = buckets
+        self._ids = [-1] * buckets
+        # [запросы, ошибки, медленные, сумма задержек, максимум задержки]
+        self._counts = [[0, 0, 0, 0.0, 0.0] for _ in range(buckets)]
+
+    def add(self, now: float, failed: bool, slow: bool, latency: float):
+        bucket_id = int(now / self.width)
+        slot = bucket_id % self.size
+        counts = self._counts[slot]
+        if self._ids[slot] != bucket_id:
+            self._ids[slot] = bucket_id
+            counts[:] = [0, 0, 0, 0.0, 0.0]
+        counts[0] += 1
+        counts[1] += failed
+        counts[2] += slow
+        counts[3] += latency
+        counts[4] = max(counts[4], latency)
+
+    def totals(self, now: float) -> Dict[str, Any]:
+        oldest = int(now / self.width) - self.size + 1
+        requests = errors = slow = 0
+        latency_total = latency_max = 0.0
+        for bucket_id, counts in zip(self._ids, self._counts):
+            if bucket_id < oldest:
+                continue
+            requests += counts[0]
+            errors += counts[1]
+            slow += counts[2]
+            latency_total += counts[3]
+            latency_max = max(latency_max, counts[4])
+        return {
+            'requests': requests,
+            'errors': errors,
+            'slow': slow,
+            'error_rate': round(errors / requests, 3) if requests else 0.0,
+            'slow_rate': round(slow / requests, 3) if requests else 0.0,
+            'latency_avg_ms': round(latency_total / requests * 1000, 1) if requests else None,
+            'latency_max_ms': round(latency_max * 1000, 1) if requests else None,
+        }
+
+    def clear(self):
+        self._ids = [-1] * self.size
+
+
+class Breaker:
+    """Автомат одного домена: allow() перед запросом, record() или cancel() после."""
+
+    def __init__(self, domain: str, registry: 'CircuitBreakers'):
+        self.domain = domain
+        self.registry = registry
+        self.window = RollingWindow(registry.window, registry.buckets)
+        self.state = CLOSED
+        self.opened_at: Optional[float] = None
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+        self.times_opened = 0
+        self.rejected = 0
+        self.last_error: Optional[str] = None
+
+    def retry_in(self, now: Optional[float] = None) -> float:
+        """Через сколько секунд открытый автомат начнёт пропускать пробы; 0 — уже пропускает."""
+        if self.state != OPEN:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.opened_at + self.registry.open_seconds - now)
+
+    def allow(self) -> bool:
+        if not self.registry.enabled:
+            return True
+        now = time.monotonic()
+        if self.state == OPEN:
+            if self.retry_in(now) > 0:
+                self.rejected += 1
+                return False
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self.probes_in_flight >= self.registry.half_open_probes:
+                self.rejected += 1
+                return False
+            self.probes_in_flight += 1
+        return True
+
+    def record(self, status_code: Optional[int], latency: float, error: Optional[str] = None):
+        """Итог запроса, пропущенного allow(); status_code None — сетевая ошибка или таймаут."""
+        if not self.registry.enabled:
+            return
+        now = time.monotonic()
+        failed = is_failure(status_code)
+        slow = latency * 1000 >= self.registry.slow_ms
+        if failed:
+            self.last_error = error or f"HTTP {status_code}"
+        self.window.add(now, failed, slow, latency)
+        if self.state == HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+            if failed or slow:
+                self._open(now)
+                return
+            self.probe_successes += 1
+            if self.probe_successes >= self.registry.close_after:
+                self._set_state(CLOSED)
+                # Старые ошибки не должны сразу открыть автомат снова
+                self.window.clear()
+            return
+        if self.state == CLOSED:
+            totals = self.window.totals(now)
+            if totals['requests'] < self.registry.min_requests:
+                return
+            if totals['error_rate'] >= self.registry.error_rate or totals['slow_rate'] >= self.registry.slow_rate:
+                self._open(now)
+
+    def cancel(self):
+        # Запрос отменён до ответа (остановка процесса): пробу не засчитываем
+        if self.state == HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+
+    def _open(self, now: float):
+        self.opened_at = now
+        self.times_opened += 1
+        self._set_state(OPEN)
+
+    def _set_state(self, state: str):
+        print(f"Circuit breaker {self.domain}: {self.state} -> {state}")
+        self.state = state
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            'state': self.state,
+            'retry_in': round(self.retry_in(now), 1),
+            'window': self.window.totals(now),
+            'times_opened': self.times_opened,
+            'rejected': self.rejected,
+            'probes_in_flight': self.probes_in_flight,
+            'last_error': self.last_error,
+        }
+
+
+class CircuitBreakers:
+    """Автоматы по доменам, создаются при первом обращении к домену."""
+
+    def __init__(self, enabled: bool, window: float, buckets: int, min_requests: int, error_rate: float,
+                 slow_ms: float, slow_rate: float, open_seconds: float, half_open_probes: int,
+                 close_after: int, open_mode: str):
+        if open_mode not in ('fail', 'defer'):
+            raise ValueError(f"Unknown BREAKER_OPEN_MODE: {open_mode}, expected fail or defer")
+        self.enabled = enabled
+        self.window = window
+        self.buckets = buckets
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.slow_ms = slow_ms
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.close_after = close_after
+        self.open_mode = open_mode
+        self._breakers: Dict[str, Breaker] = {}
+
+    def get(self, domain: str) -> Breaker:
+        breaker = self._breakers.get(domain)
+        if breaker is None:
+            breaker = self._breakers[domain] = Breaker(domain, self)
+        return breaker
+
+    def open_domains(self) -> List[str]:
+        return [domain for domain, breaker in self._breakers.items() if breaker.retry_in() > 0]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'open_mode': self.open_mode,
+            'window': self.window,
+            'min_requests': self.min_requests,
+            'error_rate': self.error_rate,
+            'slow_ms': self.slow_ms,
+            'slow_rate': self.slow_rate,
+            'open_seconds': self.open_seconds,
+            'domains': {domain: breaker.stats() for domain, breaker in self._breakers.items()},
+        }
+
+
+# Один набор на процесс
+breakers = CircuitBreakers(
+    enabled=BREAKER_ENABLED,
+    window=BREAKER_WINDOW,
+    buckets=BREAKER_BUCKETS,
+    min_requests=BREAKER_MIN_REQUESTS,
+    error_rate=BREAKER_ERROR_RATE,
+    slow_ms=BREAKER_SLOW_MS,
+    slow_rate=BREAKER_SLOW_RATE,
+    open_seconds=BREAKER_OPEN_SECONDS,
+    half_open_probes=BREAKER_HALF_OPEN_PROBES,
+    close_after=BREAKER_CLOSE_AFTER,
+    open_mode=BREAKER_OPEN_MODE,
+)
@@ -1,16 +1,211 @@
-from sqlalchemy.orm import Session
-import models, schemas
-
-def get_logs(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Logs).offset(skip).limit(limit).all()
-
-def create_log(db: Session, log: schemas.LogCreate):
-    db_log = models.Logs(**log.dict())
-    db.add(db_log)
-    db.commit()
-    db.refresh(db_log)
-    return db_log
-
-def delete_logs(db: Session):
-    db.query(models.Logs).delete()
-    db.commit()
+import asyncio
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import insert, update, delete, select, func, or_, and_
+from sqlalchemy.dialects import postgresql, sqlite
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional
+import models
+
+async def create_logs(db: AsyncSession, rows: List[Dict[str, Any]]) -> List[int]:
+    # Один multi-row INSERT на всю пачку
+    ids = await db.scalars(
+        insert(models.Logs).returning(models.Logs.id, sort_by_parameter_order=True),
+        rows,
+    )
+    ids = ids.all()
+    await db.commit()
+    return list(ids)
+
+async def notify(db: AsyncSession, channel: str, payloads: List[str]):
+    for payload in payloads:
+        await db.execute(select(func.pg_notify(channel, payload)))
+    await db.commit()
+
+async def delete_logs(db: AsyncSession, *criteria: Any, batch_size: int = 5000, sleep: float = 0.05) -> int:
+    # Пачками по id с паузами: короткие транзакции вместо одного DELETE на всю таблицу
+    deleted = 0
+    while True:
+        batch = select(models.Logs.id).where(*criteria).limit(batch_size)
+        result = await db.execute(
+            delete(models.Logs).where(models.Logs.id.in_(batch)).execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+        await asyncio.sleep(sleep)
+
+async def get_log_rows(db: AsyncSession, *criteria: Any, order_desc: bool = True,
+                       limit: int = None, offset: int = None) -> List[Dict[str, Any]]:
+    # Строки логов как словари колонка -> значение
+    columns = models.Logs.__table__.columns
+    order = models.Logs.id.desc() if order_desc else models.Logs.id.asc()
+    query = select(*columns).where(*criteria).order_by(order)
+    if offset:
+        query = query.offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
+    result = await db.execute(query)
+    return [dict(row) for row in result.mappings().all()]
+
+async def stream_log_rows(db: AsyncSession, *criteria: Any, order_desc: bool = False,
+                          batch_size: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+    # Серверный курсор: в памяти держим не больше одной пачки строк
+    columns = models.Logs.__table__.columns
+    order = models.Logs.id.desc() if order_desc else models.Logs.id.asc()
+    query = select(*columns).where(*criteria).order_by(order).execution_options(yield_per=batch_size)
+    result = await db.stream(query)
+    async for partition in result.mappings().partitions():
+        yield [dict(row) for row in partition]
+
+# Поля просмотрщика -> колонки Logs, заполненные при записи
+FILTER_COLUMNS = {
+    'eventName': models.Logs.event_name,
+    'eventId': models.Logs.event_id,
+    'eventTimestamp': models.Logs.event_timestamp,
+    'ticketId': models.Logs.ticket_id,
+    'internalId': models.Logs.internal_id,
+    'number': models.Logs.number,
+    'isTriggeredViaApi': models.Logs.is_triggered_via_api,
+    'domain': models.Logs.domain,
+    'ip': models.Logs.ip,
+}
+
+def log_filters(fields: Dict[str, str] = None, body_contains: Any = None, headers_contains: Any = None,
+                start: datetime = None, end: datetime = None, min_id: int = None, max_id: int = None) -> List[Any]:
+    # Условия для поиска по логам, всё считается на стороне Postgres; границы id включительные,
+    # время — [start, end), как у partitions.purge_logs
+    criteria = [FILTER_COLUMNS[name] == value for name, value in (fields or {}).items()]
+    if min_id is not None:
+        criteria.append(models.Logs.id >= min_id)
+    if max_id is not None:
+        criteria.append(models.Logs.id <= max_id)
+    if body_contains:
+        criteria.append(models.Logs.body.contains(body_contains))
+    if headers_contains:
+        criteria.append(models.Logs.headers.contains(headers_contains))
+    if start is not None:
+        criteria.append(models.Logs.timestamp >= start)
+    if end is not None:
+        criteria.append(models.Logs.timestamp < end)
+    return criteria
+
+def json_contains(document: Any, pattern: Any) -> bool:
+    """Python-аналог jsonb @>: каждый ключ и элемент pattern есть в document."""
+    if isinstance(pattern, dict):
+        return isinstance(document, dict) and all(
+            key in document and json_contains(document[key], value) for key, value in pattern.items()
+        )
+    if isinstance(pattern, list):
+        return isinstance(document, list) and all(
+            any(json_contains(item, value) for item in document) for value in pattern
+        )
+    return document == pattern
+
+def row_matches(row: Dict[str, Any], filters: Dict[str, Any]) -> bool:
+    """Те же условия, что log_filters строит для SQL, но для строки в памяти (сегмент архива, MemoryLogStore)."""
+    if filters.get('min_id') is not None and row['id'] < filters['min_id']:
+        return False
+    if filters.get('max_id') is not None and row['id'] > filters['max_id']:
+        return False
+    timestamp = row.get('timestamp')
+    if filters.get('start') is not None and (timestamp is None or timestamp < filters['start']):
+        return False
+    if filters.get('end') is not None and (timestamp is None or timestamp >= filters['end']):
+        return False
+    for name, value in (filters.get('fields') or {}).items():
+        if row.get(FILTER_COLUMNS[name].key) != value:
+            return False
+    if filters.get('body_contains') and not json_contains(row.get('body'), filters['body_contains']):
+        return False
+    if filters.get('headers_contains') and not json_contains(row.get('headers'), filters['headers_contains']):
+        return False
+    return True
+
+async def claim_ingest_key(db: AsyncSession, key: str) -> bool:
+    # Вставка уже существующего ключа ничего не делает; True — ключ заняли мы
+    dialect_insert = postgresql.insert if db.bind.dialect.name == 'postgresql' else sqlite.insert
+    result = await db.execute(
+        dialect_insert(models.IngestKey)
+        .values(key=key, created_at=datetime.now(timezone.utc))
+        .on_conflict_do_nothing(index_elements=['key'])
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+async def get_ingest_key(db: AsyncSession, key: str) -> Optional[Dict[str, Any]]:
+    result = await db.execute(select(*models.IngestKey.__table__.columns).where(models.IngestKey.key == key))
+    row = result.mappings().first()
+    return dict(row) if row is not None else None
+
+async def take_over_ingest_key(db: AsyncSession, key: str, before: datetime) -> bool:
+    # Ключ без ответа, занятый раньше before, переходит нам; из конкурентов его получит один
+    result = await db.execute(
+        update(models.IngestKey)
+        .where(models.IngestKey.key == key, models.IngestKey.status_code.is_(None), models.IngestKey.created_at < before)
+        .values(created_at=datetime.now(timezone.utc))
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+async def finish_ingest_key(db: AsyncSession, key: str, **values: Any):
+    await db.execute(update(models.IngestKey).where(models.IngestKey.key == key).values(**values))
+    await db.commit()
+
+async def delete_ingest_keys(db: AsyncSession, *criteria: Any) -> int:
+    result = await db.execute(delete(models.IngestKey).where(*criteria))
+    await db.commit()
+    return result.rowcount
+
+async def create_outbox_entries(db: AsyncSession, entries: List[Dict[str, Any]]) -> List[int]:
+    ids = await db.scalars(
+        insert(models.Outbox).returning(models.Outbox.id, sort_by_parameter_order=True),
+        entries,
+    )
+    ids = ids.all()
+    await db.commit()
+    return list(ids)
+
+async def claim_outbox(db: AsyncSession, limit: int, lease_seconds: float, exclude_domains: List[str]) -> List[Dict[str, Any]]:
+    # Забираем готовые к отправке строки и строки с просроченной арендой (упавший воркер)
+    Outbox = models.Outbox
+    now = datetime.now(timezone.utc)
+    ready = select(Outbox.id) \
+        .where(or_(
+            and_(Outbox.status == 'pending', Outbox.next_attempt_at <= now),
+            and_(Outbox.status == 'in_flight', Outbox.locked_until < now),
+        ))
+    if exclude_domains:
+        ready = ready.where(Outbox.domain.notin_(exclude_domains))
+    ready = ready.order_by(Outbox.next_attempt_at, Outbox.id) \
+        .limit(limit) \
+        .with_for_update(skip_locked=True)
+
+    result = await db.execute(
+        update(Outbox)
+        .where(Outbox.id.in_(ready.scalar_subquery()))
+        .values(status='in_flight', locked_until=now + timedelta(seconds=lease_seconds))
+        .returning(*Outbox.__table__.columns)
+    )
+    rows = result.mappings().all()
+    await db.commit()
+    return [dict(row) for row in rows]
+
+async def finish_outbox(db: AsyncSession, outbox_id: int, **values: Any):
+    await db.execute(update(models.Outbox).where(models.Outbox.id == outbox_id).values(locked_until=None, **values))
+    await db.commit()
+
+async def recover_outbox(db: AsyncSession) -> int:
+    # После рестарта возвращаем в очередь строки, аренда которых уже истекла
+    Outbox = models.Outbox
+    result = await db.execute(
+        update(Outbox)
+        .where(Outbox.status == 'in_flight', Outbox.locked_until < datetime.now(timezone.utc))
+        .values(status='pending', locked_until=None)
+    )
+    await db.commit()
+    return result.rowcount
+
+async def outbox_status_counts(db: AsyncSession) -> Dict[str, int]:
+    result = await db.execute(select(models.Outbox.status, func.count()).group_by(models.Outbox.status))
+    return {status: count for status, count in result.all()}
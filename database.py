@@ -1,6 +1,7 @@
 import os
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.engine import URL
 from dotenv import load_dotenv
@@ -9,20 +10,53 @@ from dotenv import load_dotenv
 load_dotenv()
 
 env = os.environ
-connect_kwargs = dict(
-    username=env['DATABASE_USER'],
-    password=env['DATABASE_PASSWORD'],
-    host=env['DATABASE_HOST'],
-    database=env['DATABASE_NAME'],
-)
-if 'DATABASE_PORT' in env:
-    connect_kwargs['port'] = env['DATABASE_PORT']
-
-URL_DATABASE = URL.create(
-    'postgresql',
-    **connect_kwargs
-)
-
-engine = create_engine(URL_DATABASE, pool_pre_ping=True, pool_recycle=300)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Где хранятся логи: postgres — боевой режим; sqlite — файл SQLITE_PATH (по
+# умолчанию test.db в репозитории); memory — кольцевой буфер в памяти процесса
+# без базы (storage.MemoryLogStore), движков тогда нет
+LOG_STORAGE = env.get('LOG_STORAGE', 'postgres')
+SQLITE_PATH = env.get('SQLITE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test.db'))
+
+if LOG_STORAGE == 'postgres':
+    connect_kwargs = dict(
+        username=env['DATABASE_USER'],
+        password=env['DATABASE_PASSWORD'],
+        host=env['DATABASE_HOST'],
+        database=env['DATABASE_NAME'],
+    )
+    if 'DATABASE_PORT' in env:
+        connect_kwargs['port'] = env['DATABASE_PORT']
+
+    # Настройки пула соединений асинхронного движка
+    pool_kwargs = dict(
+        pool_size=int(env.get('DATABASE_POOL_SIZE', 10)),
+        max_overflow=int(env.get('DATABASE_MAX_OVERFLOW', 10)),
+        pool_timeout=float(env.get('DATABASE_POOL_TIMEOUT', 30)),
+    )
+
+    URL_DATABASE = URL.create(
+        'postgresql',
+        **connect_kwargs
+    )
+    ASYNC_URL_DATABASE = URL_DATABASE.set(drivername='postgresql+asyncpg')
+elif LOG_STORAGE == 'sqlite':
+    pool_kwargs = {}
+    URL_DATABASE = URL.create('sqlite', database=SQLITE_PATH)
+    ASYNC_URL_DATABASE = URL_DATABASE.set(drivername='sqlite+aiosqlite')
+elif LOG_STORAGE == 'memory':
+    URL_DATABASE = ASYNC_URL_DATABASE = None
+else:
+    raise ValueError(f"Unknown LOG_STORAGE: {LOG_STORAGE}")
+
+if URL_DATABASE is not None:
+    # Синхронный движок остаётся для создания схемы и служебных скриптов
+    engine = create_engine(URL_DATABASE, pool_pre_ping=True, pool_recycle=300)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    # Асинхронный движок для эндпоинтов и фоновых задач, не блокирует event loop
+    async_engine = create_async_engine(ASYNC_URL_DATABASE, pool_pre_ping=True, pool_recycle=300, **pool_kwargs)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+else:
+    engine = SessionLocal = async_engine = AsyncSessionLocal = None
+
 Base = declarative_base()
@@ -1,9 +0,0 @@
-from sqlalchemy.orm import Session
-from database import SessionLocal
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
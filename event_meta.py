@@ -0,0 +1,67 @@
+import json
+from typing import Any, Dict, Optional
+
+# Версия правил извлечения; строки со старой версией можно переизвлечь бэкфиллом
+META_VERSION = 1
+
+CASAVI_IP = "52.28.237.77"
+
+META_COLUMNS = [
+    'ip', 'domain', 'event_name', 'event_id', 'event_timestamp',
+    'ticket_id', 'internal_id', 'number', 'is_triggered_via_api',
+]
+
+
+def _text(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def extract_event_meta(headers: Any, body: Any) -> Dict[str, Any]:
+    """Достаёт из заголовков и тела поля, которые просмотрщик показывает в отдельных колонках.
+
+    Правила те же, что в flattening.flatten_row; headers и body могут быть как
+    словарями, так и JSON-строками из базы.
+    """
+    if isinstance(headers, str):
+        try:
+            headers = json.loads(headers)
+        except json.JSONDecodeError:
+            headers = {}
+    if not isinstance(headers, dict):
+        headers = {}
+    if isinstance(body, str):
+        try:
+            body = json.loads(body)
+        except json.JSONDecodeError:
+            body = None
+
+    ip = headers.get('x-forwarded-for')
+    domain = headers.get('x-origin-domain')
+    if not domain and ip == CASAVI_IP:
+        domain = "CASAVI"
+
+    meta = dict.fromkeys(META_COLUMNS)
+    meta.update(ip=_text(ip), domain=_text(domain), meta_version=META_VERSION)
+
+    if isinstance(body, dict):
+        payload = body.get('payload')
+        payload = payload if isinstance(payload, dict) else {}
+        is_triggered_via_api = body.get('isTriggeredViaApi')
+        try:
+            is_triggered_via_api = None if is_triggered_via_api is None else str(int(is_triggered_via_api))
+        except (TypeError, ValueError):
+            is_triggered_via_api = _text(is_triggered_via_api)
+        meta.update(
+            event_name=_text(body.get('eventName')),
+            event_id=_text(body.get('eventId')),
+            event_timestamp=_text(body.get('eventTimestamp')),
+            ticket_id=_text(payload.get('ticketId')),
+            internal_id=_text(payload.get('internalId')),
+            number=_text(payload.get('number')),
+            is_triggered_via_api=is_triggered_via_api,
+        )
+    return meta
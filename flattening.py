@@ -0,0 +1,220 @@
+"""Плоские строки просмотрщика из строк logs.
+
+Общие поля (id, ip, domain, eventName, ...) одинаковы для всех событий, а
+различия между типами событий описаны таблицей EVENT_SPECS: раскладывать ли
+тело в колонки body_*, и какие поля строки собрать в second_level. Каждая
+спецификация один раз компилируется в функцию; неизвестные eventName и строки
+с телом не-объектом идут через DEFAULT_SPEC.
+
+Набор колонок строки зависит только от eventName и ключей тела, поэтому
+схема кэшируется по этой паре, и строка-заголовок страницы собирается из
+нескольких различных схем, а не из ключей каждой строки.
+"""
+import json
+import logging
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+from body_capture import row_body
+from event_meta import CASAVI_IP
+from utils import format_timestamp
+
+# Колонки, которые есть у каждой плоской строки
+BASE_COLUMNS = (
+    'id', 'ip', 'domain', 'eventName', 'timestamp', 'eventTimestamp', 'column_names', 'body_json',
+    'eventId', 'ticketId', 'internalId', 'number', 'headers', 'isTriggeredViaApi',
+)
+
+NOT_FOUND_HEADERS = {"x-origin-domain": "Not found domain", "x-forwarded-for": "Not found id"}
+
+# Сколько различных схем (eventName + ключи тела) держать в кэше
+SCHEMA_CACHE_MAX = 10000
+
+
+class EventSpec:
+    """Что добавить к общим полям для событий одного типа."""
+    __slots__ = ('body_prefix', 'second_level')
+
+    def __init__(self, body_prefix: bool = True, second_level: Tuple[str, ...] = ()):
+        self.body_prefix = body_prefix
+        self.second_level = second_level
+
+
+DEFAULT_SPEC = EventSpec(body_prefix=True)
+
+EVENT_SPECS = {
+    'ticket_updated': EventSpec(body_prefix=False),
+    'ticket_comment_created': EventSpec(body_prefix=False),
+    'ELMA_event_ticket update': EventSpec(body_prefix=True, second_level=('headers', 'query_params')),
+    'ticket_created': EventSpec(body_prefix=True, second_level=('headers', 'query_params')),
+    'document_downloaded': EventSpec(body_prefix=True),
+}
+
+Extractor = Callable[[Dict[str, Any], Dict[str, Any], Any], None]
+
+
+def compile_extractor(spec: EventSpec) -> Extractor:
+    """Функция (строка базы, результат, разобранное тело), дописывающая поля события в результат."""
+    steps: List[Extractor] = []
+    if spec.body_prefix:
+        def prefix_body(item, result, body):
+            if isinstance(body, dict):
+                for key, value in body.items():
+                    result[f"body_{key}"] = value
+        steps.append(prefix_body)
+    if spec.second_level:
+        fields = spec.second_level
+
+        def second_level(item, result, body):
+            result['second_level'] = {key: item[key] for key in fields if key in item}
+        steps.append(second_level)
+
+    if not steps:
+        return lambda item, result, body: None
+    if len(steps) == 1:
+        return steps[0]
+
+    def extract(item, result, body):
+        for step in steps:
+            step(item, result, body)
+    return extract
+
+
+EXTRACTORS = {event_name: compile_extractor(spec) for event_name, spec in EVENT_SPECS.items()}
+DEFAULT_EXTRACTOR = compile_extractor(DEFAULT_SPEC)
+
+
+def _parse_json(value: Any, default: Any) -> Any:
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            return default
+    return value
+
+
+def _from_payload(payload: Any, key: str) -> Any:
+    # Как прежнее `payload and payload.get(key)`, но без падения на payload не-объекте
+    if not payload:
+        return payload
+    return payload.get(key) if isinstance(payload, dict) else None
+
+
+def _triggered_via_api(value: Any) -> str:
+    if value is None:
+        return 'None'
+    try:
+        return str(int(value))
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def flatten_row(item: Dict[str, Any], column_names: Optional[str] = None) -> Dict[str, Any]:
+    """Одна строка logs -> плоский словарь просмотрщика; item не изменяется."""
+    # Большие и не-JSON тела лежат в raw_body и разбираются только здесь
+    body = row_body(item) if item.get('raw_body') is not None else item.get('body', 'Not found body')
+    if isinstance(body, str):
+        body_json = _parse_json(body, body)
+    elif body is not None:
+        body_json = body
+    else:
+        body_json = {}
+
+    # Для строк с извлечёнными при записи полями заголовки и тело не разбираем
+    if item.get('meta_version'):
+        ip = item.get('ip')
+        domain = item.get('domain')
+        event_name = item.get('event_name')
+        event_timestamp = item.get('event_timestamp')
+        event_id = item.get('event_id')
+        is_triggered_via_api = item.get('is_triggered_via_api') or 'None'
+        internal_id = item.get('internal_id')
+        number = item.get('number')
+        ticket_id = item.get('ticket_id')
+    else:
+        headers = _parse_json(item.get('headers') or NOT_FOUND_HEADERS, {})
+        if not isinstance(headers, dict):
+            headers = {}
+        ip = headers.get('x-forwarded-for')
+        domain = headers.get('x-origin-domain')
+        if not domain and ip == CASAVI_IP:
+            domain = "CASAVI"
+        if isinstance(body_json, dict):
+            payload = body_json.get('payload')
+            event_name = body_json.get('eventName')
+            event_timestamp = body_json.get('eventTimestamp')
+            event_id = body_json.get('eventId')
+            is_triggered_via_api = _triggered_via_api(body_json.get('isTriggeredViaApi'))
+            internal_id = _from_payload(payload, 'internalId')
+            number = _from_payload(payload, 'number')
+            ticket_id = _from_payload(payload, 'ticketId')
+        else:
+            # Тело не JSON-объект: полей события нет, строка всё равно показывается
+            event_name = event_timestamp = event_id = internal_id = number = ticket_id = None
+            is_triggered_via_api = 'None'
+
+    result = {
+        'id': item.get('id', 'Not found'),
+        'ip': ip,
+        'domain': domain,
+        'eventName': event_name,
+        'timestamp': format_timestamp(item.get('timestamp', 'Not found')),
+        'eventTimestamp': event_timestamp,
+        'column_names': column_names if column_names is not None else str(item.keys()),
+        'body_json': body_json,
+        'eventId': event_id,
+        'ticketId': ticket_id,
+        'internalId': internal_id,
+        'number': number,
+        'headers': item.get('headers'),
+        'isTriggeredViaApi': is_triggered_via_api,
+    }
+    extractor = EXTRACTORS.get(event_name, DEFAULT_EXTRACTOR) if isinstance(event_name, str) else DEFAULT_EXTRACTOR
+    extractor(item, result, body_json)
+    return result
+
+
+def flatten_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Вся страница за один проход; column_names считается один раз на набор колонок."""
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    column_names_cache: Dict[Tuple[str, ...], str] = {}
+    result = []
+    for row in rows:
+        keys = tuple(row)
+        column_names = column_names_cache.get(keys)
+        if column_names is None:
+            column_names = column_names_cache[keys] = str(row.keys())
+        if debug:
+            logging.debug(f"Обработка item: {json.dumps(row, ensure_ascii=False, default=str)}")
+        result.append(flatten_row(row, column_names))
+    return result
+
+
+_schema_cache: Dict[Tuple[Any, Optional[Tuple[str, ...]]], FrozenSet[str]] = {}
+
+
+def item_schema(item: Dict[str, Any]) -> FrozenSet[str]:
+    """Колонки плоской строки по её eventName и ключам тела."""
+    body = item.get('body_json')
+    key = (item.get('eventName'), tuple(body) if isinstance(body, dict) else None)
+    try:
+        schema = _schema_cache.get(key)
+    except TypeError:
+        # eventName не строка (например, объект в теле) — схему не кэшируем
+        return frozenset(item)
+    if schema is None:
+        spec = EVENT_SPECS.get(key[0], DEFAULT_SPEC)
+        columns = set(BASE_COLUMNS)
+        if spec.body_prefix and key[1] is not None:
+            columns.update(f"body_{name}" for name in key[1])
+        if spec.second_level:
+            columns.add('second_level')
+        schema = frozenset(columns)
+        if len(_schema_cache) >= SCHEMA_CACHE_MAX:
+            _schema_cache.clear()
+        _schema_cache[key] = schema
+    return schema
+
+
+def page_columns(items: List[Dict[str, Any]]) -> FrozenSet[str]:
+    """Объединение колонок страницы: по различным схемам, а не по каждой строке."""
+    schemas = {item_schema(item) for item in items}
+    return frozenset().union(*schemas)
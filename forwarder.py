@@ -0,0 +1,150 @@
+import asyncio
+import time
+from typing import Any, Dict, List
+import httpx
+from circuit_breaker import breakers
+from rate_limiter import limiter
+from log_writer import log_writer, make_log_row, LOG_WRITER_ACK
+from http_client import client_pool
+
+ELMA_SCRIPT_PATH = "/api/extensions/22fe87c3-14fc-4c97-83dd-52ef65fa4644/script/"
+
+
+def elma_url(domain: str, elma_tail: str) -> str:
+    return f"{domain}{ELMA_SCRIPT_PATH}{elma_tail}"
+
+
+async def forward_to_domain(
+    domain: str,
+    method: str,
+    elma_tail: str,
+    headers_dict: Dict[str, str],
+    bodyObj: Dict[str, Any],
+    path_params: str,
+    query_params: Dict[str, str],
+    rate_limited: bool = True,
+) -> Dict[str, Any]:
+    """Пересылает событие в один домен ELMA и логирует запрос и ответ.
+
+    Ошибки не пробрасываются: сбой одного домена возвращается как response_data
+    со status_code 502, чтобы не мешать доставке в остальные домены. Пока автомат
+    домена открыт (circuit_breaker.py), запрос не отправляется: status_code 503
+    и circuit_open=True.
+    rate_limited=False — токен лимитера уже получен вызывающим (outbox).
+    """
+    url = elma_url(domain, elma_tail)
+    breaker = breakers.get(domain)
+    if not breaker.allow():
+        response_data = {
+            'payload': {
+                'textError': f"Circuit breaker for {domain} is open: {breaker.last_error}",
+                'retry_in': round(breaker.retry_in(), 1),
+            },
+            'status_code': 503,
+            'circuit_open': True,
+            'eventName': bodyObj['eventName'] + "_response",
+        }
+        # Запрос не отправлялся, в лог идёт только ответ-заглушка
+        await log_writer.write(
+            make_log_row(method, {'x-origin-domain': "res <- ELMA"}, response_data, path_params, query_params),
+            wait=LOG_WRITER_ACK,
+        )
+        return response_data
+    try:
+        if rate_limited:
+            # Ждём токен своего домена и события, остальные домены не блокируются
+            await limiter.acquire(domain=domain, event=elma_tail)
+        await log_writer.write(
+            make_log_row(method, headers_dict, bodyObj, path_params, query_params),
+            wait=LOG_WRITER_ACK,
+        )
+    except BaseException:
+        # Запрос так и не ушёл (отмена, ошибка записи лога): слот пробы возвращаем
+        breaker.cancel()
+        raise
+
+    response_headers: Dict[str, str] = {}
+    started = time.monotonic()
+    try:
+        try:
+            external_response = await client_pool.request(
+                domain,
+                method=method,
+                url=url,
+                headers=headers_dict,
+                json=bodyObj,
+            )
+        except httpx.RequestError as exc:
+            breaker.record(None, time.monotonic() - started, error=f"{type(exc).__name__}: {str(exc)}")
+            raise
+        except BaseException:
+            breaker.cancel()
+            raise
+        breaker.record(external_response.status_code, time.monotonic() - started)
+        response_headers = dict(external_response.headers)
+        status_code = external_response.status_code
+        response_data = {}
+        if not (200 <= status_code < 300):
+            response_data['payload'] = {
+                'textError': f"data:text/html,{external_response.text}",
+                'reqest': {
+                    'method': method,
+                    'url': url,
+                    'headers': headers_dict,
+                    'json': bodyObj
+                }
+            }
+        else:
+            response_data = external_response.json()
+            if not isinstance(response_data, dict):
+                response_data = {'payload': response_data}
+    except (httpx.RequestError, ValueError) as exc:
+        print(f"An error occurred while requesting {url!r}: {str(exc)}")
+        status_code = 502
+        response_data = {
+            'payload': {
+                'textError': f"Request to external service failed: {str(exc)}",
+                'reqest': {
+                    'method': method,
+                    'url': url,
+                    'headers': headers_dict,
+                    'json': bodyObj
+                }
+            }
+        }
+
+    response_data['status_code'] = status_code
+    response_data['eventName'] = bodyObj['eventName'] + "_response"
+    response_headers['x-origin-domain'] = "res <- ELMA"
+
+    await log_writer.write(
+        make_log_row(method, response_headers, response_data, path_params, query_params),
+        wait=LOG_WRITER_ACK,
+    )
+
+    print('Request and response logged')
+    print('response data: ', response_data)
+    return response_data
+
+
+async def fan_out(domains: List[str], **event: Any) -> List[Dict[str, Any]]:
+    """Параллельно пересылает событие во все домены, порядок ответов совпадает с domains.
+
+    Сбой пересылки в один домен (например, запись в лог) становится его ответом 502,
+    остальные домены получают событие и свой ответ как обычно.
+    """
+    results = await asyncio.gather(*[forward_to_domain(domain, **event) for domain in domains],
+                                   return_exceptions=True)
+    responses = []
+    for domain, result in zip(domains, results):
+        if isinstance(result, Exception):
+            print(f"Forwarding to {domain} failed: {str(result)}")
+            result = {
+                'payload': {'textError': f"Forwarding to {domain} failed: {str(result)}"},
+                'status_code': 502,
+                'eventName': event['bodyObj']['eventName'] + "_response",
+            }
+        elif isinstance(result, BaseException):
+            raise result
+        responses.append(result)
+    return responses
@@ -0,0 +1,88 @@
+"""Боевой запуск: gunicorn-мастер и N воркеров uvicorn.
+
+    gunicorn main:app            # конфиг ./gunicorn.conf.py подхватывается сам
+
+Число воркеров — WEB_CONCURRENCY, по умолчанию по числу доступных ядер с
+учётом квоты cgroup. Мастер следит за воркерами и перезапускает упавшие.
+    kill -HUP <master>   — плавная перезагрузка: новые воркеры с новым кодом,
+                           старые дорабатывают запросы и останавливаются
+    kill -TERM <master>  — плавная остановка: lifespan каждого воркера
+                           дописывает очередь логов, не дольше GRACEFUL_TIMEOUT
+
+Состояние, которое должно быть общим для воркеров, настраивается здесь до их
+запуска (значения из окружения не перезаписываются):
+    RATE_LIMIT_BACKEND   file — ведра лимитера в файлах, общие для машины
+    LIVE_TAIL_NOTIFY     1 — live-tail через LISTEN/NOTIFY, иначе подписчик
+                         видит только строки, принятые его воркером
+    LOG_ROW_CACHE_DISK   общий файл SQLite второго уровня кэша строк,
+                         свой на каждый запуск мастера
+LOG_STORAGE=memory работает только с одним воркером: логи живут в памяти процесса.
+Мастер к базе не ходит: схему готовят воркеры в фоне (SCHEMA_MODE=lazy,
+по очереди под advisory-блокировкой) или заранее python migrations.py.
+"""
+import os
+import tempfile
+
+env = os.environ
+
+
+def available_cpus() -> int:
+    """Ядра, которые процессу реально дают: affinity и квота cgroup v2 (cpu.max)."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus)
+
+
+bind = f"{env.get('HOST', '0.0.0.0')}:{env.get('PORT', '8000')}"
+workers = int(env.get('WEB_CONCURRENCY', available_cpus()))
+worker_class = 'uvicorn.workers.UvicornWorker'
+# Воркер, не отвечающий мастеру дольше timeout, перезапускается
+timeout = int(env.get('WORKER_TIMEOUT', 60))
+graceful_timeout = int(env.get('GRACEFUL_TIMEOUT', 30))
+keepalive = int(env.get('KEEPALIVE', 5))
+# Перезапуск воркера после N запросов страхует от утечек; 0 — выключено
+max_requests = int(env.get('MAX_REQUESTS', 0))
+max_requests_jitter = int(env.get('MAX_REQUESTS_JITTER', 0))
+accesslog = env.get('ACCESS_LOG', '-') or None
+errorlog = '-'
+proc_name = 'showhttpreq'
+
+# Файл кэша строк этого мастера; удаляется при остановке
+row_cache_path = os.path.join(tempfile.gettempdir(), f'showhttpreq-rows-{os.getpid()}.sqlite')
+
+
+def on_starting(server):
+    # Окружение мастера наследуют все воркеры, в том числе после HUP
+    count = server.cfg.workers
+    if count > 1:
+        env.setdefault('RATE_LIMIT_BACKEND', 'file')
+        env.setdefault('LIVE_TAIL_NOTIFY', '1')
+        if env.get('LOG_STORAGE') == 'memory':
+            # У каждого воркера свой кольцевой буфер с id от 1: логи не общие, а вебхук
+            # и запрос просмотрщика попадают в случайный воркер
+            raise RuntimeError(f"LOG_STORAGE=memory needs a single worker, got {count}: set WEB_CONCURRENCY=1")
+        env.setdefault('LOG_ROW_CACHE_DISK', row_cache_path)
+        if env['RATE_LIMIT_BACKEND'] == 'memory':
+            print(f"WARNING: RATE_LIMIT_BACKEND=memory with {count} workers: each worker gets its own limit")
+        if env['LIVE_TAIL_NOTIFY'] != '1':
+            print("WARNING: LIVE_TAIL_NOTIFY is off: live tail subscribers see only their worker's rows")
+    pool = int(env.get('DATABASE_POOL_SIZE', 10)) + int(env.get('DATABASE_MAX_OVERFLOW', 10))
+    print(f"Starting {count} workers on {server.cfg.bind}, up to {count * pool} database connections")
+
+
+def on_exit(server):
+    if env.get('LOG_ROW_CACHE_DISK') == row_cache_path:
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(row_cache_path + suffix)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,105 @@
+import os
+from typing import Any, Dict, Optional
+import httpx
+
+env = os.environ
+
+# Настройки пула соединений к ELMA
+HTTP_CLIENT_MAX_CONNECTIONS = int(env.get('HTTP_CLIENT_MAX_CONNECTIONS', 100))
+HTTP_CLIENT_MAX_KEEPALIVE = int(env.get('HTTP_CLIENT_MAX_KEEPALIVE', 20))
+HTTP_CLIENT_KEEPALIVE_EXPIRY = float(env.get('HTTP_CLIENT_KEEPALIVE_EXPIRY', 30))
+HTTP_CLIENT_TIMEOUT = float(env.get('HTTP_CLIENT_TIMEOUT', 5))
+HTTP_CLIENT_HTTP2 = env.get('HTTP_CLIENT_HTTP2', '0') == '1'
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class ClientPool:
+    """Долгоживущие httpx.AsyncClient, по одному на целевой домен.
+
+    Клиенты создаются лениво при первом запросе к домену и держат keep-alive
+    соединения до close(), поэтому TCP+TLS рукопожатие происходит один раз.
+    """
+
+    def __init__(self, limits: httpx.Limits, timeout: float, http2: bool = False):
+        self.limits = limits
+        self.timeout = timeout
+        self.http2 = http2
+        if http2 and not _http2_available():
+            print("HTTP/2 requested but 'h2' is not installed, falling back to HTTP/1.1")
+            self.http2 = False
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def client(self, domain: str) -> httpx.AsyncClient:
+        client = self._clients.get(domain)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                base_url=domain,
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=self.http2,
+            )
+            self._clients[domain] = client
+            self._stats.setdefault(domain, {'requests': 0, 'errors': 0, 'in_flight': 0})
+        return client
+
+    async def request(self, domain: str, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        client = self.client(domain)
+        stats = self._stats[domain]
+        stats['requests'] += 1
+        stats['in_flight'] += 1
+        try:
+            return await client.request(method, url, **kwargs)
+        except httpx.RequestError:
+            stats['errors'] += 1
+            raise
+        finally:
+            stats['in_flight'] -= 1
+
+    async def close(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        domains = {}
+        for domain, counters in self._stats.items():
+            domains[domain] = {**counters, **self._connection_stats(self._clients.get(domain))}
+        return {
+            'http2': self.http2,
+            'max_connections': self.limits.max_connections,
+            'max_keepalive_connections': self.limits.max_keepalive_connections,
+            'keepalive_expiry': self.limits.keepalive_expiry,
+            'domains': domains,
+        }
+
+    @staticmethod
+    def _connection_stats(client: Optional[httpx.AsyncClient]) -> Dict[str, int]:
+        # Только для /x/stats и без гарантий: httpx не отдаёт состояние пула
+        # публично, а внутренности httpcore меняются между версиями. Не вышло
+        # прочитать — полей connections нет, in_flight считает сам request()
+        try:
+            connections = list(client._transport._pool.connections)
+            idle = sum(1 for conn in connections if conn.is_idle())
+        except Exception:
+            return {}
+        return {'connections': len(connections), 'idle_connections': idle}
+
+
+# Один пул на процесс, закрывается в lifespan приложения
+client_pool = ClientPool(
+    limits=httpx.Limits(
+        max_connections=HTTP_CLIENT_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_CLIENT_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_CLIENT_KEEPALIVE_EXPIRY,
+    ),
+    timeout=HTTP_CLIENT_TIMEOUT,
+    http2=HTTP_CLIENT_HTTP2,
+)
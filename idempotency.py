@@ -0,0 +1,332 @@
+"""Идемпотентный приём: повторная доставка того же вебхука не пересылается в ELMA второй раз.
+
+CASAVI повторяет вебхук, если не дождалась ответа. Ключ события считает
+функция IDEMPOTENCY_KEY (по умолчанию eventId из тела; header:<имя> — значение
+заголовка; пусто — выключено). Первая доставка занимает ключ и обрабатывается
+как обычно, её ответ запоминается; если ни один домен ELMA событие не
+принял, ключ освобождается и повтор пересылается заново. Повторная получает тот же ответ (если он
+не больше IDEMPOTENCY_RESPONSE_MAX байт, иначе короткий ответ о дубликате) и
+пишется в logs со ссылкой duplicate_of на первую строку, без пересылки.
+
+Ключи проверяются в два уровня:
+    память   OrderedDict ключ -> запись на IDEMPOTENCY_TTL секунд, проверка O(1);
+             ловит повторы в том же процессе, в том числе пока первая доставка
+             ещё обрабатывается (повтор ждёт её ответа до IDEMPOTENCY_WAIT секунд);
+             не больше IDEMPOTENCY_CACHE_SIZE ключей и IDEMPOTENCY_CACHE_BYTES
+             байт сохранённых ответов, сверх — вытесняются самые старые
+    база     таблица ingest_keys с уникальным ключом: вставка ON CONFLICT DO NOTHING
+             решает, кто первый, между воркерами и после рестарта; строки старше
+             TTL удаляются фоновой задачей раз в IDEMPOTENCY_PURGE_INTERVAL секунд;
+             ключ без ответа старше IDEMPOTENCY_LEASE забирает следующая доставка;
+             вставка идёт параллельно с записью строки в logs (claim_cached, затем
+             claim_shared), строка ждёт её только перед сбросом пачки
+С LOG_STORAGE=memory базы нет, работает только память процесса.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+import os
+import crud
+import models
+from database import AsyncSessionLocal
+from json_response import encode_json
+
+env = os.environ
+
+IDEMPOTENCY_KEY = env.get('IDEMPOTENCY_KEY', 'eventId')
+IDEMPOTENCY_TTL = float(env.get('IDEMPOTENCY_TTL', 24 * 3600))
+IDEMPOTENCY_CACHE_SIZE = int(env.get('IDEMPOTENCY_CACHE_SIZE', 100000))
+# Сумма размеров ответов в памяти; без неё кэш мог дорасти до CACHE_SIZE * RESPONSE_MAX
+IDEMPOTENCY_CACHE_BYTES = int(env.get('IDEMPOTENCY_CACHE_BYTES', 64 * 1024 * 1024))
+IDEMPOTENCY_WAIT = float(env.get('IDEMPOTENCY_WAIT', 30))
+# Ответы больше этого не храним: повтор получит короткий ответ о дубликате
+IDEMPOTENCY_RESPONSE_MAX = int(env.get('IDEMPOTENCY_RESPONSE_MAX', 64 * 1024))
+IDEMPOTENCY_PURGE_INTERVAL = float(env.get('IDEMPOTENCY_PURGE_INTERVAL', 3600))
+# Ключ без ответа старше этого считается брошенным (воркер упал посреди обработки)
+# и достаётся следующей доставке
+IDEMPOTENCY_LEASE = float(env.get('IDEMPOTENCY_LEASE', 600))
+
+
+def _body_field(name: str) -> Callable[[Dict[str, str], Dict[str, Any]], Any]:
+    return lambda headers, body: body.get(name)
+
+
+def _joined(*parts: Callable[[Dict[str, str], Dict[str, Any]], Any]) -> Callable[[Dict[str, str], Dict[str, Any]], Any]:
+    # Ключ из нескольких полей; нет хотя бы одного — ключа нет
+    def key(headers, body):
+        values = [part(headers, body) for part in parts]
+        return None if any(value is None for value in values) else ':'.join(map(str, values))
+    return key
+
+
+KEY_FUNCTIONS = {
+    'eventId': _body_field('eventId'),
+    'eventName+eventId': _joined(_body_field('eventName'), _body_field('eventId')),
+    'domain+eventId': _joined(lambda headers, body: headers.get('x-origin-domain'), _body_field('eventId')),
+}
+
+
+def make_key_function(name: str) -> Optional[Callable[[Dict[str, str], Dict[str, Any]], Any]]:
+    if not name or name == 'off':
+        return None
+    if name.startswith('header:'):
+        header = name[len('header:'):].lower()
+        return lambda headers, body: headers.get(header)
+    if name not in KEY_FUNCTIONS:
+        raise ValueError(f"Unknown IDEMPOTENCY_KEY: {name}, expected one of {sorted(KEY_FUNCTIONS)} or header:<name>")
+    return KEY_FUNCTIONS[name]
+
+
+class Entry:
+    """Ключ, занятый первой доставкой, и её результат."""
+
+    __slots__ = ('key', 'expires', 'done', 'response', 'size', 'log_id', 'log_future', 'released')
+
+    def __init__(self, key: str, expires: float):
+        self.key = key
+        self.expires = expires
+        self.done = asyncio.Event()
+        # (status_code, content) ответа первой доставки; None — не сохранён
+        self.response: Optional[Tuple[int, Any]] = None
+        # Размер сохранённого ответа в JSON, учитывается в cache_bytes
+        self.size = 0
+        self.log_id: Optional[int] = None
+        self.log_future: Optional[asyncio.Future] = None
+        # Первая доставка не обработана, ключ освобождён
+        self.released = False
+
+
+class Idempotency:
+    def __init__(self, key_function, key_name: str, ttl: float, cache_size: int, cache_bytes: int,
+                 wait: float, response_max: int, purge_interval: float, lease: float, session_factory):
+        self.key_function = key_function
+        self.key_name = key_name
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.cache_bytes = cache_bytes
+        self.wait = wait
+        self.response_max = response_max
+        self.purge_interval = purge_interval
+        self.lease = lease
+        self.session_factory = session_factory
+        # TTL у всех записей один, поэтому порядок вставки — это и порядок истечения
+        self._cache: 'OrderedDict[str, Entry]' = OrderedDict()
+        self._cached_bytes = 0
+        self._pending: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.claimed = 0
+        self.duplicates = 0
+        self.cache_hits = 0
+        self.db_hits = 0
+        self.replayed = 0
+        self.released = 0
+        self.taken_over = 0
+        self.db_errors = 0
+        self.purged = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.key_function is not None
+
+    def key(self, headers: Dict[str, str], body: Dict[str, Any]) -> Optional[str]:
+        if self.key_function is None:
+            return None
+        value = self.key_function(headers, body)
+        return None if value is None or value == '' else str(value)
+
+    def _expire(self, now: float):
+        while self._cache:
+            entry = next(iter(self._cache.values()))
+            if entry.expires > now and len(self._cache) <= self.cache_size \
+                    and self._cached_bytes <= self.cache_bytes:
+                break
+            self._cache.popitem(last=False)
+            self._cached_bytes -= entry.size
+
+    async def claim(self, key: str) -> Tuple[bool, Entry]:
+        """(True, запись) — первая доставка: обработать и вызвать complete или release.
+        (False, запись) — повтор; ответ первой доставки — original_response(запись).
+        """
+        first, entry = self.claim_cached(key)
+        if first:
+            first = await self.claim_shared(entry)
+        return first, entry
+
+    def claim_cached(self, key: str) -> Tuple[bool, Entry]:
+        """Проверка по памяти процесса, без ожидания; (True, запись) ещё нужно подтвердить claim_shared."""
+        now = time.monotonic()
+        self._expire(now)
+        entry = self._cache.get(key)
+        if entry is not None:
+            self.duplicates += 1
+            self.cache_hits += 1
+            return False, entry
+        # Запись в памяти появляется до похода в базу: параллельный повтор в этом процессе её уже увидит
+        entry = self._cache[key] = Entry(key, now + self.ttl)
+        return True, entry
+
+    async def claim_shared(self, entry: Entry) -> bool:
+        """Занимает ключ в ingest_keys; False — его уже занял другой воркер или процесс до рестарта."""
+        if self.session_factory is not None:
+            key = entry.key
+            try:
+                async with self.session_factory() as db:
+                    first = await crud.claim_ingest_key(db, key)
+                    stored = None if first else await crud.get_ingest_key(db, key)
+                    if stored is not None and stored['status_code'] is None:
+                        stale = datetime.now(timezone.utc) - timedelta(seconds=self.lease)
+                        first = await crud.take_over_ingest_key(db, key, stale)
+                        self.taken_over += first
+            except Exception as e:
+                # База недоступна — лучше переслать повтор, чем потерять событие
+                self.db_errors += 1
+                print(f"Idempotency check failed for {key}: {str(e)}")
+                first, stored = True, None
+            if not first:
+                # Ключ занят другим воркером или до рестарта
+                if stored is not None:
+                    entry.log_id = stored['log_id']
+                    if stored['status_code'] is not None:
+                        self._store_response(entry, stored['status_code'], stored['response'])
+                entry.done.set()
+                self.duplicates += 1
+                self.db_hits += 1
+                return False
+        self.claimed += 1
+        return True
+
+    def _store_response(self, entry: Entry, status_code: int, content: Any):
+        size = len(encode_json(content))
+        if size > self.response_max:
+            return
+        entry.response = (status_code, content)
+        if self._cache.get(entry.key) is entry:
+            entry.size = size
+            self._cached_bytes += size
+            self._expire(time.monotonic())
+
+    def complete(self, entry: Entry, status_code: int, content: Any, log_future: Optional[asyncio.Future]):
+        """Запоминает ответ первой доставки; id её строки logs и запись в базу — в фоне."""
+        self._store_response(entry, status_code, content)
+        entry.log_future = log_future
+        entry.done.set()
+        task = asyncio.create_task(self._persist(entry))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _persist(self, entry: Entry):
+        if entry.log_future is not None:
+            try:
+                entry.log_id = await entry.log_future
+            except Exception:
+                pass
+        if self.session_factory is None:
+            return
+        status_code, content = entry.response if entry.response is not None else (None, None)
+        try:
+            async with self.session_factory() as db:
+                await crud.finish_ingest_key(db, entry.key, log_id=entry.log_id,
+                                             status_code=status_code, response=content)
+        except Exception as e:
+            self.db_errors += 1
+            print(f"Idempotency: saving response for {entry.key} failed: {str(e)}")
+
+    async def release(self, entry: Entry):
+        """Первая доставка не обработана: повтор должен пройти заново."""
+        self.released += 1
+        entry.released = True
+        if self._cache.get(entry.key) is entry:
+            del self._cache[entry.key]
+            self._cached_bytes -= entry.size
+        entry.done.set()
+        if self.session_factory is not None:
+            try:
+                async with self.session_factory() as db:
+                    await crud.delete_ingest_keys(db, models.IngestKey.key == entry.key)
+            except Exception as e:
+                self.db_errors += 1
+                print(f"Idempotency: releasing {entry.key} failed: {str(e)}")
+
+    async def original_response(self, entry: Entry) -> Optional[Tuple[int, Any]]:
+        """Ответ первой доставки; ждёт его, пока она обрабатывается в этом процессе."""
+        try:
+            await asyncio.wait_for(entry.done.wait(), self.wait)
+        except asyncio.TimeoutError:
+            return None
+        if entry.response is not None:
+            self.replayed += 1
+        return entry.response
+
+    async def original_log_id(self, entry: Entry) -> Optional[int]:
+        if entry.log_id is None and entry.log_future is not None:
+            try:
+                # Строка первой доставки в очереди log_writer, id будет после ближайшего сброса
+                entry.log_id = await asyncio.wait_for(asyncio.shield(entry.log_future), self.wait)
+            except Exception:
+                pass
+        return entry.log_id
+
+    async def start(self):
+        if self._task is None and self.enabled and self.session_factory is not None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Ответы, которые ещё не дописаны в ingest_keys
+        if self._pending:
+            await asyncio.wait(self._pending, timeout=self.wait)
+
+    async def purge_once(self) -> int:
+        before = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        async with self.session_factory() as db:
+            deleted = await crud.delete_ingest_keys(db, models.IngestKey.created_at < before)
+        self.purged += deleted
+        return deleted
+
+    async def _run(self):
+        while True:
+            try:
+                await self.purge_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.db_errors += 1
+                print(f"Idempotency key purge failed: {str(e)}")
+            await asyncio.sleep(self.purge_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'key': self.key_name if self.enabled else None,
+            'ttl': self.ttl,
+            'database': self.session_factory is not None,
+            'cached_keys': len(self._cache),
+            'cached_bytes': self._cached_bytes,
+            'claimed': self.claimed,
+            'duplicates': self.duplicates,
+            'cache_hits': self.cache_hits,
+            'db_hits': self.db_hits,
+            'replayed': self.replayed,
+            'released': self.released,
+            'taken_over': self.taken_over,
+            'db_errors': self.db_errors,
+            'purged': self.purged,
+        }
+
+
+idempotency = Idempotency(
+    key_function=make_key_function(IDEMPOTENCY_KEY),
+    key_name=IDEMPOTENCY_KEY,
+    ttl=IDEMPOTENCY_TTL,
+    cache_size=IDEMPOTENCY_CACHE_SIZE,
+    cache_bytes=IDEMPOTENCY_CACHE_BYTES,
+    wait=IDEMPOTENCY_WAIT,
+    response_max=IDEMPOTENCY_RESPONSE_MAX,
+    purge_interval=IDEMPOTENCY_PURGE_INTERVAL,
+    lease=IDEMPOTENCY_LEASE,
+    session_factory=AsyncSessionLocal,
+)
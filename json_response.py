@@ -0,0 +1,75 @@
+import gzip
+import json
+import os
+import re
+from typing import Any
+from fastapi import Request
+from fastapi.responses import Response
+from utils import default_serializer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+env = os.environ
+
+# Маленькие ответы не сжимаем: заголовки gzip и CPU дороже выигрыша
+JSON_GZIP_MIN_SIZE = int(env.get('JSON_GZIP_MIN_SIZE', 1024))
+JSON_GZIP_LEVEL = int(env.get('JSON_GZIP_LEVEL', 5))
+
+# Пары "\x" внутри закодированных строк; \\ ловим, чтобы не сбиться с пары
+_ESCAPES = re.compile(rb'\\[n"\\]')
+_REPLACEMENTS = {
+    b'\\n': b'\\\\u000A',
+    b'\\"': b'\\"\\"',
+    b'\\\\': b'\\\\',
+}
+
+
+def encode_json(content: Any) -> bytes:
+    """Компактный JSON в байтах за один проход, как у JSONResponse, но через orjson если он есть."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(content, default=default_serializer, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # Например, целые больше 64 бит: отдаём стандартному json
+            pass
+    return json.dumps(content, ensure_ascii=False, separators=(',', ':'), default=default_serializer).encode('utf-8')
+
+
+def escape_newlines(data: bytes) -> bytes:
+    """То же, что replace_newlines над данными, но по уже закодированным байтам без копии дерева.
+
+    Перевод строки внутри строки становится литералом \\u000A, кавычка — двумя кавычками.
+    """
+    return _ESCAPES.sub(lambda match: _REPLACEMENTS[match.group()], data)
+
+
+def accepts_gzip(request: Request) -> bool:
+    for part in request.headers.get('accept-encoding', '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if coding.strip().lower() not in ('gzip', '*'):
+            continue
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def json_response(request: Request, content: Any, status_code: int = 200, newlines_escaped: bool = False,
+                  media_type: str = 'application/json') -> Response:
+    """Ответ эндпоинтов просмотрщика: кодируем один раз и сжимаем, если клиент принимает gzip."""
+    body = encode_json(content)
+    if newlines_escaped:
+        body = escape_newlines(body)
+    # Формат страницы тоже выбирается по Accept, кэши должны это учитывать
+    headers = {'Vary': 'Accept, Accept-Encoding'}
+    if len(body) >= JSON_GZIP_MIN_SIZE and accepts_gzip(request):
+        body = gzip.compress(body, compresslevel=JSON_GZIP_LEVEL, mtime=0)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(content=body, status_code=status_code, headers=headers, media_type=media_type)
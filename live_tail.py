@@ -0,0 +1,155 @@
+import asyncio
+import os
+from typing import Any, Callable, Dict, List, Optional, Set
+from database import async_engine
+from storage import log_store
+
+env = os.environ
+
+# Через LISTEN/NOTIFY новые строки видят подписчики всех воркеров, а не только своего
+LIVE_TAIL_NOTIFY = env.get('LIVE_TAIL_NOTIFY', '0') == '1'
+LIVE_TAIL_CHANNEL = env.get('LIVE_TAIL_CHANNEL', 'logs_inserted')
+LIVE_TAIL_QUEUE = int(env.get('LIVE_TAIL_QUEUE', 1000))
+# Ограничение Postgres на payload NOTIFY — 8000 байт
+NOTIFY_PAYLOAD_LIMIT = 7000
+
+
+class LiveEvent:
+    """Новая строка логов; форматируется один раз на всех подписчиков."""
+    __slots__ = ('row', '_encoded')
+
+    def __init__(self, row: Dict[str, Any]):
+        self.row = row
+        self._encoded = None
+
+    def encode(self, formatter: Callable[[Dict[str, Any]], str]) -> str:
+        if self._encoded is None:
+            self._encoded = formatter(self.row)
+        return self._encoded
+
+
+class Subscriber:
+    def __init__(self, filters: Dict[str, str], maxsize: int):
+        self.filters = filters
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        # Сколько событий выброшено с момента последнего уведомления клиента
+        self.dropped = 0
+
+    def matches(self, row: Dict[str, Any]) -> bool:
+        return all(row.get(column) == value for column, value in self.filters.items())
+
+    def offer(self, event: LiveEvent):
+        if self.queue.full():
+            # Медленный клиент: выбрасываем самое старое событие, а не копим память
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+
+class LiveTail:
+    """Рассылка новых строк Logs подписчикам live-tail внутри процесса.
+
+    Без NOTIFY строки публикует log_writer сразу после коммита. С NOTIFY
+    log_writer только шлёт id в канал, а каждый воркер слушает канал, дочитывает
+    строки из базы (только если у него есть подписчики) и раздаёт их локально.
+    """
+
+    def __init__(self, notify: bool, channel: str, queue_size: int):
+        self.notify = notify
+        self.channel = channel
+        self.queue_size = queue_size
+        self._subscribers: Set[Subscriber] = set()
+        self._listener = None
+        self._listener_task: Optional[asyncio.Task] = None
+        self.published = 0
+
+    def subscribe(self, filters: Dict[str, str]) -> Subscriber:
+        subscriber = Subscriber(filters, self.queue_size)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    def publish(self, rows: List[Dict[str, Any]]):
+        if not self._subscribers:
+            return
+        for row in rows:
+            event = LiveEvent(row)
+            for subscriber in self._subscribers:
+                if subscriber.matches(row):
+                    subscriber.offer(event)
+        self.published += len(rows)
+
+    async def rows_inserted(self, rows: List[Dict[str, Any]], ids: List[int]):
+        # Вызывается log_writer после коммита пачки
+        if self.notify:
+            return
+        self.publish([{**row, 'id': log_id} for row, log_id in zip(rows, ids)])
+
+    def notify_payloads(self, ids: List[int]) -> List[str]:
+        payloads, current = [], ''
+        for log_id in ids:
+            part = str(log_id)
+            if current and len(current) + len(part) + 1 > NOTIFY_PAYLOAD_LIMIT:
+                payloads.append(current)
+                current = ''
+            current = f"{current},{part}" if current else part
+        if current:
+            payloads.append(current)
+        return payloads
+
+    async def start(self):
+        if self.notify and log_store.name != 'postgres':
+            # LISTEN/NOTIFY есть только в Postgres; остаёмся на публикации внутри процесса
+            print(f"Live tail: LIVE_TAIL_NOTIFY needs postgres, storage is {log_store.name}; notify disabled")
+            self.notify = False
+        if self.notify and self._listener_task is None:
+            self._listener_task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            await asyncio.gather(self._listener_task, return_exceptions=True)
+            self._listener_task = None
+
+    async def _listen(self):
+        # Держим отдельное соединение под LISTEN и переподключаемся при обрыве
+        while True:
+            try:
+                async with async_engine.connect() as conn:
+                    raw = await conn.get_raw_connection()
+                    listener = raw.driver_connection
+                    await listener.add_listener(self.channel, self._on_notify)
+                    while not listener.is_closed():
+                        await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Live tail listener failed: {str(e)}")
+            await asyncio.sleep(1)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        if not self._subscribers:
+            return
+        ids = [int(part) for part in payload.split(',') if part]
+        asyncio.get_running_loop().create_task(self._fetch_and_publish(ids))
+
+    async def _fetch_and_publish(self, ids: List[int]):
+        try:
+            rows = await log_store.get_by_ids(ids)
+        except Exception as e:
+            print(f"Live tail fetch failed: {str(e)}")
+            return
+        self.publish(rows)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'notify': self.notify,
+            'subscribers': len(self._subscribers),
+            'published': self.published,
+            'lagging': sum(1 for subscriber in self._subscribers if subscriber.dropped),
+        }
+
+
+live_tail = LiveTail(notify=LIVE_TAIL_NOTIFY, channel=LIVE_TAIL_CHANNEL, queue_size=LIVE_TAIL_QUEUE)
@@ -0,0 +1,244 @@
+import asyncio
+import os
+from typing import Any, Dict, List, Optional, Tuple
+import json
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+from event_meta import extract_event_meta
+from live_tail import live_tail
+from storage import log_store
+from utils import utc_now
+
+env = os.environ
+
+# Настройки write-behind очереди логов
+LOG_WRITER_BATCH_SIZE = int(env.get('LOG_WRITER_BATCH_SIZE', 200))
+LOG_WRITER_FLUSH_INTERVAL = float(env.get('LOG_WRITER_FLUSH_INTERVAL', 0.05))
+LOG_WRITER_MAX_QUEUE = int(env.get('LOG_WRITER_MAX_QUEUE', 10000))
+# Ждать ли подтверждения записи в базу перед ответом на вебхук
+LOG_WRITER_ACK = env.get('LOG_WRITER_ACK', '0') == '1'
+# Недоступная база: пачка повторяется с задержкой RETRY_DELAY * 2^n, пока очередь
+# копит новые строки; без ACK иначе строки терялись бы при первом обрыве соединения
+LOG_WRITER_RETRIES = int(env.get('LOG_WRITER_RETRIES', 5))
+LOG_WRITER_RETRY_DELAY = float(env.get('LOG_WRITER_RETRY_DELAY', 0.5))
+
+_STOP = object()
+
+
+def is_connection_error(error: Exception) -> bool:
+    # База недоступна — дробить пачку бесполезно, упадёт каждая часть
+    if isinstance(error, DBAPIError):
+        return error.connection_invalidated or isinstance(error, (OperationalError, InterfaceError))
+    return isinstance(error, (OSError, asyncio.TimeoutError))
+
+
+def make_log_row(method: str, headers: Dict[str, Any], body: Any, path_params: str,
+                 query_params: Dict[str, Any], body_columns: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Строка models.Logs вместе с полями события, извлечёнными один раз при записи.
+
+    body — разобранное тело для полей события; body_columns (body_capture.columns)
+    задают, как тело хранится, по умолчанию оно пишется в jsonb body.
+    """
+    row = dict(
+        timestamp=utc_now(),
+        httpmethod=method,
+        headers=headers,
+        body=body,
+        path_params=path_params,
+        query_params=json.dumps(query_params, ensure_ascii=False),
+        **extract_event_meta(headers, body),
+    )
+    if body_columns:
+        row.update(body_columns)
+    return row
+
+
+class LogWriter:
+    """Копит строки models.Logs в очереди и пишет их пачками одним multi-row INSERT.
+
+    Сброс происходит при наборе batch_size строк или по истечении flush_interval
+    секунд с момента первой строки в пачке. write(row, wait=True) возвращает id
+    строки только после коммита. Обрыв соединения с базой пачка переживает
+    повторами (retries, retry_delay), остальные ошибки ищутся делением пачки.
+    Если в start передано событие ready, первая
+    запись ждёт его (схема ещё создаётся), а строки тем временем копятся в очереди.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_queue: int,
+                 retries: int, retry_delay: float):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Event] = None
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.bisected = 0
+        self.retried = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self, ready: Optional[asyncio.Event] = None):
+        if self.running:
+            return
+        self._ready = ready
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self.running:
+            return
+        if self._ready is not None and not self._ready.is_set():
+            # Схема так и не готова: писать некуда, ждать бесполезно
+            print(f"Log writer stopped before schema was ready, {self._queue.qsize()} rows dropped")
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            return
+        # Всё, что успели положить до остановки, будет записано
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def write(self, row: Dict[str, Any], wait: bool = False) -> Optional[int]:
+        if not self.running:
+            # Очередь не запущена (например, скрипты без lifespan) — пишем сразу
+            return (await self._insert([row]))[0]
+        if not wait:
+            # При переполненной очереди put ждёт, это и есть backpressure
+            await self._queue.put((row, None, None))
+            return None
+        return await (await self.submit(row))
+
+    async def submit(self, row: Dict[str, Any], ready: Optional[asyncio.Future] = None) -> asyncio.Future:
+        """Ставит строку в очередь; future получит её id после коммита пачки.
+
+        ready — задача, которая ещё дописывает поля строки (duplicate_of при
+        проверке идемпотентности): пачка с этой строкой сбрасывается после неё.
+        """
+        future = asyncio.get_running_loop().create_future()
+        if not self.running:
+            try:
+                if ready is not None:
+                    await asyncio.wait([ready])
+                future.set_result((await self._insert([row]))[0])
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        await self._queue.put((row, future, ready))
+        return future
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'running': self.running,
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'written': self.written,
+            'batches': self.batches,
+            'failed': self.failed,
+            'bisected': self.bisected,
+            'retried': self.retried,
+            'batch_size': self.batch_size,
+            'flush_interval': self.flush_interval,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        if self._ready is not None:
+            await self._ready.wait()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+        # Дописываем остаток очереди при остановке
+        rest = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP:
+                rest.append(item)
+        for start in range(0, len(rest), self.batch_size):
+            await self._flush(rest[start:start + self.batch_size])
+
+    async def _flush(self, batch: List[Tuple[Dict[str, Any], Optional[asyncio.Future], Optional[asyncio.Future]]]):
+        ready = [item for _, _, item in batch if item is not None and not item.done()]
+        if ready:
+            await asyncio.wait(ready)
+        rows = [row for row, _, _ in batch]
+        try:
+            ids = await self._insert_retrying(rows)
+        except Exception as e:
+            if len(batch) > 1 and not is_connection_error(e):
+                # Строку, которую база не принимает, ищем делением пачки пополам:
+                # остальные строки пачки записываются, падает только она
+                self.bisected += 1
+                middle = len(batch) // 2
+                await self._flush(batch[:middle])
+                await self._flush(batch[middle:])
+                return
+            self.failed += len(rows)
+            print(f"Log writer flush failed ({len(rows)} rows): {str(e)}")
+            for _, future, _ in batch:
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            return
+
+        self.written += len(rows)
+        self.batches += 1
+        for (_, future, _), log_id in zip(batch, ids):
+            if future is not None and not future.done():
+                future.set_result(log_id)
+
+    async def _insert_retrying(self, rows: List[Dict[str, Any]]) -> List[int]:
+        for attempt in range(self.retries + 1):
+            try:
+                return await self._insert(rows)
+            except Exception as e:
+                if attempt == self.retries or not is_connection_error(e):
+                    raise
+                delay = self.retry_delay * 2 ** attempt
+                self.retried += 1
+                print(f"Log writer: database unavailable, retrying {len(rows)} rows in {delay:.1f}s: {str(e)}")
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    async def _insert(rows: List[Dict[str, Any]]) -> List[int]:
+        ids = await log_store.insert(rows)
+        if live_tail.notify:
+            # Остальные воркеры узнают о новых строках через LISTEN
+            try:
+                await log_store.notify(live_tail.channel, live_tail.notify_payloads(ids))
+            except Exception as e:
+                print(f"Live tail notify failed: {str(e)}")
+        await live_tail.rows_inserted(rows, ids)
+        return ids
+
+
+# Один экземпляр на процесс, запускается в lifespan приложения
+log_writer = LogWriter(
+    batch_size=LOG_WRITER_BATCH_SIZE,
+    flush_interval=LOG_WRITER_FLUSH_INTERVAL,
+    max_queue=LOG_WRITER_MAX_QUEUE,
+    retries=LOG_WRITER_RETRIES,
+    retry_delay=LOG_WRITER_RETRY_DELAY,
+)
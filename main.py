@@ -1,14 +1,59 @@
+import asyncio
 from fastapi import FastAPI, Request
-import models
 import os
-from database import engine
-from routers import logs, requests
-from sqlalchemy import text
+from routers import logs, requests, stats, live, health
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
 from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
+from log_writer import log_writer
+from http_client import client_pool
+import outbox
+from live_tail import live_tail
+import partitions
+from archive import archiver
+from idempotency import idempotency
+from circuit_breaker import breakers
+from startup import startup
 
-app = FastAPI()
+
+async def start_background_services():
+    # Фоновые службы работают с таблицами, поэтому ждут готовности схемы
+    await startup.schema_ready.wait()
+    # В sync-режиме диспетчер нужен для событий, отложенных открытым автоматом
+    if outbox.FORWARD_MODE == 'outbox' or breakers.open_mode == 'defer':
+        await outbox.dispatcher.start()
+    await partitions.partition_maintainer.start()
+    await archiver.start()
+    await idempotency.start()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Импорт main к базе не ходит; схема готовится в фоне, приём вебхуков открыт сразу
+    await startup.start()
+    await live_tail.start()
+    await log_writer.start(ready=startup.schema_ready)
+    # Заранее создаём клиентов для всех доменов пересылки
+    for domain in requests.domains:
+        client_pool.client(domain)
+    background = asyncio.create_task(start_background_services())
+    startup.mark('lifespan_ready')
+    yield
+    background.cancel()
+    await asyncio.gather(background, return_exceptions=True)
+    await archiver.stop()
+    await partitions.partition_maintainer.stop()
+    await outbox.dispatcher.stop()
+    # Ответы первых доставок дописываются в ingest_keys, пока очередь логов ещё работает
+    await idempotency.stop()
+    # Дописываем накопленные логи перед остановкой процесса
+    await log_writer.stop()
+    await startup.stop()
+    await live_tail.stop()
+    await client_pool.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # Добавляем TrustedHostMiddleware для всех хостов
 app.add_middleware(
@@ -22,7 +67,6 @@ one_level_up = os.path.dirname(os.path.abspath(__file__))
 
 # Формируем путь к папке static
 static_path = os.path.join(one_level_up, "static")
-print("Path to static ----- ", static_path)
 
 # Подключаем статические файлы для React приложения
 app.mount("/static", StaticFiles(directory=static_path), name="static")
@@ -45,20 +89,19 @@ app.mount("/static", StaticFiles(directory=static_path), name="static")
 class LoggingMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
         response = await call_next(request)
+        if request.url.path not in health.PROBE_PATHS:
+            startup.first_request()
         if request.url.path.startswith("/static"):
             print(f"Static file requested: {request.url.path} -> Status: {response.status_code}")
         return response
 
 app.add_middleware(LoggingMiddleware)
 
-models.Base.metadata.create_all(bind=engine)
-tableModel = models.Base.metadata.tables
-print(tableModel)
-
-# Вывод схемы таблицы (для PostgreSQL или другой базы данных)
-with engine.connect() as conn:
-    result = conn.execute(text("SELECT column_name, data_type FROM information_schema.columns WHERE table_name = 'logs'"))
-    print(result.fetchall())
-
+# Схема создаётся не здесь: startup.py (SCHEMA_MODE) или python migrations.py
+app.include_router(health.router)
+app.include_router(live.router)
 app.include_router(logs.router)
 app.include_router(requests.router)
+app.include_router(stats.router)
+
+startup.mark('imported')
@@ -0,0 +1,425 @@
+"""Одноразовые миграции схемы, которые нельзя сделать через create_all.
+
+Запуск перед выкладкой новой версии:
+
+    python migrations.py [--batch-size 5000] [--sleep 0.05] [--drop-old]
+
+--schema-only только создаёт недостающие таблицы — то же, что делает при
+старте сервис с SCHEMA_MODE=lazy (startup.py).
+
+Каждый шаг идемпотентен: уже применённый шаг пропускается. Большие таблицы
+переводятся без долгих блокировок: новая колонка добавляется пустой,
+заполняется пачками по диапазонам id, а блокировка берётся только на
+дозаполнение хвоста и переименование колонок.
+"""
+import argparse
+import hashlib
+import time
+from sqlalchemy import MetaData, inspect, select, text
+from sqlalchemy.engine import Engine
+import models
+import partitions
+from database import engine
+from event_meta import extract_event_meta, META_VERSION
+
+# Безопасное приведение текста к timestamptz: битые значения становятся NULL
+TRY_TIMESTAMPTZ_FUNCTION = """
+CREATE OR REPLACE FUNCTION showhttpreq_try_timestamptz(value text) RETURNS timestamptz AS $$
+BEGIN
+    RETURN value::timestamptz;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE
+"""
+
+# То же для JSON: текст, который не разбирается, сохраняется как JSON-строка
+TRY_JSONB_FUNCTION = """
+CREATE OR REPLACE FUNCTION showhttpreq_try_jsonb(value text) RETURNS jsonb AS $$
+BEGIN
+    RETURN value::jsonb;
+EXCEPTION WHEN others THEN
+    RETURN to_jsonb(value);
+END;
+$$ LANGUAGE plpgsql IMMUTABLE
+"""
+
+
+def column_type(conn, table: str, column: str):
+    return conn.execute(text(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_name = :table AND column_name = :column"
+    ), {'table': table, 'column': column}).scalar()
+
+
+def backfill_batches(db_engine: Engine, table: str, target: str, source: str, using: str,
+                     batch_size: int, sleep: float, start_id: int = 0) -> int:
+    """Заполняет target из выражения using пачками по id, каждая пачка — своя транзакция."""
+    with db_engine.connect() as conn:
+        max_id = conn.execute(text(f"SELECT max(id) FROM {table}")).scalar() or 0
+    done = 0
+    low = start_id
+    while low <= max_id:
+        high = low + batch_size
+        with db_engine.begin() as conn:
+            result = conn.execute(text(
+                f'UPDATE {table} SET {target} = {using} '
+                f'WHERE id >= :low AND id < :high AND {target} IS NULL AND "{source}" IS NOT NULL'
+            ), {'low': low, 'high': high})
+            done += result.rowcount
+        print(f"  {table}.{target}: ids {low}..{high - 1} done ({done} rows)")
+        low = high
+        # Пауза между пачками даёт место рабочему трафику и автовакууму
+        time.sleep(sleep)
+    return max_id
+
+
+def convert_column(db_engine: Engine, table: str, column: str, new_type: str, using: str,
+                   batch_size: int, sleep: float, drop_old: bool):
+    """Меняет тип колонки без переписывания таблицы под эксклюзивной блокировкой.
+
+    using — SQL-выражение от старой колонки, например 'showhttpreq_try_timestamptz("timestamp")'.
+    Старая колонка остаётся под именем <column>_old, если не передан drop_old.
+    """
+    new_column = f"{column}_new"
+    old_column = f"{column}_old"
+    with db_engine.begin() as conn:
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {new_column} {new_type}'))
+
+    last_id = backfill_batches(db_engine, table, new_column, column, using, batch_size, sleep)
+    # Вторая проходка по строкам, которые успели вставить во время первой
+    last_id = backfill_batches(db_engine, table, new_column, column, using, batch_size, sleep, start_id=last_id)
+
+    with db_engine.begin() as conn:
+        conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+        conn.execute(text(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE'))
+        # Под блокировкой — только хвост после второй проходки, по индексу id: полный
+        # проход задержал бы приём и заново пересчитал строки, где using честно даёт NULL
+        conn.execute(text(
+            f'UPDATE {table} SET {new_column} = {using} '
+            f'WHERE id > :last_id AND {new_column} IS NULL AND "{column}" IS NOT NULL'
+        ), {'last_id': last_id})
+        conn.execute(text(f'ALTER TABLE {table} RENAME COLUMN "{column}" TO {old_column}'))
+        conn.execute(text(f'ALTER TABLE {table} RENAME COLUMN {new_column} TO "{column}"'))
+        if drop_old:
+            conn.execute(text(f'ALTER TABLE {table} DROP COLUMN {old_column}'))
+    print(f"  {table}.{column} is now {new_type}")
+
+
+def create_index_concurrently(db_engine: Engine, sql: str):
+    # CREATE INDEX CONCURRENTLY не работает внутри транзакции
+    with db_engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        # и на секционированной таблице: там индекс строится по партициям обычным CREATE INDEX
+        if partitions.is_partitioned(conn):
+            sql = sql.replace('CREATE INDEX CONCURRENTLY', 'CREATE INDEX')
+        conn.execute(text(sql))
+
+
+def migrate_timestamp(db_engine: Engine, batch_size: int, sleep: float, drop_old: bool):
+    """logs.timestamp: ISO-строка -> timestamptz с BRIN-индексом."""
+    with db_engine.connect() as conn:
+        current = column_type(conn, 'logs', 'timestamp')
+    if current != 'timestamp with time zone':
+        print("Converting logs.timestamp to timestamptz")
+        with db_engine.begin() as conn:
+            conn.execute(text(TRY_TIMESTAMPTZ_FUNCTION))
+        convert_column(db_engine, 'logs', 'timestamp', 'timestamptz',
+                       'showhttpreq_try_timestamptz("timestamp")', batch_size, sleep, drop_old)
+        with db_engine.begin() as conn:
+            conn.execute(text('DROP INDEX IF EXISTS ix_logs_timestamp'))
+
+    # Логи только дописываются, поэтому BRIN по времени почти бесплатен по размеру
+    create_index_concurrently(
+        db_engine,
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_logs_timestamp_brin ON logs USING brin ("timestamp")',
+    )
+
+
+def add_columns(db_engine: Engine, table: str, columns):
+    # ADD COLUMN без DEFAULT не переписывает таблицу
+    with db_engine.begin() as conn:
+        for name, sql_type in columns:
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {name} {sql_type}'))
+
+
+def migrate_event_meta(db_engine: Engine, batch_size: int, sleep: float, drop_old: bool):
+    """Колонки с полями события и бэкфилл для строк, записанных до их появления."""
+    add_columns(db_engine, 'logs', [
+        ('ip', 'varchar'),
+        ('domain', 'varchar'),
+        ('event_name', 'varchar'),
+        ('event_id', 'varchar'),
+        ('event_timestamp', 'varchar'),
+        ('ticket_id', 'varchar'),
+        ('internal_id', 'varchar'),
+        ('number', 'varchar'),
+        ('is_triggered_via_api', 'varchar'),
+        ('meta_version', 'smallint'),
+    ])
+
+    last_id = 0
+    done = 0
+    while True:
+        with db_engine.begin() as conn:
+            rows = conn.execute(text(
+                'SELECT id, headers, body FROM logs '
+                'WHERE id > :last_id AND (meta_version IS NULL OR meta_version < :version) '
+                'ORDER BY id LIMIT :limit'
+            ), {'last_id': last_id, 'version': META_VERSION, 'limit': batch_size}).all()
+            if not rows:
+                break
+            updates = [{'row_id': row.id, **extract_event_meta(row.headers, row.body)} for row in rows]
+            conn.execute(text(
+                'UPDATE logs SET ip = :ip, domain = :domain, event_name = :event_name, '
+                'event_id = :event_id, event_timestamp = :event_timestamp, ticket_id = :ticket_id, '
+                'internal_id = :internal_id, number = :number, '
+                'is_triggered_via_api = :is_triggered_via_api, meta_version = :meta_version '
+                'WHERE id = :row_id'
+            ), updates)
+        last_id = rows[-1].id
+        done += len(rows)
+        print(f"  logs event meta: up to id {last_id} ({done} rows)")
+        time.sleep(sleep)
+
+    for column in ('domain', 'event_name', 'event_id', 'ticket_id'):
+        create_index_concurrently(
+            db_engine, f'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_logs_{column} ON logs ({column})'
+        )
+
+
+def migrate_jsonb(db_engine: Engine, batch_size: int, sleep: float, drop_old: bool):
+    """logs.headers и logs.body: текст -> jsonb с GIN-индексами для поиска через @>."""
+    for column in ('headers', 'body'):
+        with db_engine.connect() as conn:
+            current = column_type(conn, 'logs', column)
+        if current != 'jsonb':
+            print(f"Converting logs.{column} to jsonb")
+            with db_engine.begin() as conn:
+                conn.execute(text(TRY_JSONB_FUNCTION))
+            convert_column(db_engine, 'logs', column, 'jsonb',
+                           f'showhttpreq_try_jsonb("{column}")', batch_size, sleep, drop_old)
+        create_index_concurrently(
+            db_engine,
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_logs_{column}_gin '
+            f'ON logs USING gin ({column} jsonb_path_ops)',
+        )
+
+
+def migrate_raw_body(db_engine: Engine, batch_size: int, sleep: float, drop_old: bool):
+    """Колонки для сырого тела (body_capture); старые строки не трогаются, их тело в body."""
+    columns = [
+        ('raw_body', 'bytea'),
+        ('body_encoding', 'varchar'),
+        ('body_size', 'integer'),
+        ('body_truncated', 'boolean'),
+    ]
+    add_columns(db_engine, 'logs', columns)
+    # Прерванный перенос в секционированную таблицу копирует все колонки модели
+    with db_engine.connect() as conn:
+        legacy = conn.execute(text("SELECT to_regclass('logs_legacy')")).scalar()
+    if legacy:
+        add_columns(db_engine, 'logs_legacy', columns)
+
+
+def migrate_duplicate_of(db_engine: Engine, batch_size: int, sleep: float, drop_old: bool):
+    """logs.duplicate_of для повторных доставок вебхуков (idempotency.py); таблица ingest_keys создаётся create_all."""
+    add_columns(db_engine, 'logs', [('duplicate_of', 'integer')])
+    with db_engine.connect() as conn:
+        legacy = conn.execute(text("SELECT to_regclass('logs_legacy')")).scalar()
+    if legacy:
+        add_columns(db_engine, 'logs_legacy', [('duplicate_of', 'integer')])
+
+
+def migrate_partitioning(db_engine: Engine, batch_size: int, sleep: float, drop_old: bool):
+    """logs -> таблица, секционированная по "timestamp".
+
+    Под короткой блокировкой старая таблица переименовывается в logs_legacy, на её
+    месте создаётся секционированная logs, а последовательность id продолжается
+    с максимума старой. Новые логи сразу пишутся в новую таблицу; старые строки
+    переносятся пачками, до конца переноса просмотрщик видит неполную историю.
+    """
+    with db_engine.connect() as conn:
+        partitioned = partitions.is_partitioned(conn)
+        legacy = conn.execute(text("SELECT to_regclass('logs_legacy')")).scalar()
+    if not partitioned:
+        print("Converting logs to a partitioned table")
+        with db_engine.connect() as conn:
+            since = conn.execute(text('SELECT min("timestamp") FROM logs')).scalar()
+        with db_engine.begin() as conn:
+            conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+            conn.execute(text('LOCK TABLE logs IN ACCESS EXCLUSIVE MODE'))
+            # Имена индексов и последовательности освобождаем под новую таблицу
+            for (index_name,) in conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = 'logs'")).all():
+                conn.execute(text(f'ALTER INDEX "{index_name}" RENAME TO "{index_name}_legacy"'))
+            sequence = conn.execute(text("SELECT pg_get_serial_sequence('logs', 'id')")).scalar()
+            if sequence:
+                conn.execute(text(f'ALTER SEQUENCE {sequence} RENAME TO logs_legacy_id_seq'))
+            conn.execute(text('ALTER TABLE logs RENAME TO logs_legacy'))
+
+            conn.execute(text(f"CREATE SEQUENCE {partitions.SEQUENCE}"))
+            partitions.partitioned_logs_table(MetaData()).create(conn)
+            conn.execute(text(f"ALTER SEQUENCE {partitions.SEQUENCE} OWNED BY logs.id"))
+            conn.execute(text(
+                f"SELECT setval('{partitions.SEQUENCE}', (SELECT coalesce(max(id), 0) + 1 FROM logs_legacy), false)"
+            ))
+            conn.execute(text(f"CREATE TABLE {partitions.DEFAULT_PARTITION} PARTITION OF logs DEFAULT"))
+            partitions.ensure_partitions(conn, partitions.LOG_PARTITION_INTERVAL, partitions.LOG_PARTITION_PREMAKE,
+                                         since=since)
+        legacy = True
+
+    if legacy:
+        columns = ', '.join(f'"{column.name}"' for column in models.Logs.__table__.columns)
+        with db_engine.connect() as conn:
+            max_id = conn.execute(text("SELECT max(id) FROM logs_legacy")).scalar() or 0
+            # Продолжаем с места, где остановился прерванный перенос
+            low = conn.execute(text("SELECT coalesce(max(id), 0) + 1 FROM logs WHERE id <= :max_id"),
+                               {'max_id': max_id}).scalar()
+        while low <= max_id:
+            high = low + batch_size
+            with db_engine.begin() as conn:
+                conn.execute(text(
+                    f'INSERT INTO logs ({columns}) SELECT {columns} FROM logs_legacy WHERE id >= :low AND id < :high'
+                ), {'low': low, 'high': high})
+            print(f"  logs_legacy -> logs: ids {low}..{high - 1} copied")
+            low = high
+            time.sleep(sleep)
+        if drop_old:
+            with db_engine.begin() as conn:
+                conn.execute(text('DROP TABLE logs_legacy'))
+        else:
+            print("  logs_legacy kept, run with --drop-old to remove it")
+
+    with db_engine.begin() as conn:
+        partitions.ensure_partitions(conn, partitions.LOG_PARTITION_INTERVAL, partitions.LOG_PARTITION_PREMAKE)
+
+
+MIGRATIONS = [
+    migrate_timestamp,
+    migrate_event_meta,
+    migrate_jsonb,
+    migrate_raw_body,
+    migrate_duplicate_of,
+    migrate_partitioning,
+]
+
+
+# Воркеры и инстансы создают схему по очереди
+SCHEMA_LOCK_ID = 70150002
+
+
+def schema_fingerprint() -> str:
+    """Хэш таблиц, колонок и индексов моделей: меняется, только если create_all есть что создать."""
+    parts = []
+    for table in sorted(models.Base.metadata.tables.values(), key=lambda table: table.name):
+        parts.append(table.name)
+        parts.extend(f"{column.name}:{column.type}" for column in table.columns)
+        parts.extend(sorted(index.name for index in table.indexes))
+        parts.extend(sorted(f"{name}={value}" for name, value in table.dialect_kwargs.items()))
+    return hashlib.sha1('\n'.join(parts).encode()).hexdigest()
+
+
+def add_missing_columns(db_engine: Engine):
+    """Добавляет пустыми колонки моделей, которых нет в уже существующих таблицах (старый test.db).
+
+    Только не для Postgres: там колонки добавляют шаги MIGRATIONS вместе с бэкфиллом.
+    """
+    if db_engine.dialect.name == 'postgresql':
+        return
+    with db_engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in models.Base.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    sql_type = column.type.compile(dialect=conn.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {sql_type}'))
+                    print(f"  added {table.name}.{column.name} {sql_type}")
+
+
+def add_sqlite_autoincrement(db_engine: Engine):
+    """Пересоздаёт logs в SQLite с AUTOINCREMENT, если таблица создана без него (старый test.db).
+
+    Без AUTOINCREMENT id удалённых строк достаются новым. Строки копируются как
+    есть, счётчик продолжится с наибольшего id.
+    """
+    if db_engine.dialect.name != 'sqlite':
+        return
+    table = models.Logs.__table__
+    with db_engine.begin() as conn:
+        sql = conn.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': table.name}
+        ).scalar()
+        if sql is None or 'AUTOINCREMENT' in sql.upper():
+            return
+        old = f'{table.name}_without_autoincrement'
+        conn.execute(text(f'ALTER TABLE {table.name} RENAME TO {old}'))
+        # Имена индексов в SQLite общие на базу, старые мешают создать новые
+        indexes = conn.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :name AND sql IS NOT NULL"),
+            {'name': old},
+        ).scalars().all()
+        for index in indexes:
+            conn.execute(text(f'DROP INDEX "{index}"'))
+        table.create(conn)
+        existing = {column['name'] for column in inspect(conn).get_columns(old)}
+        columns = ', '.join(f'"{column.name}"' for column in table.columns if column.name in existing)
+        conn.execute(text(f'INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {old}'))
+        conn.execute(text(f'DROP TABLE {old}'))
+        print(f"  recreated {table.name} with AUTOINCREMENT")
+
+
+def ensure_schema(db_engine: Engine = engine) -> bool:
+    """Создаёт недостающие таблицы; False — схема с этим отпечатком уже создана.
+
+    Проверка отпечатка — один запрос вместо запроса на каждую таблицу в create_all.
+    """
+    fingerprint = schema_fingerprint()
+    state = models.SchemaState.__table__
+    with db_engine.connect() as conn:
+        postgres = conn.dialect.name == 'postgresql'
+        if postgres:
+            conn.execute(text("SELECT pg_advisory_lock(:id)"), {'id': SCHEMA_LOCK_ID})
+        try:
+            try:
+                current = conn.execute(select(state.c.fingerprint).where(state.c.name == 'models')).scalar()
+            except Exception:
+                # Таблицы schema_state ещё нет — пустая база
+                conn.rollback()
+                current = None
+            if current == fingerprint:
+                return False
+            # Новые таблицы создаются сразу в актуальной схеме
+            partitions.create_logs_table(db_engine)
+            models.Base.metadata.create_all(bind=db_engine)
+            add_missing_columns(db_engine)
+            add_sqlite_autoincrement(db_engine)
+            conn.execute(state.delete().where(state.c.name == 'models'))
+            conn.execute(state.insert().values(name='models', fingerprint=fingerprint))
+            conn.commit()
+            return True
+        finally:
+            if postgres:
+                conn.rollback()
+                conn.execute(text("SELECT pg_advisory_unlock(:id)"), {'id': SCHEMA_LOCK_ID})
+                conn.commit()
+
+
+def run(batch_size: int = 5000, sleep: float = 0.05, drop_old: bool = False):
+    ensure_schema()
+    for migration in MIGRATIONS:
+        started = time.monotonic()
+        migration(engine, batch_size, sleep, drop_old)
+        print(f"{migration.__name__}: {time.monotonic() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Apply schema migrations")
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--sleep', type=float, default=0.05, help='пауза между пачками, секунд')
+    parser.add_argument('--drop-old', action='store_true', help='удалить старые колонки после конвертации')
+    parser.add_argument('--schema-only', action='store_true', help='только создать недостающие таблицы')
+    args = parser.parse_args()
+    if args.schema_only:
+        print("Schema created" if ensure_schema() else "Schema is up to date")
+    else:
+        run(args.batch_size, args.sleep, args.drop_old)
@@ -1,13 +1,90 @@
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Boolean, Column, Integer, LargeBinary, SmallInteger, String, DateTime, Float, Index, JSON, func
+from sqlalchemy.dialects.postgresql import JSONB
 from database import Base
 
+# JSONB в Postgres, обычный JSON там, где JSONB нет
+JSONType = JSONB().with_variant(JSON(), 'sqlite')
+
 class Logs(Base):
     __tablename__ = "logs"
     id = Column(Integer, unique=True, primary_key=True, index=True)
-    timestamp = Column(String, index=True)
+    timestamp = Column(DateTime(timezone=True))
     httpmethod = Column(String)
+    headers = Column(JSONType)
+    body = Column(JSONType)
+    path_params = Column(String)
+    query_params = Column(String)
+    # Поля события, извлечённые при записи (event_meta.extract_event_meta)
+    ip = Column(String)
+    domain = Column(String, index=True)
+    event_name = Column(String, index=True)
+    event_id = Column(String, index=True)
+    event_timestamp = Column(String)
+    ticket_id = Column(String, index=True)
+    internal_id = Column(String)
+    number = Column(String)
+    is_triggered_via_api = Column(String)
+    meta_version = Column(SmallInteger)
+    # Большие и не-JSON тела: исходные байты, возможно сжатые (body_capture), body тогда NULL
+    raw_body = Column(LargeBinary)
+    body_encoding = Column(String)
+    body_size = Column(Integer)
+    body_truncated = Column(Boolean)
+    # Повторная доставка того же события (idempotency): id первой строки
+    duplicate_of = Column(Integer)
+
+    __table_args__ = (
+        # Логи только дописываются, BRIN по времени компактнее btree в сотни раз
+        Index('ix_logs_timestamp_brin', 'timestamp', postgresql_using='brin'),
+        # jsonb_path_ops поддерживает только @>, зато индекс меньше и быстрее
+        Index('ix_logs_body_gin', 'body', postgresql_using='gin', postgresql_ops={'body': 'jsonb_path_ops'}),
+        Index('ix_logs_headers_gin', 'headers', postgresql_using='gin', postgresql_ops={'headers': 'jsonb_path_ops'}),
+        # Без AUTOINCREMENT SQLite отдаёт id удалённых строк новым, а кэш строк и live tail считают id вечным
+        {'sqlite_autoincrement': True},
+    )
+
+
+class RateBucket(Base):
+    __tablename__ = "rate_buckets"
+    key = Column(String, primary_key=True)
+    tokens = Column(Float)
+    updated = Column(Float)
+
+
+class Outbox(Base):
+    __tablename__ = "outbox"
+    id = Column(Integer, primary_key=True, index=True)
+    domain = Column(String, index=True)
+    method = Column(String)
+    elma_tail = Column(String)
     headers = Column(String)
     body = Column(String)
     path_params = Column(String)
     query_params = Column(String)
-    
\ No newline at end of file
+    # pending -> in_flight -> done | failed, при ошибке снова pending с задержкой
+    status = Column(String, index=True, default='pending')
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), index=True, server_default=func.now())
+    locked_until = Column(DateTime(timezone=True))
+    last_status_code = Column(Integer)
+    last_error = Column(String)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class IngestKey(Base):
+    __tablename__ = "ingest_keys"
+    # Ключ идемпотентности вебхука (idempotency.py); уникальность — первичный ключ
+    key = Column(String, primary_key=True)
+    log_id = Column(Integer)
+    status_code = Column(Integer)
+    response = Column(JSONType)
+    created_at = Column(DateTime(timezone=True), index=True)
+
+
+class SchemaState(Base):
+    __tablename__ = "schema_state"
+    # Отпечаток схемы моделей, для которой таблицы уже созданы (migrations.ensure_schema)
+    name = Column(String, primary_key=True)
+    fingerprint = Column(String)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,221 @@
+import asyncio
+import json
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+import crud
+from circuit_breaker import breakers
+from database import AsyncSessionLocal
+from forwarder import forward_to_domain
+from rate_limiter import limiter
+from utils import CustomJSONEncoder
+
+env = os.environ
+
+# sync — ответ на вебхук ждёт ELMA, outbox — 202 сразу, пересылка в фоне
+FORWARD_MODE = env.get('FORWARD_MODE', 'sync')
+if FORWARD_MODE == 'outbox' and AsyncSessionLocal is None:
+    # Очередь outbox — таблица в базе, без базы пересылаем синхронно
+    print("FORWARD_MODE=outbox needs a database (LOG_STORAGE=memory), falling back to sync")
+    FORWARD_MODE = 'sync'
+OUTBOX_WORKERS = int(env.get('OUTBOX_WORKERS', 4))
+OUTBOX_PER_DOMAIN = int(env.get('OUTBOX_PER_DOMAIN', 2))
+OUTBOX_MAX_ATTEMPTS = int(env.get('OUTBOX_MAX_ATTEMPTS', 8))
+OUTBOX_BACKOFF_BASE = float(env.get('OUTBOX_BACKOFF_BASE', 1))
+OUTBOX_BACKOFF_MAX = float(env.get('OUTBOX_BACKOFF_MAX', 300))
+OUTBOX_POLL_INTERVAL = float(env.get('OUTBOX_POLL_INTERVAL', 0.5))
+OUTBOX_LEASE_SECONDS = float(env.get('OUTBOX_LEASE_SECONDS', 60))
+# Задержка, с которой строка возвращается в очередь, если лимитер не дал токен
+OUTBOX_RATE_LIMIT_DELAY = float(env.get('OUTBOX_RATE_LIMIT_DELAY', 0.5))
+
+# Коды, при которых повтор не поможет
+PERMANENT_STATUS_CODES = {400, 401, 403, 404, 405, 410, 422}
+
+
+async def enqueue(domains: List[str], method: str, elma_tail: str, headers_dict: Dict[str, str],
+                  bodyObj: Dict[str, Any], path_params: str, query_params: Dict[str, str]) -> List[int]:
+    """Сохраняет по строке outbox на каждый домен, возвращает после коммита."""
+    entries = [dict(
+        domain=domain,
+        method=method,
+        elma_tail=elma_tail,
+        headers=json.dumps(headers_dict, ensure_ascii=False, cls=CustomJSONEncoder),
+        body=json.dumps(bodyObj, ensure_ascii=False),
+        path_params=path_params,
+        query_params=json.dumps(query_params, ensure_ascii=False),
+    ) for domain in domains]
+
+    async with AsyncSessionLocal() as db:
+        return await crud.create_outbox_entries(db, entries)
+
+
+def backoff_delay(attempts: int) -> float:
+    delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1))
+    # Джиттер, чтобы повторы разных событий не приходили в ELMA одной волной
+    return delay * random.uniform(0.5, 1)
+
+
+class OutboxDispatcher:
+    """Пул фоновых задач, которые разбирают таблицу outbox и пересылают события в ELMA.
+
+    Строки забираются через FOR UPDATE SKIP LOCKED с арендой на lease_seconds,
+    поэтому несколько воркеров и процессов не отправляют одну строку дважды, а
+    строки упавшего процесса возвращаются в очередь после истечения аренды.
+    """
+
+    def __init__(self, workers: int, per_domain: int, max_attempts: int,
+                 poll_interval: float, lease_seconds: float):
+        self.workers = workers
+        self.per_domain = per_domain
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._tasks: List[asyncio.Task] = []
+        self._in_flight: Dict[str, int] = {}
+        self._claim_lock = asyncio.Lock()
+        self._stopping = asyncio.Event()
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+        self.deferred = 0
+        self.breaker_deferred = 0
+
+    async def start(self):
+        self._stopping.clear()
+        recovered = await self._db_call(crud.recover_outbox)
+        if recovered:
+            print(f"Outbox: {recovered} in-flight rows returned to the queue")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10):
+        self._stopping.set()
+        if not self._tasks:
+            return
+        # Даём текущим отправкам завершиться, остальное подберёт следующий запуск
+        done, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+
+    @staticmethod
+    async def _db_call(func, *args, **kwargs):
+        async with AsyncSessionLocal() as db:
+            return await func(db, *args, **kwargs)
+
+    def _busy_domains(self) -> List[str]:
+        busy = [domain for domain, count in self._in_flight.items() if count >= self.per_domain]
+        # Строки доменов с открытым автоматом не забираем, пока он не начнёт пропускать пробы
+        return busy + breakers.open_domains()
+
+    async def _defer_open_circuit(self, row: Dict[str, Any]):
+        # Домен нездоров: строка ждёт его без траты попыток
+        self.breaker_deferred += 1
+        delay = max(breakers.get(row['domain']).retry_in(), OUTBOX_RATE_LIMIT_DELAY)
+        await self._db_call(
+            crud.finish_outbox, row['id'], status='pending',
+            next_attempt_at=datetime.now(timezone.utc) + timedelta(seconds=delay),
+        )
+
+    async def _claim(self) -> Optional[Dict[str, Any]]:
+        # Пока ждём базу, другие воркеры тоже забирают строки: без блокировки
+        # список занятых доменов у них устаревший и OUTBOX_PER_DOMAIN превышается
+        async with self._claim_lock:
+            rows = await self._db_call(crud.claim_outbox, 1, self.lease_seconds, self._busy_domains())
+            if not rows:
+                return None
+            domain = rows[0]['domain']
+            self._in_flight[domain] = self._in_flight.get(domain, 0) + 1
+            return rows[0]
+
+    async def _worker(self):
+        while not self._stopping.is_set():
+            try:
+                row = await self._claim()
+            except Exception as e:
+                print(f"Outbox claim failed: {str(e)}")
+                row = None
+            if row is None:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            domain = row['domain']
+            try:
+                await self._dispatch(row)
+            except Exception as e:
+                print(f"Outbox dispatch of {row['id']} failed: {str(e)}")
+            finally:
+                self._in_flight[domain] -= 1
+
+    async def _dispatch(self, row: Dict[str, Any]):
+        now = datetime.now(timezone.utc)
+        if breakers.get(row['domain']).retry_in() > 0:
+            await self._defer_open_circuit(row)
+            return
+        if not await limiter.try_acquire(domain=row['domain'], event=row['elma_tail']):
+            # Токена нет — откладываем строку, попытка не засчитывается
+            self.deferred += 1
+            await self._db_call(
+                crud.finish_outbox, row['id'], status='pending',
+                next_attempt_at=now + timedelta(seconds=OUTBOX_RATE_LIMIT_DELAY),
+            )
+            return
+
+        response_data = await forward_to_domain(
+            row['domain'],
+            method=row['method'],
+            elma_tail=row['elma_tail'],
+            headers_dict=json.loads(row['headers']),
+            bodyObj=json.loads(row['body']),
+            path_params=row['path_params'],
+            query_params=json.loads(row['query_params']),
+            rate_limited=False,
+        )
+        if response_data.get('circuit_open'):
+            # Автомат открылся или все пробы уже заняты, пока строка ждала
+            await self._defer_open_circuit(row)
+            return
+        attempts = (row['attempts'] or 0) + 1
+        status_code = response_data.get('status_code')
+        values: Dict[str, Any] = dict(attempts=attempts, last_status_code=status_code)
+
+        if 200 <= status_code < 300:
+            self.delivered += 1
+            values.update(status='done', last_error=None)
+        elif status_code in PERMANENT_STATUS_CODES or attempts >= self.max_attempts:
+            self.failed += 1
+            values.update(status='failed', last_error=str(response_data.get('payload'))[:1000])
+        else:
+            self.retried += 1
+            values.update(
+                status='pending',
+                last_error=str(response_data.get('payload'))[:1000],
+                next_attempt_at=datetime.now(timezone.utc) + timedelta(seconds=backoff_delay(attempts)),
+            )
+        await self._db_call(crud.finish_outbox, row['id'], **values)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'mode': FORWARD_MODE,
+            'workers': len(self._tasks),
+            'per_domain': self.per_domain,
+            'in_flight': dict(self._in_flight),
+            'delivered': self.delivered,
+            'retried': self.retried,
+            'failed': self.failed,
+            'deferred': self.deferred,
+            'breaker_deferred': self.breaker_deferred,
+        }
+
+
+dispatcher = OutboxDispatcher(
+    workers=OUTBOX_WORKERS,
+    per_domain=OUTBOX_PER_DOMAIN,
+    max_attempts=OUTBOX_MAX_ATTEMPTS,
+    poll_interval=OUTBOX_POLL_INTERVAL,
+    lease_seconds=OUTBOX_LEASE_SECONDS,
+)
@@ -0,0 +1,305 @@
+"""Партиции logs по времени и удаление старых логов целыми партициями.
+
+Таблица logs в Postgres секционирована по RANGE ("timestamp"): одна партиция
+на день (или неделю, LOG_PARTITION_INTERVAL=week), плюс logs_default для строк
+без времени. Фоновая задача заранее создаёт партиции на LOG_PARTITION_PREMAKE
+интервалов вперёд и по LOG_RETENTION_DAYS удаляет (или отсоединяет) целиком
+партиции, которые полностью старше срока хранения.
+
+Ручной запуск:
+
+    python partitions.py maintain
+    python partitions.py purge --end 2024-01-01T00:00:00+00:00 [--start ...] [--batch-size 5000] [--sleep 0.05]
+
+Перевод существующей таблицы — шаг migrate_partitioning в migrations.py.
+"""
+import argparse
+import asyncio
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import Column, Index, MetaData, Table, inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+import crud
+import models
+from database import AsyncSessionLocal, async_engine, engine
+
+env = os.environ
+
+LOG_PARTITION_INTERVAL = env.get('LOG_PARTITION_INTERVAL', 'day')
+LOG_PARTITION_PREMAKE = int(env.get('LOG_PARTITION_PREMAKE', 7))
+# 0 — хранить логи без ограничения
+LOG_RETENTION_DAYS = int(env.get('LOG_RETENTION_DAYS', 0))
+# drop — удалить партицию, detach — отсоединить и оставить таблицей для выгрузки в архив
+LOG_RETENTION_MODE = env.get('LOG_RETENTION_MODE', 'drop')
+LOG_PARTITION_CHECK_INTERVAL = float(env.get('LOG_PARTITION_CHECK_INTERVAL', 3600))
+
+DEFAULT_PARTITION = 'logs_default'
+SEQUENCE = 'logs_id_seq'
+# Партиции создаёт и удаляет один воркер за раз
+MAINTENANCE_LOCK_ID = 70150001
+
+_BOUND = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def partition_step(interval: str) -> timedelta:
+    return timedelta(weeks=1) if interval == 'week' else timedelta(days=1)
+
+
+def partition_start(moment: datetime, interval: str) -> datetime:
+    """Начало интервала (в UTC), в который попадает moment; недели начинаются с понедельника."""
+    moment = moment.astimezone(timezone.utc)
+    start = datetime(moment.year, moment.month, moment.day, tzinfo=timezone.utc)
+    if interval == 'week':
+        start -= timedelta(days=start.weekday())
+    return start
+
+
+def partition_name(start: datetime) -> str:
+    return f"logs_p{start:%Y%m%d}"
+
+
+def partitioned_logs_table(metadata: MetaData) -> Table:
+    """Описание logs как секционированной таблицы с теми же колонками и индексами, что в models.Logs.
+
+    Уникальный ключ у секционированной таблицы обязан включать "timestamp", поэтому
+    первичного ключа нет: id по-прежнему выдаёт последовательность, а ищется он
+    через обычный индекс ix_logs_id.
+    """
+    source = models.Logs.__table__
+    columns = [
+        Column(column.name, column.type, server_default=text(f"nextval('{SEQUENCE}')"), nullable=False)
+        if column.name == 'id' else Column(column.name, column.type)
+        for column in source.columns
+    ]
+    table = Table(source.name, metadata, *columns, postgresql_partition_by='RANGE ("timestamp")')
+    for index in source.indexes:
+        Index(index.name, *[table.c[column.name] for column in index.columns], **index.dialect_kwargs)
+    return table
+
+
+def is_partitioned(conn: Connection, table: str = 'logs') -> bool:
+    return bool(conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p "
+        "JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :table)"
+    ), {'table': table}).scalar())
+
+
+def list_partitions(conn: Connection) -> List[Tuple[str, Optional[datetime], Optional[datetime]]]:
+    """(имя, начало, конец) для каждой партиции logs; у logs_default границ нет."""
+    rows = conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'logs' ORDER BY c.relname"
+    )).all()
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND.search(bound or '')
+        if match:
+            partitions.append((name, datetime.fromisoformat(match.group(1)), datetime.fromisoformat(match.group(2))))
+        else:
+            partitions.append((name, None, None))
+    return partitions
+
+
+def create_partition(conn: Connection, start: datetime, interval: str) -> bool:
+    name = partition_name(start)
+    if conn.execute(text("SELECT to_regclass(:name)"), {'name': name}).scalar():
+        return False
+    end = start + partition_step(interval)
+    bounds = {'start': start, 'end': end}
+    # Строки, попавшие в logs_default раньше, чем появилась партиция, переносим в неё,
+    # иначе Postgres не даст создать партицию с пересекающимся диапазоном
+    stray = conn.execute(text(
+        f'SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE "timestamp" >= :start AND "timestamp" < :end)'
+    ), bounds).scalar()
+    if stray:
+        conn.execute(text(f"CREATE TEMP TABLE logs_stray (LIKE {DEFAULT_PARTITION}) ON COMMIT DROP"))
+        conn.execute(text(
+            f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE "timestamp" >= :start AND "timestamp" < :end RETURNING *) '
+            'INSERT INTO logs_stray SELECT * FROM moved'
+        ), bounds)
+    conn.execute(text(
+        f"CREATE TABLE {name} PARTITION OF logs "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+    if stray:
+        conn.execute(text("INSERT INTO logs SELECT * FROM logs_stray"))
+        conn.execute(text("DROP TABLE logs_stray"))
+    return True
+
+
+def ensure_partitions(conn: Connection, interval: str, premake: int,
+                      since: Optional[datetime] = None, now: Optional[datetime] = None) -> List[str]:
+    """Создаёт недостающие партиции от since (по умолчанию — текущий интервал) до now + premake интервалов."""
+    now = now or datetime.now(timezone.utc)
+    step = partition_step(interval)
+    start = partition_start(since or now, interval)
+    last = partition_start(now, interval) + step * premake
+    created = []
+    while start <= last:
+        if create_partition(conn, start, interval):
+            created.append(partition_name(start))
+        start += step
+    return created
+
+
+def apply_retention(conn: Connection, retention_days: int, mode: str, now: Optional[datetime] = None) -> List[str]:
+    """Удаляет или отсоединяет партиции, целиком лежащие до now - retention_days."""
+    if retention_days <= 0:
+        return []
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=retention_days)
+    removed = []
+    for name, start, end in list_partitions(conn):
+        if end is None or end > cutoff:
+            continue
+        if mode == 'detach':
+            conn.execute(text(f"ALTER TABLE logs DETACH PARTITION {name}"))
+        else:
+            conn.execute(text(f"DROP TABLE {name}"))
+        removed.append(name)
+    return removed
+
+
+def maintain(conn: Connection, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Один проход обслуживания: будущие партиции и retention. Ничего не делает, если logs не секционирована."""
+    conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {'id': MAINTENANCE_LOCK_ID})
+    if not is_partitioned(conn):
+        return {'partitioned': False, 'created': [], 'removed': []}
+    return {
+        'partitioned': True,
+        'created': ensure_partitions(conn, LOG_PARTITION_INTERVAL, LOG_PARTITION_PREMAKE, now=now),
+        'removed': apply_retention(conn, LOG_RETENTION_DAYS, LOG_RETENTION_MODE, now=now),
+    }
+
+
+def create_logs_table(db_engine: Engine):
+    """В пустой базе Postgres сразу создаёт logs секционированной; create_all её потом пропустит."""
+    if db_engine.dialect.name != 'postgresql':
+        return
+    with db_engine.begin() as conn:
+        if inspect(conn).has_table('logs'):
+            return
+        conn.execute(text(f"CREATE SEQUENCE IF NOT EXISTS {SEQUENCE}"))
+        partitioned_logs_table(MetaData()).create(conn)
+        conn.execute(text(f"ALTER SEQUENCE {SEQUENCE} OWNED BY logs.id"))
+        conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF logs DEFAULT"))
+        ensure_partitions(conn, LOG_PARTITION_INTERVAL, LOG_PARTITION_PREMAKE)
+    print("Created partitioned logs table")
+
+
+async def purge_logs(db: AsyncSession, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                     batch_size: int = 5000, sleep: float = 0.05) -> int:
+    """Удаляет логи в [start, end): целиком покрытые партиции очищаются TRUNCATE,
+    остаток удаляется пачками с паузами, без одного большого DELETE.
+
+    Возвращает число строк, удалённых пачками (строки из очищенных партиций не считаются).
+    """
+    if db.bind.dialect.name == 'postgresql':
+        connection = await db.connection()
+        partitions = await connection.run_sync(lambda conn: list_partitions(conn) if is_partitioned(conn) else [])
+        for name, lower, upper in partitions:
+            if lower is None:
+                covered = start is None and end is None
+            else:
+                covered = (start is None or start <= lower) and (end is None or upper <= end)
+            if covered:
+                # TRUNCATE блокирует только эту партицию и не пишет построчно в WAL
+                await db.execute(text(f"TRUNCATE {name}"))
+        await db.commit()
+
+    criteria = []
+    if start is not None:
+        criteria.append(models.Logs.timestamp >= start)
+    if end is not None:
+        criteria.append(models.Logs.timestamp < end)
+    return await crud.delete_logs(db, *criteria, batch_size=batch_size, sleep=sleep)
+
+
+class PartitionMaintainer:
+    """Периодически запускает maintain() в фоне процесса приложения."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.last_run: Optional[datetime] = None
+        self.last_result: Dict[str, Any] = {}
+        self.errors = 0
+
+    async def start(self):
+        if self._task is None and async_engine is not None and async_engine.dialect.name == 'postgresql':
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run_once(self) -> Dict[str, Any]:
+        async with async_engine.begin() as conn:
+            result = await conn.run_sync(maintain)
+        self.last_run = datetime.now(timezone.utc)
+        self.last_result = result
+        if result['created'] or result['removed']:
+            print(f"Log partitions: created {result['created']}, removed {result['removed']}")
+        return result
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                print(f"Log partition maintenance failed: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'interval': LOG_PARTITION_INTERVAL,
+            'premake': LOG_PARTITION_PREMAKE,
+            'retention_days': LOG_RETENTION_DAYS,
+            'retention_mode': LOG_RETENTION_MODE,
+            'last_run': self.last_run.isoformat() if self.last_run else None,
+            'last_result': self.last_result,
+            'errors': self.errors,
+        }
+
+
+partition_maintainer = PartitionMaintainer(interval=LOG_PARTITION_CHECK_INTERVAL)
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+async def _purge(args):
+    start = _parse_time(args.start)
+    end = _parse_time(args.end)
+    async with AsyncSessionLocal() as db:
+        deleted = await purge_logs(db, start, end, args.batch_size, args.sleep)
+    print(f"Deleted {deleted} rows in batches")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Log partitions maintenance")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('maintain', help='создать будущие партиции и применить retention')
+    purge = subparsers.add_parser('purge', help='удалить логи за диапазон времени')
+    purge.add_argument('--start', help='ISO-время начала, включительно')
+    purge.add_argument('--end', help='ISO-время конца, не включая')
+    purge.add_argument('--batch-size', type=int, default=5000)
+    purge.add_argument('--sleep', type=float, default=0.05, help='пауза между пачками, секунд')
+    args = parser.parse_args()
+    if args.command == 'maintain':
+        with engine.begin() as conn:
+            print(maintain(conn))
+    else:
+        asyncio.run(_purge(args))
@@ -1,4 +1,209 @@
-from aiolimiter import AsyncLimiter
+import asyncio
+import fcntl
+import hashlib
+import os
+import tempfile
+import time
+from typing import Dict, Optional, Tuple
+from sqlalchemy import text
+
+env = os.environ
+
+# Лимиты задаются строкой "запросов/секунд", пустая строка отключает лимит
+RATE_LIMIT_DOMAIN = env.get('RATE_LIMIT_DOMAIN', '1/1')
+RATE_LIMIT_EVENT = env.get('RATE_LIMIT_EVENT', '')
+# memory — только текущий процесс, file — все воркеры на одной машине,
+# postgres — все воркеры и инстансы, которые смотрят в одну базу
+RATE_LIMIT_BACKEND = env.get('RATE_LIMIT_BACKEND', 'file')
+RATE_LIMIT_DIR = env.get('RATE_LIMIT_DIR', os.path.join(tempfile.gettempdir(), 'showhttpreq-ratelimit'))
+
+
+def parse_rule(rule: str) -> Optional[Tuple[float, float]]:
+    if not rule:
+        return None
+    max_rate, _, period = rule.partition('/')
+    return float(max_rate), float(period or 1)
+
+
+def take_token(tokens: float, updated: float, now: float, max_rate: float, period: float,
+               block: bool) -> Tuple[float, Optional[float]]:
+    """Один шаг token bucket. Возвращает новое число токенов и время ожидания.
+
+    При block=True токен резервируется заранее (tokens уходит в минус), а
+    вызывающий ждёт возвращённое число секунд. При block=False и пустом ведре
+    возвращается None, состояние не меняется.
+    """
+    tokens = min(max_rate, tokens + (now - updated) * max_rate / period)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    if not block:
+        return tokens, None
+    return tokens - 1, (1 - tokens) * period / max_rate
+
+
+class MemoryBucketStore:
+    """Ведра в памяти процесса."""
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    async def take(self, key: str, max_rate: float, period: float, block: bool) -> Optional[float]:
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (max_rate, now))
+        tokens, wait = take_token(tokens, updated, now, max_rate, period, block)
+        self._buckets[key] = (tokens, now)
+        return wait
+
+    async def refund(self, key: str):
+        tokens, updated = self._buckets[key]
+        self._buckets[key] = (tokens + 1, updated)
+
+
+class FileBucketStore:
+    """Ведра в маленьких файлах под flock: общее состояние для воркеров одной машины."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def _update(self, key: str, max_rate: float, period: float, block: bool,
+                refund: bool = False) -> Optional[float]:
+        fd = os.open(self._path(key), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            now = time.time()
+            raw = os.pread(fd, 64, 0).split()
+            tokens, updated = (float(raw[0]), float(raw[1])) if len(raw) == 2 else (max_rate, now)
+            if refund:
+                tokens, wait = tokens + 1, None
+                now = updated
+            else:
+                tokens, wait = take_token(tokens, updated, now, max_rate, period, block)
+            data = f"{tokens!r} {now!r}".encode()
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, data, 0)
+            return wait
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    async def take(self, key: str, max_rate: float, period: float, block: bool) -> Optional[float]:
+        # flock ждёт другие воркеры — в отдельном потоке, чтобы не держать event loop
+        return await asyncio.to_thread(self._update, key, max_rate, period, block)
+
+    async def refund(self, key: str):
+        await asyncio.to_thread(self._update, key, 0, 1, False, refund=True)
+
+
+class PostgresBucketStore:
+    """Ведра в таблице rate_buckets, доступ к строке сериализуется advisory lock."""
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+
+    async def _update(self, key: str, max_rate: float, period: float, block: bool,
+                      refund: bool = False) -> Optional[float]:
+        async with self.session_factory() as db:
+            await db.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {'key': key})
+            result = await db.execute(
+                text("SELECT tokens, updated FROM rate_buckets WHERE key = :key"), {'key': key}
+            )
+            row = result.first()
+            now = time.time()
+            tokens, updated = (row.tokens, row.updated) if row else (max_rate, now)
+            if refund:
+                tokens, wait = tokens + 1, None
+                now = updated
+            else:
+                tokens, wait = take_token(tokens, updated, now, max_rate, period, block)
+            await db.execute(text(
+                "INSERT INTO rate_buckets (key, tokens, updated) VALUES (:key, :tokens, :updated) "
+                "ON CONFLICT (key) DO UPDATE SET tokens = :tokens, updated = :updated"
+            ), {'key': key, 'tokens': tokens, 'updated': now})
+            await db.commit()
+        return wait
+
+    async def take(self, key: str, max_rate: float, period: float, block: bool) -> Optional[float]:
+        return await self._update(key, max_rate, period, block)
+
+    async def refund(self, key: str):
+        await self._update(key, 0, 1, False, refund=True)
+
+
+class RateLimiter:
+    """Лимиты на пересылку: отдельное ведро на каждый домен и на каждый eventName.
+
+    acquire() ждёт токены во всех подходящих ведрах, try_acquire() возвращает
+    False сразу, если хотя бы одно ведро пустое, и ничего не списывает.
+    """
+
+    def __init__(self, store, domain_rule: Optional[Tuple[float, float]],
+                 event_rule: Optional[Tuple[float, float]]):
+        self.store = store
+        self.domain_rule = domain_rule
+        self.event_rule = event_rule
+        self.acquired = 0
+        self.rejected = 0
+        self.waited_seconds = 0.0
+
+    def _buckets(self, domain: Optional[str], event: Optional[str]):
+        buckets = []
+        if domain and self.domain_rule:
+            buckets.append((f"domain:{domain}", self.domain_rule))
+        if event and self.event_rule:
+            buckets.append((f"event:{event}", self.event_rule))
+        return buckets
+
+    async def acquire(self, domain: Optional[str] = None, event: Optional[str] = None):
+        wait = 0.0
+        for key, (max_rate, period) in self._buckets(domain, event):
+            wait = max(wait, await self.store.take(key, max_rate, period, True))
+        self.acquired += 1
+        if wait > 0:
+            self.waited_seconds += wait
+            await asyncio.sleep(wait)
+
+    async def try_acquire(self, domain: Optional[str] = None, event: Optional[str] = None) -> bool:
+        taken = []
+        for key, (max_rate, period) in self._buckets(domain, event):
+            if await self.store.take(key, max_rate, period, False) is None:
+                # Возвращаем уже списанные токены, чтобы не терять их зря
+                for taken_key in taken:
+                    await self.store.refund(taken_key)
+                self.rejected += 1
+                return False
+            taken.append(key)
+        self.acquired += 1
+        return True
+
+    def stats(self):
+        return {
+            'backend': type(self.store).__name__,
+            'domain_rule': self.domain_rule,
+            'event_rule': self.event_rule,
+            'acquired': self.acquired,
+            'rejected': self.rejected,
+            'waited_seconds': round(self.waited_seconds, 3),
+        }
+
+
+def make_store(backend: str):
+    if backend == 'memory':
+        return MemoryBucketStore()
+    if backend == 'postgres':
+        from database import AsyncSessionLocal
+        if AsyncSessionLocal is not None:
+            return PostgresBucketStore(AsyncSessionLocal)
+        print("RATE_LIMIT_BACKEND=postgres needs a database (LOG_STORAGE=memory), using file buckets")
+    return FileBucketStore(RATE_LIMIT_DIR)
+
 
 # Создаем один экземпляр лимитера, который будет использоваться во всем проекте
-limiter = AsyncLimiter(max_rate=1, time_period=1)
+limiter = RateLimiter(
+    make_store(RATE_LIMIT_BACKEND),
+    domain_rule=parse_rule(RATE_LIMIT_DOMAIN),
+    event_rule=parse_rule(RATE_LIMIT_EVENT),
+)
@@ -0,0 +1,20 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from log_writer import log_writer
+from startup import startup
+
+router = APIRouter()
+
+# Пробы платформы не считаются первым запросом
+PROBE_PATHS = ('/healthz', '/readyz')
+
+@router.get("/healthz", operation_id="healthz")
+async def healthz():
+    # Живость: процесс отвечает, база не проверяется, чтобы её сбой не перезапускал инстансы
+    return {'status': 'ok'}
+
+@router.get("/readyz", operation_id="readyz")
+async def readyz():
+    # Готовность: схема подготовлена, база отвечает, очередь логов работает
+    result = await startup.readiness(log_writer.running)
+    return JSONResponse(status_code=200 if result['ready'] else 503, content=result)
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import os
+from typing import Any, Dict, Optional
+from fastapi import APIRouter, Header, Query, Request
+from fastapi.responses import StreamingResponse
+import crud
+from live_tail import live_tail
+from storage import log_store
+from routers.logs import flatDbAnswerItem, sort_result_item, PAGE_LIMIT_MAX
+from json_response import encode_json
+
+router = APIRouter()
+
+LIVE_TAIL_KEEPALIVE = float(os.environ.get('LIVE_TAIL_KEEPALIVE', 15))
+
+def format_event(row: Dict[str, Any]) -> str:
+    item = sort_result_item(flatDbAnswerItem(dict(row)))
+    data = encode_json(item).decode()
+    return f"id: {row['id']}\nevent: log\ndata: {data}\n\n"
+
+@router.get("/x/logs/live", operation_id="logs_live")
+async def logs_live(
+    request: Request,
+    eventName: Optional[str] = None,
+    eventId: Optional[str] = None,
+    ticketId: Optional[str] = None,
+    domain: Optional[str] = None,
+    ip: Optional[str] = None,
+    last_id: Optional[int] = Query(None, description="Дослать строки после этого id перед live-потоком"),
+    last_event_id: Optional[int] = Header(None, alias="Last-Event-ID"),
+):
+    """Server-Sent Events с новыми строками логов вместо опроса /x/logs_after."""
+    fields = {
+        name: value for name, value in dict(
+            eventName=eventName, eventId=eventId, ticketId=ticketId, domain=domain, ip=ip,
+        ).items() if value is not None
+    }
+    filters = {crud.FILTER_COLUMNS[name].key: value for name, value in fields.items()}
+    # Подписываемся до чтения пропущенного, чтобы не потерять строки между ними
+    subscriber = live_tail.subscribe(filters)
+
+    resume_id = last_event_id if last_event_id is not None else last_id
+    missed = []
+    if resume_id is not None:
+        missed = await log_store.find({'fields': fields, 'min_id': resume_id + 1}, order_desc=False, limit=PAGE_LIMIT_MAX)
+
+    async def stream():
+        try:
+            sent_id = resume_id or 0
+            for row in missed:
+                sent_id = row['id']
+                yield format_event(row)
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), LIVE_TAIL_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                if subscriber.dropped:
+                    # Клиент не успевал читать; он может дочитать пропуск через /x/logs/page
+                    yield f"event: lagged\ndata: {json.dumps({'dropped': subscriber.dropped})}\n\n"
+                    subscriber.dropped = 0
+                if event.row['id'] <= sent_id:
+                    continue
+                sent_id = event.row['id']
+                yield event.encode(format_event)
+        finally:
+            live_tail.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,16 +1,22 @@
+import asyncio
+import base64
 import csv
+import io
 import os
 import json
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from functools import reduce
-import crud, models, schemas
-from dependencies import get_db
-from typing import List, Any, Dict
-from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
+import schemas
+from typing import List, Any, Dict, Optional
+from datetime import datetime, timezone
 import logging
-from pprint import pformat
-from sqlalchemy import cast, DateTime
+from json_response import json_response, encode_json
+from archive import find_log_rows, log_archive
+from event_meta import extract_event_meta
+from body_capture import row_body
+from storage import log_store
+from row_cache import row_cache
+from flattening import flatten_row, flatten_rows, page_columns
 
 router = APIRouter()
 
@@ -19,14 +25,21 @@ log_dir = "logs"
 os.makedirs(log_dir, exist_ok=True)
 log_file_path = os.path.join(log_dir, "logs_parsed_by_page.log")
 
+# Верхняя граница limit для всех эндпоинтов со страницами
+PAGE_LIMIT_MAX = 1000
+
+# Колонки, которые просмотрщик показывает первыми и в этом порядке
+MANDATORY_KEYS = ['id', 'ip', 'domain', 'eventName', 'timestamp', 'eventTimestamp','eventId','internalId','number','ticketId','isTriggeredViaApi','body_json']
+
+# Сколько строк выгрузка читает из серверного курсора за раз
+LOG_EXPORT_BATCH_SIZE = int(os.environ.get('LOG_EXPORT_BATCH_SIZE', 1000))
+
+# Колоночный формат страницы: {"columns": [...], "rows": [[...], ...]}
+COLUMNAR_MEDIA_TYPE = 'application/vnd.showhttpreq.columnar+json'
+
 logging.basicConfig(filename=log_file_path, level=logging.INFO, 
                     format='%(asctime)s %(levelname)s: %(message)s')
 
-def default_serializer(obj):
-    if isinstance(obj, datetime):
-        return obj.isoformat()
-    return str(obj)
-
 def replace_newlines(obj):
     if isinstance(obj, str):
         return obj.replace('\n', '\\u000A').replace('"','""')
@@ -37,189 +50,128 @@ def replace_newlines(obj):
     else:
         return obj
 
-# Универсальная функция для обработки элементов логов
+# Универсальная функция для обработки элементов логов; правила по eventName — в flattening.EVENT_SPECS
 def flatDbAnswerItem(item: Dict[str, Any]) -> Dict[str, Any]:
-    logging.info(f'Обработка item: {json.dumps(item, ensure_ascii=False, default=json.JSONEncoder().default, indent=4)}')
-
-    # все названия колонок item
-    column_name = str(item.keys())
-
-    # Определяем обязательные ключи
-    id = item.get('id', 'Not found')
-    headers = json.loads(item.get('headers') or '{"x-origin-domain": "Not found domain","x-forwarded-for": "Not found id"}')
-    ip = headers.get('x-forwarded-for')
-    domain = headers.get('x-origin-domain')
-    if not domain and ip == "52.28.237.77":
-        domain = "CASAVI"
-    timestamp = item.get('timestamp', 'Not found')
-    headers = item.get('headers')
-
-    # Определяем eventName и eventTimestamp и заполняем их или "Not found" по умолчанию
-    body = item.get('body', 'Not found body')
-    body_json = {} 
-
-    if isinstance(body, str):
-        try:
-            body_json = json.loads(body)
-        except json.JSONDecodeError:
-            body_json = body
-
-    if isinstance(body_json, dict):
-        event_name = body_json.get('eventName') \
-            # or body_json.get('body') \
-            # and body_json.get('body').get('eventName',event_name)\
-            # or event_name
-        event_timestamp = body_json.get('eventTimestamp') \
-            # or body_json.get('body') \
-            # and body_json.get('body').get('eventTimestamp',event_timestamp)\
-            # or event_timestamp
-        event_id = body_json.get('eventId') \
-            # or body_json.get('body') \
-            # and body_json.get('body').get('eventId',event_timestamp)\
-            # or event_id
-        isTriggeredViaApi = body_json.get('isTriggeredViaApi') != None and str(int(body_json.get('isTriggeredViaApi'))) or 'None'
-        internal_id = body_json.get('payload') \
-            and body_json.get('payload').get('internalId') 
-            # body_json.get('internalId') \
-            # or body_json.get('body') \
-            # and body_json.get('body').get('internalId') \
-            # or body_json.get('payload') \
-            # and body_json.get('payload').get('internalId')\
-            # or internal_id
-        number = body_json.get('payload') \
-            and body_json.get('payload').get('number') 
-            # body_json.get('number') \
-            # or body_json.get('body') \
-            # and body_json.get('body').get('number') \
-            # or body_json.get('payload') \
-            # and body_json.get('payload').get('number') \
-            # or number
-        ticket_id = body_json.get('payload') \
-            and body_json.get('payload').get('ticketId')
-            # body_json.get('ticketId') \
-            # or body_json.get('body') \
-            # and body_json.get('body').get('ticketId') \
-            # or body_json.get('payload') \
-            # and body_json.get('payload').get('ticketId')\
-            # or ticket_id
-
-    logging.info(f'Определён eventName: {event_name}')
-    logging.info(f'Определён eventTimestamp: {event_timestamp}')
-
-    # Добавляем обязательные ключи на верхний уровень
-    result = {
-        'id': id,
-        'ip': ip,
-        'domain': domain,
-        'eventName': event_name,
-        'timestamp': timestamp,
-        'eventTimestamp': event_timestamp,
-        'column_names': column_name,
-        'body_json': body_json,
-        'eventId': event_id,
-        'ticketId': ticket_id,
-        'internalId': internal_id,
-        'number': number,
-        'ticketId': ticket_id,
-        'headers': headers,
-        'isTriggeredViaApi': isTriggeredViaApi,
-    }
-
-    # print(body)
-
-    if event_name == 'ticket_updated':
-        pass
-    elif event_name == 'ELMA_event_ticket update':
-        if 'body' in item and isinstance(body_json, dict):
-            result.update(add_prefix_to_keys(body_json, 'body'))
-            del item['body']
-        if 'payload' in item and isinstance(item['payload'], dict):
-            result.update(add_prefix_to_keys(item['payload'], 'payload'))
-            del item['payload']
-        second_level_fields = ['headers', 'query_params']
-        result['second_level'] = {key: item[key] for key in second_level_fields if key in item}
-    elif event_name == 'ticket_comment_created':
-        second_level_fields = ['path_params', 'headers']
-    elif event_name == 'ticket_created':
-        if 'body' in item and isinstance(body_json, dict):
-            result.update(add_prefix_to_keys(body_json, 'body'))
-            del item['body']
-        second_level_fields = ['headers', 'query_params']
-        result['second_level'] = {key: item[key] for key in second_level_fields if key in item}
-    elif event_name == 'document_downloaded':
-        if 'body' in item and isinstance(body_json, dict):
-            result.update(add_prefix_to_keys(body_json, 'body'))
-            del item['body']
-        if 'payload' in item and isinstance(item['payload'], dict):
-            result.update(add_prefix_to_keys(item['payload'], 'payload'))
-            del item['payload']
-    else:
-        if 'body' in item and isinstance(body_json, dict):
-            result.update(add_prefix_to_keys(body_json, 'body'))
-            del item['body']
-        if 'payload' in item and isinstance(item['payload'], dict):
-            result.update(add_prefix_to_keys(item['payload'], 'payload'))
-            del item['payload']
+    return flatten_row(item)
 
-    # logging.info(f'Результат обработки item: {json.dumps(result, ensure_ascii=False, default=json.JSONEncoder().default, indent=4)}')
-    return result
+def parse_datetime_param(value: str) -> datetime:
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use ISO format.")
+    # Даты без зоны считаем UTC, как и хранимые timestamp
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
 
-def add_prefix_to_keys(data: Dict[str, Any], prefix: str) -> Dict[str, Any]:
-    return {f"{prefix}_{key}": value for key, value in data.items()}
+def parse_json_param(name: str, value: str) -> Any:
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail=f"{name} must be valid JSON")
+
+def parse_where(where: List[str]) -> Dict[str, Any]:
+    # "payload.ticketId=123" -> {"payload": {"ticketId": 123}} для поиска через @>
+    contains: Dict[str, Any] = {}
+    for condition in where:
+        path, sep, raw_value = condition.partition('=')
+        if not sep or not path:
+            raise HTTPException(status_code=400, detail=f"Invalid where condition: {condition}")
+        try:
+            value = json.loads(raw_value)
+        except json.JSONDecodeError:
+            value = raw_value
+        node = contains
+        keys = path.split('.')
+        for key in keys[:-1]:
+            node = node.setdefault(key, {})
+            if not isinstance(node, dict):
+                raise HTTPException(status_code=400, detail=f"Conflicting where condition: {condition}")
+        node[keys[-1]] = value
+    return contains
+
+def page_format(request: Request, format: str = Query('rows', pattern='^(rows|columnar)$',
+                                                     description="columnar — список колонок и строки-массивы")) -> str:
+    # Колоночный формат включается явно: ?format=columnar или Accept с его media type
+    if format == 'columnar' or COLUMNAR_MEDIA_TYPE in request.headers.get('accept', ''):
+        return 'columnar'
+    return 'rows'
+
+def columnar_page(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # Имена ключей передаются один раз; отсутствующий в строке ключ — null, без 'Not found'
+    extra = sorted(page_columns(items).difference(MANDATORY_KEYS))
+    columns = MANDATORY_KEYS + extra
+    return {'columns': columns, 'rows': [[item.get(column) for column in columns] for item in items]}
+
+def page_response(request: Request, items: List[Dict[str, Any]], newlines_escaped: bool = False) -> Response:
+    return json_response(request, columnar_page(items), newlines_escaped=newlines_escaped, media_type=COLUMNAR_MEDIA_TYPE)
+
+def flatten_page(dbanswer: List[Dict[str, Any]], format: str = 'rows'):
+    # Плоские строки с первой строкой-заголовком, как во всех /x/ эндпоинтах
+    unsortedResult = flatten_rows(dbanswer)
+    if format == 'columnar':
+        return columnar_page(unsortedResult)
+    headers = {v: v for v in page_columns(unsortedResult)}
+    unsortedResult.insert(0, headers)
+    return list(map(sort_result_item, unsortedResult))
 
 @router.get("/x/logs", response_model=List[schemas.Log], operation_id="read_logs")
-async def read_logs(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    logs = crud.get_logs(db, skip=skip, limit=limit)
+async def read_logs(skip: int = 0, limit: int = 10):
+    logs = await find_log_rows({}, order_desc=False, limit=limit, offset=skip)
     if not logs:
         raise HTTPException(status_code=404, detail="Logs not found")
-    return logs
+    return [{**log, 'body': row_body(log)} for log in logs]
 
 @router.post("/x/logs", response_model=schemas.Log, operation_id="create_log")
-async def create_log(log: schemas.LogCreate, db: Session = Depends(get_db)):
-    return crud.create_log(db=db, log=log)
+async def create_log(log: schemas.LogCreate):
+    row = dict(**log.dict(), **extract_event_meta(log.headers, log.body))
+    [log_id] = await log_store.insert([row])
+    return {**row, 'id': log_id}
 
 @router.delete("/x/logs", operation_id="delete_logs")
-async def delete_logs(db: Session = Depends(get_db)):
-    crud.delete_logs(db)
-    return {"message": "Logs deleted successfully"}
+async def delete_logs(start: Optional[str] = None, end: Optional[str] = None):
+    # Без границ удаляются все логи; целые партиции очищаются сразу, остальное — пачками
+    start_date = parse_datetime_param(start) if start else None
+    end_date = parse_datetime_param(end) if end else None
+    deleted = await log_store.purge(start=start_date, end=end_date)
+    # Строки, уже переехавшие в архив, удаляются из его сегментов
+    archived = await asyncio.to_thread(log_archive.purge, start_date, end_date) if log_store.archived else 0
+    # id удалённых строк могут достаться новым
+    await row_cache.clear()
+    return {"message": "Logs deleted successfully", "deleted_in_batches": deleted, "deleted_from_archive": archived}
 
 @router.api_route("/x/logs_parsed_by_page/{page_str}", methods=['GET'], operation_id="logs_parsed_by_page")
-async def logs_parsed_by_page(page_str: int, db: Session = Depends(get_db)):
+async def logs_parsed_by_page(page_str: int, request: Request, format: str = Depends(page_format)):
+    # Устаревший эндпоинт, для новых клиентов есть /x/logs/page
     pageSize = 100
     logging.info(f'Запрос на страницу: {page_str}')
     page = int(page_str)
     logging.info(f'Номер страницы: {page}')
+    if page < 1:
+        raise HTTPException(status_code=404, detail='Logs not found')
 
-    columns = models.Logs.__table__.columns.keys()
-
-    dbanswer = db.query(*[getattr(models.Logs, col) for col in columns]) \
-                .filter(models.Logs.id <= (page * pageSize), models.Logs.id > ((page - 1) * pageSize)) \
-                .all()
-
-    dbanswer = [{col: getattr(row, col) for col in columns} for row in dbanswer]
+    # Страница — диапазон id, как и раньше: поиск по индексу id, стоимость не зависит от номера страницы
+    dbanswer = await find_log_rows({'min_id': (page - 1) * pageSize + 1, 'max_id': page * pageSize},
+                                   order_desc=False, limit=pageSize)
     logging.info(f'Количество записей на странице: {len(dbanswer)}')
 
     if not dbanswer:
         logging.error('Записи не найдены')
         raise HTTPException(status_code=404, detail='Logs not found')
 
-    logging.info('Исходные данные из базы данных:')
-    for row in dbanswer:
-        logging.info(json.dumps(row, ensure_ascii=False, default=default_serializer, indent=4))
-
-    unsortedResult = []
-    for ans in dbanswer:
-        item = ans.copy()  
-        flat_item = flatDbAnswerItem(item)
-        unsortedResult.append(flat_item)
+    # Разобранные строки берутся из кэша по id, строки логов не меняются
+    unsortedResult = await row_cache.flatten(dbanswer, flatten_rows)
 
     for item in unsortedResult:
         if '_sa_instance_state' in item:
             del item['_sa_instance_state']
 
+    if format == 'columnar':
+        return page_response(request, unsortedResult, newlines_escaped=True)
+
     logging.info(f'Количество преобразованных записей: {len(unsortedResult)}')
 
-    headers = {v: v for v in list(reduce(lambda allKeys, dict: allKeys.union(dict.keys()), unsortedResult, set()))}
+    headers = {v: v for v in page_columns(unsortedResult)}
     unsortedResult.insert(0, headers)
     result = list(map(sort_result_item, unsortedResult))
 
@@ -229,45 +181,35 @@ async def logs_parsed_by_page(page_str: int, db: Session = Depends(get_db)):
 
     logging.info('Формирование окончательного ответа')
 
-    processed_result = replace_newlines(result)
-
-    return json.loads(json.dumps(processed_result, ensure_ascii=False, indent=4, default=default_serializer))
+    # Экранирование replace_newlines делается прямо по закодированным байтам
+    return json_response(request, result, newlines_escaped=True)
 
 @router.get("/x/logs_last_part", operation_id="logs_last_part")
-async def logs_last_part(db: Session = Depends(get_db)):
+async def logs_last_part(request: Request, format: str = Depends(page_format), limit: int = Query(50, ge=1, le=PAGE_LIMIT_MAX)):
     print('log last part')
-    pageSize = 50
-
-    columns = models.Logs.__table__.columns.keys()
+    pageSize = limit
 
-    dbanswer = db.query(*[getattr(models.Logs, col) for col in columns]) \
-                .order_by(models.Logs.id.desc()) \
-                .limit(pageSize) \
-                .all()
-
-    dbanswer = [{col: getattr(row, col) for col in columns} for row in dbanswer]
+    dbanswer = await find_log_rows({}, limit=pageSize)
     
     if not dbanswer:
         # logging.error('Записи не найдены')
         raise HTTPException(status_code=404, detail='Logs not found')
 
-    logging.info('Исходные данные из базы данных:')
-    # for row in dbanswer:
-        # logging.info(json.dumps(row, ensure_ascii=False, default=default_serializer, indent=4))
+    logging.info(f'Количество записей: {len(dbanswer)}')
 
-    unsortedResult = []
-    for ans in dbanswer:
-        item = ans.copy()
-        flat_item = flatDbAnswerItem(item)
-        unsortedResult.append(flat_item)
+    # Разобранные строки берутся из кэша по id, строки логов не меняются
+    unsortedResult = await row_cache.flatten(dbanswer, flatten_rows)
 
     for item in unsortedResult:
         if '_sa_instance_state' in item:
             del item['_sa_instance_state']
 
+    if format == 'columnar':
+        return page_response(request, unsortedResult, newlines_escaped=True)
+
     # logging.info(f'Количество преобразованных записей: {len(unsortedResult)}')
 
-    headers = {v: v for v in list(reduce(lambda allKeys, dict: allKeys.union(dict.keys()), unsortedResult, set()))}
+    headers = {v: v for v in page_columns(unsortedResult)}
     unsortedResult.insert(0, headers)
     result = list(map(sort_result_item, unsortedResult))
 
@@ -277,43 +219,33 @@ async def logs_last_part(db: Session = Depends(get_db)):
 
     logging.info('Формирование окончательного ответа')
 
-    processed_result = replace_newlines(result)
-
-    return json.loads(json.dumps(processed_result, ensure_ascii=False, indent=4, default=default_serializer))
+    # Экранирование replace_newlines делается прямо по закодированным байтам
+    return json_response(request, result, newlines_escaped=True)
 
 @router.get("/x/logs_after/{last_log_id}", operation_id="logs_after_id")
-async def logs_after_id(last_log_id: int, db: Session = Depends(get_db)):
-    columns = models.Logs.__table__.columns.keys()
-    # Получаем все логи с id меньше указанного
-    dbanswer = db.query(*[getattr(models.Logs, col) for col in columns]) \
-                .filter(models.Logs.id > last_log_id) \
-                .order_by(models.Logs.id.desc()) \
-                .limit(10) \
-                .all()
-
-    dbanswer = [{col: getattr(row, col) for col in columns} for row in dbanswer]
+async def logs_after_id(last_log_id: int, request: Request, format: str = Depends(page_format), limit: int = Query(10, ge=1, le=PAGE_LIMIT_MAX)):
+    # Получаем все логи с id больше указанного
+    dbanswer = await find_log_rows({'min_id': last_log_id + 1}, limit=limit)
     
     if not dbanswer:
         logging.error('Записи не найдены')
         raise HTTPException(status_code=404, detail='Logs not found')
 
-    logging.info('Исходные данные из базы данных:')
-    for row in dbanswer:
-        logging.info(json.dumps(row, ensure_ascii=False, default=default_serializer, indent=4))
+    logging.info(f'Количество записей: {len(dbanswer)}')
 
-    unsortedResult = []
-    for ans in dbanswer:
-        item = ans.copy()
-        flat_item = flatDbAnswerItem(item)
-        unsortedResult.append(flat_item)
+    # Разобранные строки берутся из кэша по id, строки логов не меняются
+    unsortedResult = await row_cache.flatten(dbanswer, flatten_rows)
 
     for item in unsortedResult:
         if '_sa_instance_state' in item:
             del item['_sa_instance_state']
 
+    if format == 'columnar':
+        return page_response(request, unsortedResult, newlines_escaped=True)
+
     logging.info(f'Количество преобразованных записей: {len(unsortedResult)}')
 
-    headers = {v: v for v in list(reduce(lambda allKeys, dict: allKeys.union(dict.keys()), unsortedResult, set()))}
+    headers = {v: v for v in page_columns(unsortedResult)}
     unsortedResult.insert(0, headers)
     result = list(map(sort_result_item, unsortedResult))
 
@@ -323,123 +255,280 @@ async def logs_after_id(last_log_id: int, db: Session = Depends(get_db)):
 
     logging.info('Формирование окончательного ответа')
 
-    processed_result = replace_newlines(result)
-
-    return json.loads(json.dumps(processed_result, ensure_ascii=False, indent=4, default=default_serializer))
+    # Экранирование replace_newlines делается прямо по закодированным байтам
+    return json_response(request, result, newlines_escaped=True)
 
 @router.get("/x/logs_before/{log_id}", response_model=List[Dict[str, Any]], operation_id="get_logs_before")
-async def get_logs_before(log_id: int, db: Session = Depends(get_db)):
-    columns = models.Logs.__table__.columns.keys()
-
-    # Запрос для получения 10 логов, которые меньше предложенного id
-    dbanswer = db.query(*[getattr(models.Logs, col) for col in columns]) \
-                 .filter(models.Logs.id < log_id) \
-                 .order_by(models.Logs.id.desc()) \
-                 .limit(10) \
-                 .all()
+async def get_logs_before(log_id: int, request: Request, format: str = Depends(page_format), limit: int = Query(10, ge=1, le=PAGE_LIMIT_MAX)):
+    # Запрос для получения limit логов, которые меньше предложенного id
+    dbanswer = await find_log_rows({'max_id': log_id - 1}, limit=limit)
 
     if not dbanswer:
         raise HTTPException(status_code=404, detail="Logs not found")
 
     # Преобразуем каждый лог в нужный формат
-    unsortedResult = [flatDbAnswerItem({col: getattr(row, col) for col in columns}) for row in dbanswer]
+    unsortedResult = await row_cache.flatten(dbanswer, flatten_rows)
 
     # Удаляем ключ _sa_instance_state, если он присутствует
     for item in unsortedResult:
         if '_sa_instance_state' in item:
             del item['_sa_instance_state']
 
+    if format == 'columnar':
+        return page_response(request, unsortedResult)
+
     # Вставляем заголовки
-    headers = {v: v for v in list(reduce(lambda allKeys, dict: allKeys.union(dict.keys()), unsortedResult, set()))}
+    headers = {v: v for v in page_columns(unsortedResult)}
     unsortedResult.insert(0, headers)
     result = list(map(sort_result_item, unsortedResult))
 
     # Возвращаем обработанный результат
-    return json.loads(json.dumps(result, ensure_ascii=False, indent=4, default=default_serializer))
+    return json_response(request, result)
 
 @router.get("/x/logs_for_period", response_model=List[Dict[str, Any]], operation_id="get_logs_for_period")
-async def get_logs_for_period(start: str, end: str, lastId: int = 0, db: Session = Depends(get_db)):
+async def get_logs_for_period(start: str, end: str, request: Request, format: str = Depends(page_format), lastId: int = 0, limit: int = Query(10, ge=1, le=PAGE_LIMIT_MAX)):
     print('logs_for_period')
     # Парсим параметры даты
-    try:
-        start_date = datetime.fromisoformat(start)
-        end_date = datetime.fromisoformat(end)
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid date format. Use ISO format.")
+    start_date = parse_datetime_param(start)
+    end_date = parse_datetime_param(end)
     print('start', start_date, 'end', end_date, 'id', lastId)
-    columns = models.Logs.__table__.columns.keys()
-
-    # Запрос для получения логов, соответствующих условиям
-    query = db.query(*[getattr(models.Logs, col) for col in columns]) \
-              .filter(models.Logs.timestamp >= start_date) \
-              .filter(models.Logs.timestamp <= end_date)
+    # Условия для получения логов за период
+    filters = {'start': start_date, 'end': end_date}
 
     if lastId > 0:
-        query = query.filter(models.Logs.id > lastId)
+        filters['min_id'] = lastId + 1
 
-    dbanswer = query.order_by(models.Logs.id.asc()) \
-                    .limit(10) \
-                    .all()
+    # Старые периоды могут лежать в архиве, find_log_rows читает и его
+    dbanswer = await find_log_rows(filters, order_desc=False, limit=limit)
     # print('dbanswer', dbanswer)
     if not dbanswer:
         raise HTTPException(status_code=404, detail="Logs not found")
 
     # Преобразуем каждый лог в нужный формат
-    unsortedResult = [flatDbAnswerItem({col: getattr(row, col) for col in columns}) for row in dbanswer]
+    unsortedResult = await row_cache.flatten(dbanswer, flatten_rows)
 
     # Удаляем ключ _sa_instance_state, если он присутствует
     for item in unsortedResult:
         if '_sa_instance_state' in item:
             del item['_sa_instance_state']
 
+    if format == 'columnar':
+        return page_response(request, unsortedResult)
+
     # Вставляем заголовки
-    headers = {v: v for v in list(reduce(lambda allKeys, dict: allKeys.union(dict.keys()), unsortedResult, set()))}
+    headers = {v: v for v in page_columns(unsortedResult)}
     unsortedResult.insert(0, headers)
     result = list(map(sort_result_item, unsortedResult))
 
     # Возвращаем обработанный результат
-    return json.loads(json.dumps(result, ensure_ascii=False, indent=4, default=default_serializer))
+    return json_response(request, result)
 
-from fastapi import Query
 
 @router.get("/x/logs_for_ids", response_model=List[Dict[str, Any]], operation_id="get_logs_for_ids")
 async def get_logs_for_ids(
+    request: Request,
     min_id: int = Query(..., description="Минимальный ID лога"),
     max_id: int = Query(..., description="Максимальный ID лога"),  # Изменено с last_id на max_id
-    db: Session = Depends(get_db)
+    limit: int = Query(10, ge=1, le=PAGE_LIMIT_MAX),
+    format: str = Depends(page_format)
 ):
     # Проверка корректности входных данных
     if min_id < 0 or max_id < 0 or min_id > max_id:
         raise HTTPException(status_code=400, detail="Invalid ID parameters")
 
-    columns = models.Logs.__table__.columns.keys()
-
-    # Формируем запрос для получения логов в заданном диапазоне id
-    query = db.query(*[getattr(models.Logs, col) for col in columns]) \
-              .filter(models.Logs.id >= min_id) \
-              .filter(models.Logs.id <= max_id) \
-              .order_by(models.Logs.id.desc())  # Сортируем по убыванию id
-
-    # Выполняем запрос
-    dbanswer = query.limit(10).all()
+    # Логи в заданном диапазоне id, по убыванию id
+    dbanswer = await find_log_rows({'min_id': min_id, 'max_id': max_id}, limit=limit)
 
     if not dbanswer:
         raise HTTPException(status_code=404, detail="Logs not found")
 
     # Обрабатываем результаты и удаляем внутренние служебные поля
-    unsortedResult = [flatDbAnswerItem({col: getattr(row, col) for col in columns}) for row in dbanswer]
+    unsortedResult = await row_cache.flatten(dbanswer, flatten_rows)
 
     for item in unsortedResult:
         if '_sa_instance_state' in item:
             del item['_sa_instance_state']
 
+    if format == 'columnar':
+        return page_response(request, unsortedResult)
+
     # Сортируем результат
     result = list(map(sort_result_item, unsortedResult))
 
-    return json.loads(json.dumps(result, ensure_ascii=False, indent=4, default=default_serializer)) 
+    return json_response(request, result) 
     
 def sort_result_item(item: Dict[str, Any]) -> Dict[str, Any]:
-    mandatory_keys = ['id', 'ip', 'domain', 'eventName', 'timestamp', 'eventTimestamp','eventId','internalId','number','ticketId','isTriggeredViaApi','body_json']
-    sorted_item = {key: item.pop(key, 'Not found') for key in mandatory_keys}
+    sorted_item = {key: item.pop(key, 'Not found') for key in MANDATORY_KEYS}
     sorted_item.update(dict(sorted(item.items())))
     return sorted_item
+
+def search_criteria(
+    eventName: Optional[str] = None,
+    eventId: Optional[str] = None,
+    ticketId: Optional[str] = None,
+    internalId: Optional[str] = None,
+    number: Optional[str] = None,
+    domain: Optional[str] = None,
+    ip: Optional[str] = None,
+    where: List[str] = Query([], description="Условие на поле тела: payload.ticketId=123"),
+    body_contains: Optional[str] = Query(None, description="JSON-объект, который должен содержаться в body"),
+    headers_contains: Optional[str] = Query(None, description="JSON-объект, который должен содержаться в headers"),
+    start: Optional[str] = None,
+    end: Optional[str] = Query(None, description="Конец периода, не включительно: [start, end), как в DELETE /x/logs"),
+) -> Dict[str, Any]:
+    # Общие фильтры для /x/logs/search и /x/logs/page
+    fields = {
+        name: value for name, value in dict(
+            eventName=eventName, eventId=eventId, ticketId=ticketId, internalId=internalId,
+            number=number, domain=domain, ip=ip,
+        ).items() if value is not None
+    }
+
+    body_filter = parse_where(where)
+    if body_contains:
+        extra = parse_json_param('body_contains', body_contains)
+        if not isinstance(extra, dict):
+            raise HTTPException(status_code=400, detail="body_contains must be a JSON object")
+        body_filter.update(extra)
+
+    # Аргументы crud.log_filters; тот же словарь проверяет и архив
+    return dict(
+        fields=fields,
+        body_contains=body_filter,
+        headers_contains=parse_json_param('headers_contains', headers_contains) if headers_contains else None,
+        start=parse_datetime_param(start) if start else None,
+        end=parse_datetime_param(end) if end else None,
+    )
+
+def narrow_ids(filters: Dict[str, Any], min_id: Optional[int] = None, max_id: Optional[int] = None) -> Dict[str, Any]:
+    # Пересечение диапазона id в фильтрах с новыми границами
+    filters = dict(filters)
+    if min_id is not None:
+        filters['min_id'] = max(min_id, filters.get('min_id') if filters.get('min_id') is not None else min_id)
+    if max_id is not None:
+        filters['max_id'] = min(max_id, filters.get('max_id') if filters.get('max_id') is not None else max_id)
+    return filters
+
+@router.get("/x/logs/search", response_model=List[Dict[str, Any]], operation_id="search_logs")
+async def search_logs(
+    request: Request,
+    filters: Dict[str, Any] = Depends(search_criteria),
+    before_id: Optional[int] = Query(None, description="Следующая страница: id последней полученной строки"),
+    limit: int = Query(50, ge=1, le=PAGE_LIMIT_MAX),
+    format: str = Depends(page_format)
+):
+    if before_id is not None:
+        filters = narrow_ids(filters, max_id=before_id - 1)
+
+    dbanswer = await find_log_rows(filters, limit=limit)
+    if not dbanswer:
+        raise HTTPException(status_code=404, detail="Logs not found")
+
+    if format == 'columnar':
+        return page_response(request, flatten_rows(dbanswer))
+    return json_response(request, flatten_page(dbanswer))
+
+def encode_cursor(key: str, log_id: int) -> str:
+    raw = json.dumps({'k': key, 'id': log_id}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+        key, log_id = data['k'], int(data['id'])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if key not in ('after', 'before'):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return key, log_id
+
+@router.get("/x/logs/page", operation_id="logs_page")
+async def logs_page(
+    request: Request,
+    filters: Dict[str, Any] = Depends(search_criteria),
+    cursor: Optional[str] = Query(None, description="next_cursor или prev_cursor из предыдущего ответа"),
+    direction: str = Query('backward', pattern='^(forward|backward)$',
+                           description="Без курсора: forward — с самых старых, backward — с самых новых"),
+    limit: int = Query(100, ge=1, le=PAGE_LIMIT_MAX),
+    min_id: Optional[int] = None,
+    max_id: Optional[int] = None,
+    format: str = Depends(page_format)
+):
+    """Keyset-пагинация: WHERE id > / < курсора ORDER BY id LIMIT n, стоимость не зависит от глубины."""
+    filters = narrow_ids(filters, min_id, max_id)
+
+    if cursor:
+        key, cursor_id = decode_cursor(cursor)
+        forward = key == 'after'
+        filters = narrow_ids(filters, min_id=cursor_id + 1) if forward else narrow_ids(filters, max_id=cursor_id - 1)
+    else:
+        forward = direction == 'forward'
+
+    # Одна лишняя строка показывает, есть ли следующая страница
+    dbanswer = await find_log_rows(filters, order_desc=not forward, limit=limit + 1)
+    has_more = len(dbanswer) > limit
+    dbanswer = dbanswer[:limit]
+
+    result = {
+        'rows': flatten_page(dbanswer, format) if dbanswer else [],
+        'count': len(dbanswer),
+        'direction': 'forward' if forward else 'backward',
+        'next_cursor': encode_cursor('after' if forward else 'before', dbanswer[-1]['id']) if has_more else None,
+        'prev_cursor': encode_cursor('before' if forward else 'after', dbanswer[0]['id']) if dbanswer else None,
+    }
+    if format == 'columnar':
+        # {"columns": [...], "rows": [[...]], "count": ..., курсоры}
+        page = result['rows'] or columnar_page([])
+        result.update(columns=page['columns'], rows=page['rows'])
+        return json_response(request, result, media_type=COLUMNAR_MEDIA_TYPE)
+    return json_response(request, result)
+
+def csv_cell(value: Any) -> Any:
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return encode_json(value).decode()
+    return value
+
+def export_chunk(rows: List[Dict[str, Any]], format: str, columns: List[str]) -> bytes:
+    if format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for item in flatten_rows(rows):
+            writer.writerow([csv_cell(item.get(column)) for column in columns])
+        return buffer.getvalue().encode()
+    return b''.join(encode_json(sort_result_item(item)) + b'\n' for item in flatten_rows(rows))
+
+async def export_chunks(filters: Dict[str, Any], format: str, columns: List[str]):
+    if format == 'csv':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(columns)
+        yield buffer.getvalue().encode()
+    # Сначала архивные сегменты (самые старые id), потом горячая таблица
+    for index in (log_archive.candidates(filters) if log_store.archived else []):
+        rows = await asyncio.to_thread(log_archive.read_matching, index, filters)
+        if rows:
+            yield export_chunk(rows, format, columns)
+    # Хранилище само открывает сессию на всё время потока, а не на время обработчика
+    async for rows in log_store.stream(filters, batch_size=LOG_EXPORT_BATCH_SIZE):
+        yield export_chunk(rows, format, columns)
+
+@router.get("/x/logs/export", operation_id="export_logs")
+async def export_logs(
+    filters: Dict[str, Any] = Depends(search_criteria),
+    format: str = Query('ndjson', pattern='^(ndjson|csv)$'),
+    min_id: Optional[int] = None,
+    max_id: Optional[int] = None,
+    columns: List[str] = Query([], description="Дополнительные плоские колонки для CSV, например body_payload"),
+):
+    """Выгрузка диапазона логов одним потоковым ответом, по возрастанию id; память не зависит от объёма."""
+    filters = narrow_ids(filters, min_id, max_id)
+
+    csv_columns = MANDATORY_KEYS + [column for column in columns if column not in MANDATORY_KEYS]
+    media_type = 'text/csv; charset=utf-8' if format == 'csv' else 'application/x-ndjson'
+    return StreamingResponse(
+        export_chunks(filters, format, csv_columns),
+        media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename="logs.{format}"'},
+    )
@@ -1,34 +1,124 @@
-from fastapi import APIRouter, Request, HTTPException, Depends
-from sqlalchemy.orm import Session
-from aiolimiter import AsyncLimiter
+from fastapi import APIRouter, Request, HTTPException
+from typing import Any, Dict, Optional, Tuple
+import asyncio
 import json
 import os
-import datetime
-import httpx
-import models
-from dependencies import get_db
-from utils import CustomJSONEncoder
-from rate_limiter import limiter
-from fastapi.responses import FileResponse
+from log_writer import log_writer, make_log_row, LOG_WRITER_ACK
+from body_capture import body_capture, parse_json
+from forwarder import fan_out
+from idempotency import idempotency
+from circuit_breaker import breakers
+import outbox
+from fastapi.responses import FileResponse, JSONResponse
 
 router = APIRouter()
 
-domains = [
+env = os.environ
+
+DEFAULT_FORWARD_DOMAINS = [
     "https://morzhkzdhj3oi.elma365.eu",
     # "https://7isfa26wfvp4a.elma365.eu"
 ]
 
+# Домены ELMA через запятую; для нагрузочных прогонов — адрес benchmarks/stub_elma.py
+domains = [domain.strip().rstrip('/') for domain in env.get('FORWARD_DOMAINS', '').split(',') if domain.strip()] \
+    or DEFAULT_FORWARD_DOMAINS
+
 ALLOWED_BROWSERS = ["chrome", "opera", "firefox", "safari", "edge"]
 
 # Путь к папке static, где теперь лежат сгенерированные файлы React
 static_files_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "static"))
 
-async def handle_request(request: Request, db: Session, method: str):
+def as_response(status_code: int, content: Any):
+    # 200 отдаём как раньше — значением из обработчика, остальные коды — JSONResponse
+    return content if status_code == 200 else JSONResponse(status_code=status_code, content=content)
+
+def delivered_nowhere(content: Any) -> bool:
+    # Синхронная пересылка, и ни один домен не ответил 2xx (отложенные в outbox — 202)
+    return isinstance(content, list) and not any(200 <= result.get('status_code', 0) < 300 for result in content)
+
+async def replay_duplicate(entry, log_row: Dict[str, Any], log_future: Optional[asyncio.Future] = None):
+    """Ответ на повторную доставку: ответ первой, а в logs — строка со ссылкой на неё.
+
+    log_future — строка уже в очереди log_writer (повтор обнаружен в базе), duplicate_of в ней проставлен.
+    """
+    response = await idempotency.original_response(entry)
+    if log_future is None:
+        log_row['duplicate_of'] = await idempotency.original_log_id(entry)
+        await log_writer.write(log_row, wait=LOG_WRITER_ACK)
+    elif LOG_WRITER_ACK:
+        await asyncio.shield(log_future)
+    print(f"Duplicate delivery of {entry.key}, original log {log_row['duplicate_of']}")
+    if entry.released:
+        # Первая доставка упала, пусть CASAVI повторит ещё раз
+        return JSONResponse(status_code=503, content={'status': 'retry', 'detail': 'Original delivery failed'})
+    if response is None:
+        # Ответ первой доставки не сохранён (большой, другой воркер ещё не закончил)
+        return {'status': 'duplicate', 'duplicate_of': log_row['duplicate_of']}
+    return as_response(*response)
+
+async def claim_shared(entry, log_row: Dict[str, Any]) -> bool:
+    first = await idempotency.claim_shared(entry)
+    if not first:
+        log_row['duplicate_of'] = entry.log_id
+    return first
+
+async def process_event(request: Request, method: str, bodyObj: Dict[str, Any], truncated: bool) -> Tuple[int, Any]:
+    """Всё после записи входящей строки в лог: пересылка в ELMA или outbox; (status_code, содержимое ответа)."""
+    if truncated:
+        # Начало тела сохранено в логе, но пересылать обрезанное событие нельзя
+        return 413, {'detail': f"Request body is larger than {body_capture.max_bytes} bytes"}
+
+    if not hasattr(bodyObj, 'get') or str(bodyObj.get('eventName')) not in [
+        'ticket_created',
+        'ticket_updated',
+        'ticket_comment_created',
+        'ticket_comment_updated'
+    ]:
+        # print('Request received:', str(bodyObj['eventName']))
+        return 200, 'Request received:' + json.dumps(bodyObj, ensure_ascii=False)
+
+    headers_dict = dict(request.headers)
+    headers_dict.pop('content-length', None)
+    headers_dict.pop('host', None)
+    headers_dict["x-forwarded-for"] = "0.0.0.0"
+    headers_dict["x-origin-domain"] = "koyeb"
+
+    elma_tail = bodyObj['eventName']
+    bodyObj = {**bodyObj, 'eventName': f"{elma_tail}_from_koyeb_to_ELMA"}
+
+    event = dict(
+        method=method,
+        elma_tail=elma_tail,
+        headers_dict=headers_dict,
+        bodyObj=bodyObj,
+        path_params=repr(request.path_params),
+        query_params=dict(request.query_params),
+    )
+
+    if outbox.FORWARD_MODE == 'outbox':
+        # Событие сохранено в outbox, в ELMA его отправит фоновый диспетчер
+        outbox_ids = await outbox.enqueue(domains, **event)
+        return 202, {'status': 'accepted', 'outbox_ids': outbox_ids}
+
+    # Все домены получают событие параллельно, сбой одного не влияет на остальные
+    results = await fan_out(domains, **event)
+    if breakers.open_mode == 'defer':
+        # Домены с открытым автоматом получат событие из outbox, когда поправятся
+        deferred = [i for i, result in enumerate(results) if result.get('circuit_open')]
+        if deferred:
+            outbox_ids = await outbox.enqueue([domains[i] for i in deferred], **event)
+            for i, outbox_id in zip(deferred, outbox_ids):
+                results[i] = {**results[i], 'status_code': 202, 'status': 'deferred', 'outbox_id': outbox_id}
+    return 200, results
+
+async def handle_request(request: Request, method: str):
     try:
-        # Продолжаем с обработкой логов и пересылкой запроса
-        bodyObj = dict()
-        if request.headers.get("content-length") and int(request.headers.get("content-length")) > 0:
-            bodyObj = await request.json()
+        # Тело читается потоком и целиком сохраняется, даже если это не JSON или chunked-запрос
+        raw, truncated = await body_capture.read(request)
+        is_json, parsed = parse_json(raw) if raw else (True, {})
+        # Маршрутизация и поля события — только по JSON-объекту
+        bodyObj = parsed if isinstance(parsed, dict) and not truncated else dict()
 
         if bodyObj.keys().__len__  and hasattr(bodyObj, 'get') and str(bodyObj.get('eventName')) != "None":
             event_name = bodyObj.get('eventName')
@@ -56,128 +146,73 @@ async def handle_request(request: Request, db: Session, method: str):
             return FileResponse(index_file_path, media_type="text/html")
 
        # print(json.dumps(bodyObj, ensure_ascii=False))
-        db_logs = models.Logs(
-            timestamp=datetime.datetime.now(datetime.timezone.utc).isoformat().replace("+00:00", "Z"),
-            httpmethod=method,
-            headers=json.dumps(dict(request.headers), ensure_ascii=False, cls=CustomJSONEncoder),
-            body=json.dumps(bodyObj, ensure_ascii=False),
-            path_params=repr(request.path_params),
-            query_params=json.dumps(dict(request.query_params), ensure_ascii=False)
-        )
-        db.add(db_logs)
-        db.commit()
-        db.refresh(db_logs)
-
-        if not hasattr(bodyObj, 'get') or str(bodyObj.get('eventName')) not in [
-            'ticket_created',
-            'ticket_updated',
-            'ticket_comment_created',
-            'ticket_comment_updated'
-        ]:
-            # print('Request received:', str(bodyObj['eventName']))
-            return 'Request received:' + json.dumps(bodyObj, ensure_ascii=False)
-
+        log_row = make_log_row(method, dict(request.headers), bodyObj, repr(request.path_params),
+                               dict(request.query_params),
+                               body_columns=await body_capture.columns(raw, is_json, parsed, truncated))
+
+        # Повторная доставка того же события (idempotency.py): в ELMA не пересылаем
+        key = None if truncated else idempotency.key(request.headers, bodyObj)
+        if key is None:
+            # Строка уходит в write-behind очередь и пишется пачкой вместе с соседними
+            await log_writer.write(log_row, wait=LOG_WRITER_ACK)
+            return as_response(*await process_event(request, method, bodyObj, truncated))
+
+        first, entry = idempotency.claim_cached(key)
+        if not first:
+            return await replay_duplicate(entry, log_row)
+        # Ключ занимается в базе, пока строка ждёт в очереди log_writer: пачка
+        # сбрасывается после проверки, и у повтора из другого воркера уже есть duplicate_of
+        shared = asyncio.create_task(claim_shared(entry, log_row))
+        try:
+            log_future = await log_writer.submit(log_row, ready=shared)
+            if not await shared:
+                return await replay_duplicate(entry, log_row, log_future)
+            if LOG_WRITER_ACK:
+                await asyncio.shield(log_future)
+            status_code, content = await process_event(request, method, bodyObj, truncated)
+        except BaseException:
+            # Событие не обработано: повтор от CASAVI должен пройти заново
+            await asyncio.wait([shared])
+            if not shared.cancelled() and shared.result():
+                await idempotency.release(entry)
+            raise
+        if delivered_nowhere(content):
+            # Повтор от CASAVI должен переслать событие снова, а не получить сохранённую ошибку
+            await idempotency.release(entry)
         else:
-            headers_dict = dict(request.headers)
-            headers_dict.pop('content-length', None)
-            headers_dict.pop('host', None)
-            headers_dict["x-forwarded-for"] = "0.0.0.0"
-            headers_dict["x-origin-domain"] = "koyeb"
-
-            elma_tail = bodyObj['eventName']
-            bodyObj = {**bodyObj, 'eventName': f"{elma_tail}_from_koyeb_to_ELMA"}
-
-            response_datas = []
-            for domain in domains:
-                async with limiter:
-                    async with httpx.AsyncClient() as client:
-                        try:
-                            db_request_logs = models.Logs(
-                                timestamp=datetime.datetime.now(datetime.timezone.utc).isoformat().replace("+00:00", "Z"),
-                                httpmethod=method,
-                                headers=json.dumps(headers_dict, ensure_ascii=False, cls=CustomJSONEncoder),
-                                body=json.dumps(bodyObj, ensure_ascii=False),
-                                path_params=repr(request.path_params),
-                                query_params=json.dumps(dict(request.query_params), ensure_ascii=False)
-                            )
-                            db.add(db_request_logs)
-                            db.commit()
-                            db.refresh(db_request_logs)
-
-                            external_response = await client.request(
-                                method=method,
-                                url=f"{domain}/api/extensions/22fe87c3-14fc-4c97-83dd-52ef65fa4644/script/{elma_tail}",
-                                headers=headers_dict,
-                                json=bodyObj,
-                            )
-                            response_data = {}
-                            if not (200 <= external_response.status_code < 300):
-                                response_data['payload'] = {
-                                    'textError': f"data:text/html,{external_response.text}",
-                                    'reqest': {
-                                        'method': method,
-                                        'url': f"{domain}/api/extensions/22fe87c3-14fc-4c97-83dd-52ef65fa4644/script/{elma_tail}",
-                                        'headers': headers_dict,
-                                        'json': bodyObj
-                                    }
-                                }
-                            else:
-                                response_data = external_response.json()
-
-                            response_data['status_code'] = external_response.status_code
-                            response_data['eventName'] = bodyObj['eventName'] + "_response"
-                            external_response.headers['x-origin-domain'] = "res <- ELMA"
-
-                            db_response_logs = models.Logs(
-                                timestamp=datetime.datetime.now(datetime.timezone.utc).isoformat().replace("+00:00", "Z"),
-                                httpmethod=method,
-                                headers=json.dumps(dict(external_response.headers), ensure_ascii=False, cls=CustomJSONEncoder),
-                                body=json.dumps(response_data, ensure_ascii=False),
-                                path_params=repr(request.path_params),
-                                query_params=json.dumps(dict(request.query_params, ensure_ascii=False))
-                            )
-                            db.add(db_response_logs)
-                            db.commit()
-                            db.refresh(db_response_logs)
-
-                            print('Request and response logged')
-                            print('response data: ', response_data)
-                        except httpx.RequestError as exc:
-                            print(f"An error occurred while requesting {exc.request.url!r}.")
-                            raise HTTPException(status_code=500, detail=f"Request to external service failed: {str(exc)}")
-                response_datas = response_datas + [response_data]
-            return response_datas
+            idempotency.complete(entry, status_code, content, log_future)
+        return as_response(status_code, content)
     except Exception as e:
         print(f"Error occurred: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get('/', operation_id="root_request_get")
-async def write_request_get(request: Request, db: Session = Depends(get_db)):
-    return await handle_request(request, db, "GET")
+async def write_request_get(request: Request):
+    return await handle_request(request, "GET")
 
 @router.put('/', operation_id="root_request_put")
-async def write_request_put(request: Request, db: Session = Depends(get_db)):
-    return await handle_request(request, db, "PUT")
+async def write_request_put(request: Request):
+    return await handle_request(request, "PUT")
 
 @router.post('/', operation_id="root_request_post")
-async def write_request_post(request: Request, db: Session = Depends(get_db)):
-    return await handle_request(request, db, "POST")
+async def write_request_post(request: Request):
+    return await handle_request(request, "POST")
 
 @router.delete('/', operation_id="root_request_delete")
-async def write_request_delete(request: Request, db: Session = Depends(get_db)):
-    return await handle_request(request, db, "DELETE")
+async def write_request_delete(request: Request):
+    return await handle_request(request, "DELETE")
 
 @router.patch('/', operation_id="root_request_patch")
-async def write_request_patch(request: Request, db: Session = Depends(get_db)):
-    return await handle_request(request, db, "PATCH")
+async def write_request_patch(request: Request):
+    return await handle_request(request, "PATCH")
 
 @router.head('/', operation_id="root_request_head")
-async def write_request_head(request: Request, db: Session = Depends(get_db)):
-    return await handle_request(request, db, "HEAD")
+async def write_request_head(request: Request):
+    return await handle_request(request, "HEAD")
 
 @router.options('/', operation_id="root_request_options")
-async def write_request_options(request: Request, db: Session = Depends(get_db)):
-    return await handle_request(request, db, "OPTIONS")
+async def write_request_options(request: Request):
+    return await handle_request(request, "OPTIONS")
 
 # @router.get('/x/', operation_id="root_request_get")
 # async def write_request_get(request: Request, db: Session = Depends(get_db)):
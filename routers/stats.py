@@ -0,0 +1,91 @@
+import os
+import time
+from fastapi import APIRouter
+import crud
+from database import AsyncSessionLocal
+import outbox
+from http_client import client_pool
+from log_writer import log_writer
+from rate_limiter import limiter, RATE_LIMIT_BACKEND
+from live_tail import live_tail
+from partitions import partition_maintainer
+from archive import archiver
+from row_cache import row_cache
+from startup import startup
+from storage import log_store
+from body_capture import body_capture
+from idempotency import idempotency
+from circuit_breaker import breakers
+
+router = APIRouter()
+
+started = time.time()
+
+@router.get("/x/stats/worker", operation_id="worker_stats")
+async def worker_stats():
+    # Под gunicorn каждый ответ — от одного воркера; pid показывает, какого
+    return {
+        'pid': os.getpid(),
+        'uptime_s': round(time.time() - started, 1),
+        'log_storage': log_store.name,
+        'rate_limit_backend': RATE_LIMIT_BACKEND,
+        'live_tail_notify': live_tail.notify,
+        'row_cache_disk': row_cache.disk.path if row_cache.disk else None,
+    }
+
+@router.get("/x/stats/http_pool", operation_id="http_pool_stats")
+async def http_pool_stats():
+    return client_pool.stats()
+
+@router.get("/x/stats/log_writer", operation_id="log_writer_stats")
+async def log_writer_stats():
+    return log_writer.stats()
+
+@router.get("/x/stats/rate_limiter", operation_id="rate_limiter_stats")
+async def rate_limiter_stats():
+    return limiter.stats()
+
+@router.get("/x/stats/outbox", operation_id="outbox_stats")
+async def outbox_stats():
+    counts = {}
+    # С LOG_STORAGE=memory таблицы outbox нет
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            counts = await crud.outbox_status_counts(db)
+    return {**outbox.dispatcher.stats(), 'rows': counts}
+
+@router.get("/x/stats/live_tail", operation_id="live_tail_stats")
+async def live_tail_stats():
+    return live_tail.stats()
+
+@router.get("/x/stats/partitions", operation_id="partitions_stats")
+async def partitions_stats():
+    return partition_maintainer.stats()
+
+@router.get("/x/stats/archive", operation_id="archive_stats")
+async def archive_stats():
+    return archiver.stats()
+
+@router.get("/x/stats/row_cache", operation_id="row_cache_stats")
+async def row_cache_stats():
+    return row_cache.stats()
+
+@router.get("/x/stats/startup", operation_id="startup_stats")
+async def startup_stats():
+    return startup.stats()
+
+@router.get("/x/stats/storage", operation_id="storage_stats")
+async def storage_stats():
+    return log_store.stats()
+
+@router.get("/x/stats/body_capture", operation_id="body_capture_stats")
+async def body_capture_stats():
+    return body_capture.stats()
+
+@router.get("/x/stats/idempotency", operation_id="idempotency_stats")
+async def idempotency_stats():
+    return idempotency.stats()
+
+@router.get("/x/stats/breakers", operation_id="breaker_stats")
+async def breaker_stats():
+    return breakers.stats()
@@ -0,0 +1,207 @@
+"""Кэш уже разобранных строк логов для эндпоинтов просмотрщика.
+
+Строка logs после записи не меняется, поэтому результат разбора (flattening.flatten_rows) можно
+хранить по id. id может достаться новой строке (после DELETE /x/logs в SQLite, у
+LOG_STORAGE=memory после рестарта), поэтому ключ — пара id и timestamp строки:
+старая запись с тем же id не совпадёт по времени. DELETE /x/logs ещё и очищает
+кэш (clear). Память ограничена LOG_ROW_CACHE_BYTES (считается по размеру
+строки в JSON, это оценка снизу), вытесняются давно не читанные строки.
+LOG_ROW_CACHE_DISK включает второй уровень — файл SQLite, общий для воркеров
+одной машины: промах в памяти одного воркера может попасть в строку,
+разобранную другим. С LOG_STORAGE=memory второго уровня нет: у каждого
+воркера свои строки и свои id.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from database import LOG_STORAGE
+from json_response import encode_json
+
+env = os.environ
+
+LOG_ROW_CACHE_BYTES = int(env.get('LOG_ROW_CACHE_BYTES', 64 * 1024 * 1024))
+LOG_ROW_CACHE_DISK = env.get('LOG_ROW_CACHE_DISK', '')
+LOG_ROW_CACHE_DISK_ROWS = int(env.get('LOG_ROW_CACHE_DISK_ROWS', 200000))
+# Как часто (в записанных строках) подрезать файл до LOG_ROW_CACHE_DISK_ROWS
+DISK_TRIM_EVERY = 5000
+
+
+def row_key(row: Dict[str, Any]) -> Tuple[int, str]:
+    return row['id'], str(row.get('timestamp'))
+
+
+class DiskRowCache:
+    """Разобранные строки в SQLite: (id, timestamp) -> JSON. Хранит самые новые id, старые подрезаются."""
+
+    def __init__(self, path: str, max_rows: int):
+        self.path = path
+        self.max_rows = max_rows
+        self._since_trim = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS flat_rows (id INTEGER PRIMARY KEY, stamp TEXT NOT NULL, data BLOB NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get_many(self, keys: List[Tuple[int, str]]) -> Dict[Tuple[int, str], Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            placeholders = ','.join('?' * len(keys))
+            rows = conn.execute(
+                f"SELECT id, stamp, data FROM flat_rows WHERE id IN ({placeholders})", [row_id for row_id, _ in keys],
+            ).fetchall()
+        finally:
+            conn.close()
+        wanted = set(keys)
+        # Запись с тем же id, но другим timestamp — от удалённой строки, не подходит
+        return {(row_id, stamp): json.loads(data) for row_id, stamp, data in rows if (row_id, stamp) in wanted}
+
+    def put_many(self, items: Dict[Tuple[int, str], bytes]):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO flat_rows (id, stamp, data) VALUES (?, ?, ?)",
+                    [(row_id, stamp, data) for (row_id, stamp), data in items.items()],
+                )
+                self._since_trim += len(items)
+                if self._since_trim >= DISK_TRIM_EVERY:
+                    self._since_trim = 0
+                    conn.execute(
+                        "DELETE FROM flat_rows WHERE id < (SELECT id FROM flat_rows ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                        (self.max_rows,),
+                    )
+        finally:
+            conn.close()
+
+    def clear(self):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM flat_rows")
+        finally:
+            conn.close()
+
+
+class FlatRowCache:
+    """LRU разобранных строк по (id, timestamp) с ограничением по памяти."""
+
+    def __init__(self, max_bytes: int, disk: Optional[DiskRowCache] = None):
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self._items: 'OrderedDict[Tuple[int, str], tuple]' = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self.disk_errors = 0
+
+    def get(self, key: Tuple[int, str]) -> Optional[Dict[str, Any]]:
+        entry = self._items.get(key)
+        if entry is None:
+            return None
+        self._items.move_to_end(key)
+        # Копия: sort_result_item и обработчики меняют словарь на месте
+        return dict(entry[0])
+
+    def put(self, key: Tuple[int, str], item: Dict[str, Any], size: int):
+        if size > self.max_bytes:
+            return
+        previous = self._items.pop(key, None)
+        if previous is not None:
+            self.size -= previous[1]
+        self._items[key] = (item, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, evicted_size) = self._items.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    async def flatten(self, rows: List[Dict[str, Any]],
+                      flatten_rows: Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """flatten_rows по странице, но уже разобранные строки берутся из кэша; промахи разбираются одним вызовом."""
+        if self.max_bytes <= 0:
+            return flatten_rows([dict(row) for row in rows])
+
+        keys = [row_key(row) for row in rows]
+        result: List[Optional[Dict[str, Any]]] = [self.get(key) for key in keys]
+        missing = [i for i, item in enumerate(result) if item is None]
+        self.hits += len(rows) - len(missing)
+        if not missing:
+            return result
+
+        if self.disk is not None:
+            try:
+                found = await asyncio.to_thread(self.disk.get_many, [keys[i] for i in missing])
+            except sqlite3.Error as e:
+                self.disk_errors += 1
+                print(f"Row cache disk read failed: {str(e)}")
+                found = {}
+            for i in missing:
+                item = found.get(keys[i])
+                if item is not None:
+                    self.put(keys[i], item, len(encode_json(item)))
+                    result[i] = dict(item)
+            self.disk_hits += len(found)
+            missing = [i for i in missing if result[i] is None]
+
+        self.misses += len(missing)
+        to_disk: Dict[Tuple[int, str], bytes] = {}
+        flattened = flatten_rows([dict(rows[i]) for i in missing])
+        for i, item in zip(missing, flattened):
+            encoded = encode_json(item)
+            self.put(keys[i], item, len(encoded))
+            to_disk[keys[i]] = encoded
+            result[i] = dict(item)
+
+        if self.disk is not None and to_disk:
+            try:
+                await asyncio.to_thread(self.disk.put_many, to_disk)
+            except sqlite3.Error as e:
+                self.disk_errors += 1
+                print(f"Row cache disk write failed: {str(e)}")
+        return result
+
+    async def clear(self):
+        """Оба уровня; память других воркеров защищает timestamp в ключе."""
+        self._items.clear()
+        self.size = 0
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.clear)
+            except sqlite3.Error as e:
+                self.disk_errors += 1
+                print(f"Row cache disk clear failed: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.disk_hits
+        return {
+            'rows': len(self._items),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round((self.hits + self.disk_hits) / lookups, 3) if lookups else None,
+            'disk': self.disk.path if self.disk else None,
+            'disk_errors': self.disk_errors,
+        }
+
+
+if LOG_ROW_CACHE_DISK and LOG_STORAGE == 'memory':
+    # id кольцевого буфера свои у каждого процесса: общий файл отдал бы строку чужого воркера
+    print("LOG_ROW_CACHE_DISK is ignored with LOG_STORAGE=memory")
+    LOG_ROW_CACHE_DISK = ''
+
+row_cache = FlatRowCache(
+    max_bytes=LOG_ROW_CACHE_BYTES,
+    disk=DiskRowCache(LOG_ROW_CACHE_DISK, LOG_ROW_CACHE_DISK_ROWS) if LOG_ROW_CACHE_DISK else None,
+)
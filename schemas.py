@@ -1,11 +1,12 @@
 from pydantic import BaseModel
-from typing import List
+from typing import Any, Dict, List, Optional
+from datetime import datetime
 
 class LogBase(BaseModel):
-    timestamp: str
+    timestamp: datetime
     httpmethod: str
-    headers: str
-    body: str
+    headers: Dict[str, Any]
+    body: Any
     path_params: str
     query_params: str
 
@@ -14,6 +15,8 @@ class LogCreate(LogBase):
 
 class Log(LogBase):
     id: int
+    # Повторная доставка события: id строки первой доставки
+    duplicate_of: Optional[int] = None
 
     class Config:
         from_attributes = True
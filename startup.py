@@ -0,0 +1,136 @@
+"""Холодный старт: подготовка схемы без блокировки приёма, готовность и время до первого запроса.
+
+SCHEMA_MODE=lazy — схема проверяется в фоне после старта (migrations.ensure_schema,
+при неудаче — повтор с паузой), вебхуки до этого копятся в очереди log_writer.
+SCHEMA_MODE=skip — схему заранее готовит отдельная команда (python migrations.py),
+сервис её не трогает. В обоих режимах импорт main.py к базе не ходит.
+С LOG_STORAGE=memory базы нет, схема всегда считается готовой.
+"""
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional
+import migrations
+from database import LOG_STORAGE, engine
+from storage import log_store
+
+env = os.environ
+
+SCHEMA_MODE = env.get('SCHEMA_MODE', 'lazy')
+# Пауза между попытками подготовить схему растёт до этого значения
+SCHEMA_RETRY_MAX = float(env.get('SCHEMA_RETRY_MAX', 30))
+# Сколько секунд /readyz переиспользует результат проверки базы
+READY_CHECK_CACHE = float(env.get('READY_CHECK_CACHE', 2))
+READY_CHECK_TIMEOUT = float(env.get('READY_CHECK_TIMEOUT', 2))
+
+
+def process_age() -> float:
+    """Секунды с запуска процесса (Linux: /proc), иначе с импорта этого модуля."""
+    try:
+        with open('/proc/self/stat') as f:
+            # Имя процесса в скобках может содержать пробелы, поля считаем после него
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _imported_at
+
+
+_imported_at = time.monotonic()
+
+
+class Startup:
+    """Отметки старта процесса и фоновая подготовка схемы."""
+
+    def __init__(self, schema_mode: str):
+        self.schema_mode = schema_mode
+        self.schema_ready: Optional[asyncio.Event] = None
+        self.schema_created: Optional[bool] = None
+        self.schema_attempts = 0
+        self.schema_error: Optional[str] = None
+        self.marks: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._db_checked_at = 0.0
+        self._db_error: Optional[str] = 'not checked'
+
+    def mark(self, name: str):
+        """Запоминает момент (секунды с запуска процесса) один раз."""
+        if name not in self.marks:
+            self.marks[name] = round(process_age(), 3)
+
+    def first_request(self):
+        if 'first_request' not in self.marks:
+            self.mark('first_request')
+            print(f"First request {self.marks['first_request']}s after process start")
+
+    async def start(self):
+        self.schema_ready = asyncio.Event()
+        self.schema_created = None
+        if self.schema_mode == 'skip':
+            self.schema_ready.set()
+            self.mark('schema_ready')
+            return
+        self._task = asyncio.create_task(self._prepare_schema())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _prepare_schema(self):
+        delay = 1.0
+        while True:
+            self.schema_attempts += 1
+            try:
+                self.schema_created = await asyncio.to_thread(migrations.ensure_schema, engine)
+            except Exception as e:
+                self.schema_error = str(e)
+                print(f"Schema check failed (attempt {self.schema_attempts}), retry in {delay:.0f}s: {str(e)}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, SCHEMA_RETRY_MAX)
+                continue
+            self.schema_error = None
+            self.schema_ready.set()
+            self.mark('schema_ready')
+            print(f"Schema {'created' if self.schema_created else 'is up to date'} "
+                  f"{self.marks['schema_ready']}s after process start")
+            return
+
+    async def _check_db(self) -> Optional[str]:
+        # Пробы приходят часто, результат держим READY_CHECK_CACHE секунд
+        now = time.monotonic()
+        if now - self._db_checked_at < READY_CHECK_CACHE:
+            return self._db_error
+        try:
+            # Таймаут на всё, включая подключение: медленная база — это «не готов», а не зависшая проба
+            await asyncio.wait_for(log_store.ping(), READY_CHECK_TIMEOUT)
+            self._db_error = None
+        except Exception as e:
+            self._db_error = str(e) or type(e).__name__
+        self._db_checked_at = now
+        return self._db_error
+
+    async def readiness(self, log_writer_running: bool) -> Dict[str, Any]:
+        checks = {
+            'schema': 'ok' if self.schema_ready is not None and self.schema_ready.is_set()
+            else (self.schema_error or 'pending'),
+            'database': await self._check_db() or 'ok',
+            'log_writer': 'ok' if log_writer_running else 'stopped',
+        }
+        return {'ready': all(value == 'ok' for value in checks.values()), 'checks': checks}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'schema_mode': self.schema_mode,
+            'schema_ready': self.schema_ready is not None and self.schema_ready.is_set(),
+            'schema_created': self.schema_created,
+            'schema_attempts': self.schema_attempts,
+            'schema_error': self.schema_error,
+            'marks': self.marks,
+            'uptime_s': round(process_age(), 3),
+        }
+
+
+startup = Startup(schema_mode='skip' if LOG_STORAGE == 'memory' else SCHEMA_MODE)
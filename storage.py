@@ -0,0 +1,270 @@
+"""Хранилище логов за эндпоинтами /x/, log_writer и live tail.
+
+LOG_STORAGE (database.py) выбирает реализацию:
+    postgres  SqlLogStore поверх боевой базы, фильтры считаются в SQL
+    sqlite    SqlLogStore поверх файла SQLITE_PATH (по умолчанию test.db):
+              JSON-фильтры body/headers проверяются в Python, остальное — в SQL
+    memory    MemoryLogStore: кольцевой буфер последних LOG_MEMORY_ROWS строк
+              без базы — для локального захвата вебхуков и нагрузочных прогонов
+
+Все реализации принимают фильтры в виде аргументов crud.log_filters и отдают
+строки logs словарями колонка -> значение, поэтому разбор и эндпоинты от
+хранилища не зависят.
+"""
+import asyncio
+import os
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import text
+import crud
+import models
+import partitions
+from database import AsyncSessionLocal, LOG_STORAGE, async_engine
+
+env = os.environ
+
+# Ёмкость кольцевого буфера LOG_STORAGE=memory, в строках
+LOG_MEMORY_ROWS = int(env.get('LOG_MEMORY_ROWS', 100000))
+
+# Фильтры, которые Postgres считает через jsonb @>, а другие базы — нет
+JSON_FILTERS = ('body_contains', 'headers_contains')
+
+# Строка logs со всеми колонками, как её отдаёт база
+EMPTY_ROW = dict.fromkeys(column.name for column in models.Logs.__table__.columns)
+
+
+def strip_nul(value: Any) -> Any:
+    """Убирает символ NUL из строк и ключей: Postgres не хранит \\u0000 ни в jsonb, ни в text.
+
+    Без NUL возвращает тот же объект, копируется только изменённая часть.
+    """
+    if isinstance(value, str):
+        return value.replace('\x00', '') if '\x00' in value else value
+    if isinstance(value, dict):
+        items = [(strip_nul(key), strip_nul(item)) for key, item in value.items()]
+        if all(new_key is key and new_item is item for (new_key, new_item), (key, item) in zip(items, value.items())):
+            return value
+        return dict(items)
+    if isinstance(value, list):
+        items = [strip_nul(item) for item in value]
+        return value if all(new is old for new, old in zip(items, value)) else items
+    return value
+
+
+def _utc(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Время без зоны (SQLite, POST /x/logs) считаем UTC, как и в эндпоинтах
+    for row in rows:
+        timestamp = row.get('timestamp')
+        if isinstance(timestamp, datetime) and timestamp.tzinfo is None:
+            row['timestamp'] = timestamp.replace(tzinfo=timezone.utc)
+    return rows
+
+
+class SqlLogStore:
+    """Таблица logs через crud: Postgres или SQLite."""
+
+    # Старые строки могли уехать в архив (archive.py), читать нужно и его
+    archived = True
+
+    def __init__(self, session_factory, dialect: str):
+        self.session_factory = session_factory
+        self.name = 'postgres' if dialect == 'postgresql' else dialect
+        self.json_in_sql = dialect == 'postgresql'
+        self.inserted = 0
+        self.python_filtered = 0
+
+    def _criteria(self, filters: Dict[str, Any]) -> Tuple[List[Any], Dict[str, Any]]:
+        # Условия для SQL и JSON-фильтры, которые придётся проверить в Python
+        if self.json_in_sql:
+            return crud.log_filters(**filters), {}
+        sql_filters = dict(filters)
+        python_filters = {name: sql_filters.pop(name) for name in JSON_FILTERS if sql_filters.get(name)}
+        return crud.log_filters(**sql_filters), python_filters
+
+    async def insert(self, rows: List[Dict[str, Any]]) -> List[int]:
+        if self.name == 'postgres':
+            rows = [strip_nul(row) for row in rows]
+        async with self.session_factory() as db:
+            ids = await crud.create_logs(db, rows)
+        self.inserted += len(ids)
+        return ids
+
+    async def notify(self, channel: str, payloads: List[str]):
+        async with self.session_factory() as db:
+            await crud.notify(db, channel, payloads)
+
+    async def find(self, filters: Dict[str, Any], order_desc: bool = True,
+                   limit: Optional[int] = None, offset: Optional[int] = None) -> List[Dict[str, Any]]:
+        criteria, python_filters = self._criteria(filters)
+        async with self.session_factory() as db:
+            if not python_filters:
+                return _utc(await crud.get_log_rows(db, *criteria, order_desc=order_desc, limit=limit, offset=offset))
+            # Без @> читаем кандидатов курсором и отбираем подходящие, пока не наберётся limit
+            self.python_filtered += 1
+            rows, skip = [], offset or 0
+            async for batch in crud.stream_log_rows(db, *criteria, order_desc=order_desc):
+                for row in batch:
+                    if not crud.row_matches(row, python_filters):
+                        continue
+                    if skip:
+                        skip -= 1
+                        continue
+                    rows.append(row)
+                    if limit is not None and len(rows) >= limit:
+                        return _utc(rows)
+            return _utc(rows)
+
+    async def stream(self, filters: Dict[str, Any], batch_size: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Подходящие строки пачками по возрастанию id."""
+        criteria, python_filters = self._criteria(filters)
+        async with self.session_factory() as db:
+            async for batch in crud.stream_log_rows(db, *criteria, batch_size=batch_size):
+                if python_filters:
+                    batch = [row for row in batch if crud.row_matches(row, python_filters)]
+                if batch:
+                    yield _utc(batch)
+
+    async def get_by_ids(self, ids: List[int]) -> List[Dict[str, Any]]:
+        async with self.session_factory() as db:
+            return _utc(await crud.get_log_rows(db, models.Logs.id.in_(ids), order_desc=False))
+
+    async def purge(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> int:
+        async with self.session_factory() as db:
+            return await partitions.purge_logs(db, start=start, end=end)
+
+    async def ping(self):
+        async with self.session_factory() as db:
+            await db.execute(text("SELECT 1"))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'backend': self.name,
+            'json_filters_in_sql': self.json_in_sql,
+            'inserted': self.inserted,
+            'python_filtered_queries': self.python_filtered,
+        }
+
+
+class MemoryLogStore:
+    """Последние capacity строк в памяти процесса: строка с id лежит в слоте id % capacity.
+
+    Запись и чтение по id — O(1) без аллокаций на вытеснение; новые строки
+    затирают самые старые. Поиск по фильтрам просматривает диапазон id (не
+    больше capacity строк) тем же crud.row_matches, что и архив. Строки
+    живут до остановки процесса, у каждого воркера gunicorn — свои.
+    """
+
+    name = 'memory'
+    archived = False
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._slots: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self._next_id = 1
+        self._count = 0
+        self.inserted = 0
+        self.evicted = 0
+        self.deleted = 0
+
+    @property
+    def first_id(self) -> int:
+        # Строки с меньшими id уже вытеснены
+        return max(1, self._next_id - self.capacity)
+
+    def get(self, log_id: int) -> Optional[Dict[str, Any]]:
+        if not self.first_id <= log_id < self._next_id:
+            return None
+        return self._slots[log_id % self.capacity]
+
+    async def insert(self, rows: List[Dict[str, Any]]) -> List[int]:
+        ids = []
+        for row in _utc([dict(row) for row in rows]):
+            log_id = self._next_id
+            slot = log_id % self.capacity
+            if self._slots[slot] is None:
+                self._count += 1
+            else:
+                self.evicted += 1
+            self._slots[slot] = {**EMPTY_ROW, **row, 'id': log_id}
+            self._next_id += 1
+            ids.append(log_id)
+        self.inserted += len(ids)
+        return ids
+
+    def _matching(self, filters: Dict[str, Any], order_desc: bool) -> Iterator[Dict[str, Any]]:
+        low = max(self.first_id, filters.get('min_id') or 0)
+        high = self._next_id - 1
+        if filters.get('max_id') is not None:
+            high = min(high, filters['max_id'])
+        for log_id in (range(high, low - 1, -1) if order_desc else range(low, high + 1)):
+            row = self._slots[log_id % self.capacity]
+            # Пока поток выгрузки ждёт, слот может занять более новая строка
+            if row is not None and row['id'] == log_id and crud.row_matches(row, filters):
+                yield row
+
+    async def find(self, filters: Dict[str, Any], order_desc: bool = True,
+                   limit: Optional[int] = None, offset: Optional[int] = None) -> List[Dict[str, Any]]:
+        offset = offset or 0
+        rows = islice(self._matching(filters, order_desc), offset, None if limit is None else offset + limit)
+        return [dict(row) for row in rows]
+
+    async def stream(self, filters: Dict[str, Any], batch_size: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+        batch = []
+        for row in self._matching(filters, order_desc=False):
+            batch.append(dict(row))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+                # Длинная выгрузка не должна держать event loop
+                await asyncio.sleep(0)
+        if batch:
+            yield batch
+
+    async def get_by_ids(self, ids: List[int]) -> List[Dict[str, Any]]:
+        rows = (self.get(log_id) for log_id in sorted(ids))
+        return [dict(row) for row in rows if row is not None]
+
+    async def purge(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> int:
+        # Те же границы, что у partitions.purge_logs: [start, end)
+        deleted = 0
+        for slot, row in enumerate(self._slots):
+            if row is None:
+                continue
+            timestamp = row['timestamp']
+            if start is not None and (timestamp is None or timestamp < start):
+                continue
+            if end is not None and (timestamp is None or timestamp >= end):
+                continue
+            self._slots[slot] = None
+            deleted += 1
+        self._count -= deleted
+        self.deleted += deleted
+        return deleted
+
+    async def notify(self, channel: str, payloads: List[str]):
+        raise RuntimeError("LISTEN/NOTIFY needs LOG_STORAGE=postgres")
+
+    async def ping(self):
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'backend': self.name,
+            'capacity': self.capacity,
+            'rows': self._count,
+            'first_id': self.first_id if self._next_id > 1 else None,
+            'last_id': self._next_id - 1 if self._next_id > 1 else None,
+            'inserted': self.inserted,
+            'evicted': self.evicted,
+            'deleted': self.deleted,
+        }
+
+
+def make_log_store():
+    if LOG_STORAGE == 'memory':
+        return MemoryLogStore(LOG_MEMORY_ROWS)
+    return SqlLogStore(AsyncSessionLocal, async_engine.dialect.name)
+
+
+log_store = make_log_store()
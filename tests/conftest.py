@@ -0,0 +1,78 @@
+"""Общие настройки тестов: приложение импортируется без Postgres.
+
+По умолчанию эндпоинты проверяются на копии test.db (LOG_STORAGE=sqlite), второй
+прогон — в памяти:
+
+    python -m pytest -q
+    LOG_STORAGE=memory python -m pytest -q
+
+Тесты хранилища (фикстура store) в каждом прогоне идут на обоих бэкендах.
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Модули приложения читают настройки при импорте, поэтому окружение — до импорта
+TMP_DIR = tempfile.mkdtemp(prefix='showhttpreq-tests-')
+atexit.register(shutil.rmtree, TMP_DIR, ignore_errors=True)
+env = os.environ
+env.setdefault('LOG_STORAGE', 'sqlite')
+env.setdefault('SQLITE_PATH', os.path.join(TMP_DIR, 'test.db'))
+env.setdefault('LOG_ARCHIVE_DIR', os.path.join(TMP_DIR, 'archive'))
+env.setdefault('RATE_LIMIT_BACKEND', 'memory')
+env.setdefault('RATE_LIMIT_DOMAIN', '')
+env.setdefault('LOG_WRITER_ACK', '1')
+env.setdefault('LOG_ROW_CACHE_DISK', '')
+# Порт 9 закрыт: пересылка в ELMA сразу получает отказ в соединении
+env.setdefault('FORWARD_DOMAINS', 'http://127.0.0.1:9')
+if env['LOG_STORAGE'] == 'sqlite' and not os.path.exists(env['SQLITE_PATH']):
+    # test.db в репозитории тесты не меняют
+    shutil.copy(os.path.join(ROOT, 'test.db'), env['SQLITE_PATH'])
+
+import pytest  # noqa: E402
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine  # noqa: E402
+from sqlalchemy.pool import NullPool  # noqa: E402
+import migrations  # noqa: E402
+from database import engine  # noqa: E402
+from storage import MemoryLogStore, SqlLogStore  # noqa: E402
+
+if engine is not None:
+    migrations.ensure_schema(engine)
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """Сессии к своей копии test.db со свежей схемой; NullPool — соединения не переживают event loop теста."""
+    path = str(tmp_path / 'test.db')
+    shutil.copy(os.path.join(ROOT, 'test.db'), path)
+    sync_engine = create_engine(f'sqlite:///{path}')
+    migrations.ensure_schema(sync_engine)
+    sync_engine.dispose()
+    async_engine = create_async_engine(f'sqlite+aiosqlite:///{path}', poolclass=NullPool)
+    yield async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request):
+    if request.param == 'memory':
+        return MemoryLogStore(100)
+    return SqlLogStore(request.getfixturevalue('session_factory'), 'sqlite')
+
+
+@pytest.fixture(scope='session')
+def client():
+    from fastapi.testclient import TestClient
+    from main import app
+    with TestClient(app) as test_client:
+        yield test_client
@@ -0,0 +1,92 @@
+import os
+from datetime import datetime, timedelta, timezone
+import pytest
+import archive as archive_module
+from archive import INDEX_SUFFIX, LogArchive, find_log_rows, in_purge_range, write_segment
+from storage import MemoryLogStore
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def rows(first_id, count, event_name='ticket_updated'):
+    return [{'id': log_id, 'timestamp': START + timedelta(hours=log_id), 'event_name': event_name,
+             'body': {'eventName': event_name, 'n': log_id}, 'raw_body': None}
+            for log_id in range(first_id, first_id + count)]
+
+
+def make_archive(tmp_path):
+    write_segment(str(tmp_path), rows(1, 5))
+    write_segment(str(tmp_path), rows(6, 5, event_name='ticket_created'))
+    return LogArchive(str(tmp_path))
+
+
+def test_in_purge_range():
+    assert in_purge_range(START, None, None)
+    assert in_purge_range(None, None, None)
+    assert in_purge_range(START, START, START + timedelta(hours=1))
+    assert not in_purge_range(START + timedelta(hours=1), START, START + timedelta(hours=1))
+    assert not in_purge_range(None, START, None)
+
+
+def test_find_rows_uses_index(tmp_path):
+    archive = make_archive(tmp_path)
+    assert [row['id'] for row in archive.find_rows({}, limit=3)] == [10, 9, 8]
+    assert [row['id'] for row in archive.find_rows({'min_id': 4}, order_desc=False, limit=3)] == [4, 5, 6]
+    found = archive.find_rows({'fields': {'eventName': 'ticket_updated'}, 'body_contains': {'n': 2}})
+    assert [row['id'] for row in found] == [2]
+    assert found[0]['timestamp'] == START + timedelta(hours=2)
+    assert len(archive.candidates({'fields': {'eventName': 'ticket_created'}})) == 1
+
+
+def test_raw_body_round_trip(tmp_path):
+    [row] = rows(1, 1)
+    row['raw_body'] = b'\x1f\x8b binary'
+    write_segment(str(tmp_path), [row])
+    assert LogArchive(str(tmp_path)).find_rows({})[0]['raw_body'] == b'\x1f\x8b binary'
+
+
+def test_purge_range_rewrites_segment(tmp_path):
+    archive = make_archive(tmp_path)
+    # Строки 3 и 4 — часть первого сегмента, второй сегмент не трогается
+    deleted = archive.purge(START + timedelta(hours=3), START + timedelta(hours=5))
+    assert deleted == 2
+    assert [row['id'] for row in archive.find_rows({}, order_desc=False)] == [1, 2, 5, 6, 7, 8, 9, 10]
+    assert archive.stats()['rows'] == 8
+
+
+def test_purge_whole_segment(tmp_path):
+    archive = make_archive(tmp_path)
+    assert archive.purge(START + timedelta(hours=6)) == 5
+    assert [index['max_id'] for index in archive.segments()] == [5]
+    assert not [name for name in os.listdir(tmp_path) if name.startswith('logs_000000000006')]
+
+
+def test_purge_all(tmp_path):
+    archive = make_archive(tmp_path)
+    assert archive.purge() == 10
+    assert archive.find_rows({}) == []
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(INDEX_SUFFIX)]
+
+
+def test_purge_missing_directory(tmp_path):
+    assert LogArchive(str(tmp_path / 'missing')).purge() == 0
+
+
+class HotStore(MemoryLogStore):
+    """Горячая таблица, у которой старые строки уехали в архив."""
+    archived = True
+
+
+@pytest.mark.anyio
+async def test_find_log_rows_merges_archive_with_offset(tmp_path, monkeypatch):
+    store = HotStore(100)
+    # id 1..10 в архиве, 11..13 — в хранилище
+    store._next_id = 11
+    await store.insert(rows(11, 3))
+    monkeypatch.setattr(archive_module, 'log_store', store)
+    monkeypatch.setattr(archive_module, 'log_archive', make_archive(tmp_path))
+
+    page = await find_log_rows({}, order_desc=False, limit=4, offset=8)
+    assert [row['id'] for row in page] == [9, 10, 11, 12]
+    page = await find_log_rows({}, limit=3, offset=1)
+    assert [row['id'] for row in page] == [12, 11, 10]
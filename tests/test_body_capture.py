@@ -0,0 +1,14 @@
+from body_capture import body_capture
+from storage import log_store
+from test_ingest import webhook
+
+
+def test_body_over_limit_is_rejected(client, monkeypatch):
+    monkeypatch.setattr(body_capture, 'max_bytes', 64)
+    response = webhook(client, 'ticket_created', text='x' * 200)
+    assert response.status_code == 413
+    # Начало тела всё равно сохранено
+    [row] = client.portal.call(log_store.find, {}, True, 1)
+    assert row['body_truncated'] is True
+    assert row['body_size'] == 64
+    assert row['raw_body'] == response.request.content[:64]
@@ -0,0 +1,138 @@
+import pytest
+import circuit_breaker
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreakers, RollingWindow, is_failure
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, 'monotonic', clock)
+    return clock
+
+
+def make_breakers(**overrides):
+    settings = dict(enabled=True, window=60, buckets=12, min_requests=4, error_rate=0.5, slow_ms=1000,
+                    slow_rate=0.8, open_seconds=30, half_open_probes=1, close_after=2, open_mode='fail')
+    settings.update(overrides)
+    return CircuitBreakers(**settings)
+
+
+def open_breaker(breaker):
+    for _ in range(4):
+        assert breaker.allow()
+        breaker.record(None, 0.01, error='ConnectError')
+    assert breaker.state == OPEN
+
+
+def test_is_failure():
+    assert is_failure(None)
+    assert is_failure(503)
+    assert is_failure(429)
+    assert not is_failure(404)
+    assert not is_failure(200)
+
+
+def test_rolling_window_forgets_old_buckets():
+    window = RollingWindow(60, 12)
+    window.add(0.0, failed=True, slow=False, latency=0.2)
+    window.add(30.0, failed=False, slow=True, latency=0.4)
+    totals = window.totals(30.0)
+    assert (totals['requests'], totals['errors'], totals['slow']) == (2, 1, 1)
+    assert totals['latency_max_ms'] == 400.0
+    # Через минуту первая корзина выпадает из окна
+    assert window.totals(61.0)['requests'] == 1
+
+
+def test_stays_closed_below_min_requests(clock):
+    breaker = make_breakers().get('https://elma')
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record(500, 0.01)
+    assert breaker.state == CLOSED
+
+
+def test_client_errors_do_not_open(clock):
+    breaker = make_breakers().get('https://elma')
+    for _ in range(10):
+        breaker.allow()
+        breaker.record(400, 0.01)
+    assert breaker.state == CLOSED
+
+
+def test_slow_responses_open(clock):
+    breaker = make_breakers().get('https://elma')
+    for _ in range(4):
+        breaker.allow()
+        breaker.record(200, 2.0)
+    assert breaker.state == OPEN
+
+
+def test_open_rejects_until_timeout_then_probes(clock):
+    registry = make_breakers()
+    breaker = registry.get('https://elma')
+    open_breaker(breaker)
+    assert not breaker.allow()
+    assert breaker.retry_in() == 30
+    assert registry.open_domains() == ['https://elma']
+
+    clock.now += 30
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # Одна проба за раз
+    assert not breaker.allow()
+    assert registry.open_domains() == []
+
+
+def test_half_open_closes_after_successful_probes(clock):
+    breaker = make_breakers().get('https://elma')
+    open_breaker(breaker)
+    clock.now += 30
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record(200, 0.01)
+    assert breaker.state == CLOSED
+    # Ошибки до открытия не считаются после закрытия
+    assert breaker.window.totals(clock.now)['requests'] == 0
+
+
+def test_failed_probe_reopens(clock):
+    breaker = make_breakers().get('https://elma')
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record(502, 0.01)
+    assert breaker.state == OPEN
+    assert breaker.times_opened == 2
+    assert breaker.last_error == 'HTTP 502'
+
+
+def test_cancel_returns_probe_slot(clock):
+    # Проба, которая не дошла до запроса (отмена, сбой записи лога), не должна занимать слот навсегда
+    breaker = make_breakers().get('https://elma')
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.cancel()
+    assert breaker.probes_in_flight == 0
+    assert breaker.allow()
+
+
+def test_disabled_always_allows(clock):
+    breaker = make_breakers(enabled=False).get('https://elma')
+    for _ in range(10):
+        assert breaker.allow()
+        breaker.record(None, 0.01)
+    assert breaker.state == CLOSED
+
+
+def test_unknown_open_mode():
+    with pytest.raises(ValueError):
+        make_breakers(open_mode='queue')
@@ -0,0 +1,91 @@
+import gzip
+import json
+from datetime import datetime, timedelta, timezone
+import pytest
+from event_meta import extract_event_meta
+from flattening import flatten_row, flatten_rows, page_columns
+from routers.logs import columnar_page, flatDbAnswerItem, flatten_page, sort_result_item
+
+MOMENT = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+CASAVI_HEADERS = {'content-type': 'application/json', 'x-forwarded-for': '52.28.237.77'}
+
+BODIES = [
+    {'eventName': 'ticket_updated', 'eventId': 'e-1', 'eventTimestamp': '2024-05-01T12:00:00Z',
+     'isTriggeredViaApi': False, 'payload': {'ticketId': 't-1', 'internalId': '1001', 'number': '17'}},
+    {'eventName': 'ticket_created', 'eventId': 'e-2', 'isTriggeredViaApi': True,
+     'payload': {'ticketId': 't-2', 'title': 'Не работает лифт'}},
+    {'eventName': 'document_downloaded', 'eventId': 'e-3', 'payload': {'documentId': 'd-1'}},
+    {'eventName': 'contact_updated', 'eventId': 'e-4', 'payload': None},
+    {'eventName': 'ticket_comment_created', 'eventId': 'e-5', 'payload': {'ticketId': 't-1', 'text': 'a\nb'}},
+    ['not', 'an', 'object'],
+]
+
+
+def legacy_row(log_id, body):
+    # Строка до event_meta: поля события достаются из заголовков и тела при чтении
+    return {'id': log_id, 'timestamp': MOMENT + timedelta(seconds=log_id), 'httpmethod': 'POST',
+            'headers': CASAVI_HEADERS, 'body': body, 'path_params': '{}', 'query_params': '{}'}
+
+
+def meta_row(log_id, body):
+    return {**legacy_row(log_id, body), **extract_event_meta(CASAVI_HEADERS, body)}
+
+
+@pytest.mark.parametrize('make_row', [legacy_row, meta_row])
+def test_flatten_rows_matches_flat_db_answer_item(make_row):
+    rows = [make_row(log_id, body) for log_id, body in enumerate(BODIES, 1)]
+    assert flatten_rows(rows) == [flatDbAnswerItem(dict(row)) for row in rows]
+
+
+def test_meta_columns_match_legacy_parsing():
+    for log_id, body in enumerate(BODIES, 1):
+        legacy = flatten_row(legacy_row(log_id, body))
+        meta = flatten_row(meta_row(log_id, body))
+        # column_names перечисляет колонки строки, у строки с event_meta их больше
+        legacy.pop('column_names')
+        meta.pop('column_names')
+        assert meta == legacy
+
+
+def test_raw_body_flattens_like_json_body():
+    body = BODIES[1]
+    row = legacy_row(1, body)
+    raw = {**row, 'body': None, 'raw_body': gzip.compress(json.dumps(body).encode()), 'body_encoding': 'gzip'}
+    expected = flatten_row(row)
+    actual = flatten_row(raw)
+    assert actual['body_json'] == expected['body_json']
+    assert actual['body_payload'] == expected['body_payload']
+
+
+def test_event_specs():
+    created, updated = flatten_rows([legacy_row(1, BODIES[1]), legacy_row(2, BODIES[0])])
+    assert created['second_level'] == {'headers': CASAVI_HEADERS, 'query_params': '{}'}
+    assert created['body_eventId'] == 'e-2'
+    assert 'body_eventId' not in updated
+    assert updated['domain'] == 'CASAVI'
+    assert updated['timestamp'] == '2024-05-01T12:00:02Z'
+    assert updated['isTriggeredViaApi'] == '0'
+
+
+def test_page_columns_is_union_of_keys():
+    items = flatten_rows([meta_row(log_id, body) for log_id, body in enumerate(BODIES, 1)])
+    assert page_columns(items) == frozenset().union(*items)
+
+
+def test_columnar_page_matches_rows_page():
+    rows = [meta_row(log_id, body) for log_id, body in enumerate(BODIES, 1)]
+    header, *page = flatten_page(rows)
+    columnar = columnar_page(flatten_rows(rows))
+    assert set(columnar['columns']) == set(header)
+    for item, values in zip(page, columnar['rows']):
+        for column, value in zip(columnar['columns'], values):
+            # В построчном формате отсутствующая колонка — 'Not found' или её нет, в колоночном — null
+            expected = item.get(column)
+            assert value == (None if expected == 'Not found' else expected)
+
+
+def test_sort_result_item_puts_mandatory_keys_first():
+    item = sort_result_item({'zeta': 1, 'id': 3, 'alpha': 2})
+    assert list(item)[:2] == ['id', 'ip']
+    assert item['ip'] == 'Not found'
+    assert list(item)[-2:] == ['alpha', 'zeta']
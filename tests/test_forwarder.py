@@ -0,0 +1,18 @@
+import pytest
+import forwarder
+from forwarder import fan_out
+
+
+@pytest.mark.anyio
+async def test_fan_out_turns_domain_failure_into_502(monkeypatch):
+    async def forward_to_domain(domain, **event):
+        if domain == 'http://broken':
+            raise RuntimeError('log queue is gone')
+        return {'status_code': 200, 'eventName': event['bodyObj']['eventName'] + '_response'}
+
+    monkeypatch.setattr(forwarder, 'forward_to_domain', forward_to_domain)
+    results = await fan_out(['http://broken', 'http://ok'], bodyObj={'eventName': 'ticket_created'})
+
+    assert [result['status_code'] for result in results] == [502, 200]
+    assert results[0]['eventName'] == 'ticket_created_response'
+    assert 'log queue is gone' in results[0]['payload']['textError']
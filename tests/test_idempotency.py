@@ -0,0 +1,157 @@
+import asyncio
+import uuid
+import pytest
+import crud
+from idempotency import Idempotency, idempotency as app_idempotency, make_key_function
+from routers.requests import delivered_nowhere
+from test_ingest import rows_with, webhook
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def idempotency(request):
+    session_factory = request.getfixturevalue('session_factory') if request.param == 'sqlite' else None
+    return Idempotency(make_key_function('eventId'), 'eventId', ttl=60, cache_size=100, cache_bytes=4096, wait=1,
+                       response_max=1024, purge_interval=3600, lease=600, session_factory=session_factory)
+
+
+def test_key_functions():
+    assert make_key_function('') is None
+    assert make_key_function('eventId')({}, {'eventId': 7}) == 7
+    assert make_key_function('header:X-Delivery')({'x-delivery': 'd-1'}, {}) == 'd-1'
+    assert make_key_function('eventName+eventId')({}, {'eventName': 'ticket_created', 'eventId': 7}) == 'ticket_created:7'
+    assert make_key_function('eventName+eventId')({}, {'eventId': 7}) is None
+    with pytest.raises(ValueError):
+        make_key_function('ticketId')
+
+
+def test_delivered_nowhere():
+    assert delivered_nowhere([{'status_code': 502}, {'status_code': 503}])
+    assert not delivered_nowhere([{'status_code': 502}, {'status_code': 200}])
+    # Отложенное в outbox считается принятым
+    assert not delivered_nowhere([{'status_code': 202}])
+    assert not delivered_nowhere('Request received:{}')
+
+
+@pytest.mark.anyio
+async def test_claim_and_replay(idempotency):
+    first, entry = await idempotency.claim('e-1')
+    assert first
+    duplicate, waiting = await idempotency.claim('e-1')
+    assert not duplicate
+    # Повтор ждёт ответа первой доставки, пока она обрабатывается
+    replay = asyncio.create_task(idempotency.original_response(waiting))
+    await asyncio.sleep(0)
+    assert not replay.done()
+
+    log_future = asyncio.get_running_loop().create_future()
+    idempotency.complete(entry, 200, [{'status_code': 200}], log_future)
+    assert await replay == (200, [{'status_code': 200}])
+    log_future.set_result(41)
+    assert await idempotency.original_log_id(waiting) == 41
+    await idempotency.stop()
+    assert idempotency.stats()['duplicates'] == 1
+
+
+@pytest.mark.anyio
+async def test_release_lets_retry_through(idempotency):
+    _, entry = await idempotency.claim('e-2')
+    await idempotency.release(entry)
+    assert entry.released
+    first, _ = await idempotency.claim('e-2')
+    assert first
+
+
+@pytest.mark.anyio
+async def test_large_response_is_not_stored(idempotency):
+    _, entry = await idempotency.claim('e-3')
+    idempotency.complete(entry, 200, {'payload': 'x' * 2048}, None)
+    _, duplicate = await idempotency.claim('e-3')
+    assert await idempotency.original_response(duplicate) is None
+    await idempotency.stop()
+
+
+@pytest.mark.anyio
+async def test_cache_is_bounded_by_response_bytes(idempotency):
+    # Четыре ответа по ~1 КБ в кэш на 4 КБ: пятый вытесняет самый старый
+    for n in range(5):
+        _, entry = await idempotency.claim(f'bytes-{n}')
+        idempotency.complete(entry, 200, {'payload': 'x' * 1000}, None)
+    assert idempotency.stats()['cached_keys'] == 4
+    assert idempotency.stats()['cached_bytes'] <= 4096
+    await idempotency.release(entry)
+    assert idempotency.stats()['cached_bytes'] <= 3 * 1024
+    await idempotency.stop()
+
+
+@pytest.mark.anyio
+async def test_key_survives_restart(session_factory):
+    # Второй процесс (или тот же после рестарта) видит ключ и ответ в ingest_keys
+    def make():
+        return Idempotency(make_key_function('eventId'), 'eventId', ttl=60, cache_size=100, cache_bytes=4096, wait=1,
+                           response_max=1024, purge_interval=3600, lease=600, session_factory=session_factory)
+    before = make()
+    _, entry = await before.claim('e-4')
+    before.complete(entry, 200, {'status': 'ok'}, None)
+    await before.stop()
+
+    after = make()
+    first, entry = await after.claim('e-4')
+    assert not first
+    assert await after.original_response(entry) == (200, {'status': 'ok'})
+    assert after.stats()['db_hits'] == 1
+
+
+@pytest.mark.anyio
+async def test_stale_lease_is_taken_over(session_factory):
+    # Воркер упал посреди обработки: ключ без ответа дольше lease достаётся повтору
+    async with session_factory() as db:
+        assert await crud.claim_ingest_key(db, 'e-5')
+    idempotency = Idempotency(make_key_function('eventId'), 'eventId', ttl=60, cache_size=100, cache_bytes=4096, wait=1,
+                              response_max=1024, purge_interval=3600, lease=-1, session_factory=session_factory)
+    first, _ = await idempotency.claim('e-5')
+    assert first
+    assert idempotency.stats()['taken_over'] == 1
+
+
+def test_duplicate_delivery_is_replayed(client):
+    event_name = f'not_forwarded_{uuid.uuid4().hex[:8]}'
+    event_id = str(uuid.uuid4())
+    first = webhook(client, event_name, event_id)
+    second = webhook(client, event_name, event_id)
+    assert first.status_code == second.status_code == 200
+    assert second.json() == first.json()
+
+    original, duplicate = sorted(rows_with(client, event_name), key=lambda row: row['id'])
+    assert original['duplicate_of'] is None
+    assert duplicate['duplicate_of'] == original['id']
+
+
+def test_duplicate_from_other_worker_is_replayed(client):
+    # Ключ занят и обработан другим воркером: в памяти этого процесса его нет
+    if app_idempotency.session_factory is None:
+        pytest.skip('LOG_STORAGE=memory: ключи только в памяти процесса')
+    event_name = f'not_forwarded_{uuid.uuid4().hex[:8]}'
+    event_id = str(uuid.uuid4())
+
+    async def claim_elsewhere():
+        async with app_idempotency.session_factory() as db:
+            await crud.claim_ingest_key(db, event_id)
+            await crud.finish_ingest_key(db, event_id, log_id=7, status_code=200, response={'status': 'elsewhere'})
+    client.portal.call(claim_elsewhere)
+
+    response = webhook(client, event_name, event_id)
+    assert response.json() == {'status': 'elsewhere'}
+    [row] = rows_with(client, event_name)
+    assert row['duplicate_of'] == 7
+
+
+def test_failed_delivery_releases_key(client):
+    # FORWARD_DOMAINS в conftest указывает на закрытый порт: ни один домен не принял событие
+    event_id = str(uuid.uuid4())
+    released = app_idempotency.stats()['released']
+    for _ in range(2):
+        response = webhook(client, 'ticket_created', event_id, payload={'ticketId': event_id})
+        assert response.status_code == 200
+        assert [result['status_code'] for result in response.json()] == [502]
+    # Повтор пересылается заново, а не получает сохранённую ошибку
+    assert app_idempotency.stats()['released'] == released + 2
@@ -0,0 +1,29 @@
+"""Приём вебхуков целиком, на бэкенде из LOG_STORAGE (см. conftest.py)."""
+import uuid
+from storage import log_store
+
+
+def webhook(client, event_name, event_id=None, **fields):
+    body = {'eventName': event_name, 'eventId': event_id or str(uuid.uuid4()), **fields}
+    return client.post('/', json=body)
+
+
+def rows_with(client, event_name):
+    # Хранилище живёт в event loop приложения, читаем через него же
+    return client.portal.call(log_store.find, {'fields': {'eventName': event_name}})
+
+
+def test_webhook_is_logged_with_event_fields(client):
+    event_name = f'ingest_{uuid.uuid4().hex[:8]}'
+    response = webhook(client, event_name, payload={'ticketId': 't-1'})
+    assert response.status_code == 200
+    # LOG_WRITER_ACK=1: строка записана до ответа
+    [row] = rows_with(client, event_name)
+    assert row['body']['payload'] == {'ticketId': 't-1'}
+    assert row['event_name'] == event_name
+    assert row['httpmethod'] == 'POST'
+
+
+def test_stats(client):
+    for name in ('worker', 'idempotency', 'breakers', 'log_writer', 'row_cache'):
+        assert client.get(f'/x/stats/{name}').status_code == 200
@@ -0,0 +1,134 @@
+import asyncio
+import pytest
+from sqlalchemy.exc import DataError, OperationalError
+import log_writer as log_writer_module
+from log_writer import LogWriter, is_connection_error, make_log_row
+from storage import MemoryLogStore, strip_nul
+
+
+class RejectingStore(MemoryLogStore):
+    """Хранилище, которое отклоняет весь INSERT, если в пачке есть «плохая» строка."""
+
+    def __init__(self, error):
+        super().__init__(100)
+        self.error = error
+        self.calls = 0
+
+    async def insert(self, rows):
+        self.calls += 1
+        if any(row['body'].get('bad') for row in rows):
+            raise self.error
+        return await super().insert(rows)
+
+
+def rows(count, bad=()):
+    return [make_log_row('POST', {}, {'n': n, 'bad': n in bad}, '{}', {}) for n in range(count)]
+
+
+async def write_batch(writer, batch):
+    await writer.start()
+    futures = [await writer.submit(row) for row in batch]
+    await writer.stop()
+    return await asyncio.gather(*futures, return_exceptions=True)
+
+
+def test_strip_nul():
+    assert strip_nul({'a\x00': ['x\x00y', 1, None]}) == {'a': ['xy', 1, None]}
+
+
+def test_strip_nul_keeps_clean_objects():
+    value = {'a': ['b', {'c': 'd'}], 'e': 1}
+    assert strip_nul(value) is value
+
+
+def test_is_connection_error():
+    assert is_connection_error(OperationalError('INSERT', {}, Exception('server closed the connection')))
+    assert is_connection_error(ConnectionRefusedError())
+    assert not is_connection_error(DataError('INSERT', {}, Exception('invalid byte sequence')))
+    assert not is_connection_error(ValueError())
+
+
+@pytest.mark.anyio
+async def test_bad_row_is_isolated(monkeypatch):
+    store = RejectingStore(DataError('INSERT', {}, Exception('unsupported Unicode escape sequence')))
+    monkeypatch.setattr(log_writer_module, 'log_store', store)
+    writer = LogWriter(batch_size=8, flush_interval=0.05, max_queue=100, retries=2, retry_delay=0)
+
+    results = await write_batch(writer, rows(8, bad={5}))
+
+    assert isinstance(results[5], DataError)
+    assert all(isinstance(result, int) for n, result in enumerate(results) if n != 5)
+    assert sorted(row['body']['n'] for row in await store.find({})) == [0, 1, 2, 3, 4, 6, 7]
+    stats = writer.stats()
+    assert (stats['written'], stats['failed']) == (7, 1)
+    assert stats['bisected'] > 0
+
+
+@pytest.mark.anyio
+async def test_connection_error_fails_whole_batch(monkeypatch):
+    # База так и не поднялась — пачку не дробим, иначе log2(n) лишних попыток впустую
+    store = RejectingStore(OperationalError('INSERT', {}, Exception('connection refused')))
+    monkeypatch.setattr(log_writer_module, 'log_store', store)
+    writer = LogWriter(batch_size=8, flush_interval=0.05, max_queue=100, retries=2, retry_delay=0)
+
+    results = await write_batch(writer, rows(4, bad={0}))
+
+    assert all(isinstance(result, OperationalError) for result in results)
+    # Первая попытка и два повтора
+    assert store.calls == 3
+    assert writer.stats()['retried'] == 2
+    assert writer.stats()['bisected'] == 0
+
+
+class FlakyStore(MemoryLogStore):
+    """Хранилище, соединение с которым рвётся первые failures раз."""
+
+    def __init__(self, failures):
+        super().__init__(100)
+        self.failures = failures
+
+    async def insert(self, rows):
+        if self.failures:
+            self.failures -= 1
+            raise OperationalError('INSERT', {}, Exception('server closed the connection'))
+        return await super().insert(rows)
+
+
+@pytest.mark.anyio
+async def test_connection_error_is_retried(monkeypatch):
+    store = FlakyStore(failures=2)
+    monkeypatch.setattr(log_writer_module, 'log_store', store)
+    writer = LogWriter(batch_size=8, flush_interval=0.05, max_queue=100, retries=2, retry_delay=0)
+
+    results = await write_batch(writer, rows(4))
+
+    assert all(isinstance(result, int) for result in results)
+    assert len(await store.find({})) == 4
+    assert (writer.stats()['written'], writer.stats()['failed']) == (4, 0)
+
+
+@pytest.mark.anyio
+async def test_write_without_queue_inserts_directly(monkeypatch):
+    store = MemoryLogStore(10)
+    monkeypatch.setattr(log_writer_module, 'log_store', store)
+    writer = LogWriter(batch_size=8, flush_interval=0.05, max_queue=100, retries=2, retry_delay=0)
+    log_id = await writer.write(rows(1)[0], wait=True)
+    assert store.get(log_id)['body'] == {'n': 0, 'bad': False}
+
+
+@pytest.mark.anyio
+async def test_batch_waits_for_ready(monkeypatch):
+    store = MemoryLogStore(10)
+    monkeypatch.setattr(log_writer_module, 'log_store', store)
+    writer = LogWriter(batch_size=8, flush_interval=0.01, max_queue=100, retries=2, retry_delay=0)
+    await writer.start()
+    row = rows(1)[0]
+
+    async def fill_row():
+        await asyncio.sleep(0.05)
+        row['duplicate_of'] = 3
+    future = await writer.submit(row, ready=asyncio.create_task(fill_row()))
+    # Строка дописывается после ready, хотя flush_interval уже прошёл
+    log_id = await future
+    await writer.stop()
+    assert store.get(log_id)['duplicate_of'] == 3
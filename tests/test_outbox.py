@@ -0,0 +1,29 @@
+import asyncio
+import pytest
+import crud
+from outbox import OutboxDispatcher, backoff_delay
+
+
+def test_backoff_delay_is_capped():
+    assert 0.5 <= backoff_delay(1) <= 1
+    assert backoff_delay(100) <= 300
+
+
+@pytest.mark.anyio
+async def test_concurrent_claims_respect_per_domain(monkeypatch):
+    dispatcher = OutboxDispatcher(workers=2, per_domain=1, max_attempts=3, poll_interval=1, lease_seconds=60)
+    queue = [{'id': 1, 'domain': 'a'}, {'id': 2, 'domain': 'a'}]
+
+    async def db_call(func, limit, lease_seconds, busy_domains):
+        assert func is crud.claim_outbox
+        # Пока запрос в базе, второй воркер успевает начать свой
+        await asyncio.sleep(0.01)
+        rows = [row for row in queue if row['domain'] not in busy_domains][:limit]
+        for row in rows:
+            queue.remove(row)
+        return rows
+
+    monkeypatch.setattr(dispatcher, '_db_call', db_call)
+    claimed = await asyncio.gather(dispatcher._claim(), dispatcher._claim())
+    assert [row['id'] for row in claimed if row] == [1]
+    assert dispatcher.stats()['in_flight'] == {'a': 1}
@@ -0,0 +1,60 @@
+import uuid
+import pytest
+from fastapi import HTTPException
+from routers.logs import decode_cursor, encode_cursor
+from storage import log_store
+from test_ingest import rows_with, webhook
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor('after', 42)) == ('after', 42)
+    assert '=' not in encode_cursor('before', 1)
+
+
+@pytest.mark.parametrize('cursor', ['not-base64!', encode_cursor('sideways', 1), 'e30'])
+def test_invalid_cursor(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def test_invalid_cursor_is_bad_request(client):
+    assert client.get('/x/logs/page', params={'cursor': 'garbage'}).status_code == 400
+
+
+def test_keyset_pages(client):
+    event_name = f'page_test_{uuid.uuid4().hex[:8]}'
+    for _ in range(5):
+        assert webhook(client, event_name).status_code == 200
+    expected = sorted(row['id'] for row in rows_with(client, event_name))
+    assert len(expected) == 5
+
+    ids, params = [], {'eventName': event_name, 'direction': 'forward', 'limit': 2}
+    while True:
+        page = client.get('/x/logs/page', params=params).json()
+        header, *items = page['rows']
+        ids.extend(item['id'] for item in items)
+        if page['next_cursor'] is None:
+            break
+        params = {'eventName': event_name, 'cursor': page['next_cursor'], 'limit': 2}
+    assert ids == expected
+
+    # Обратно от первой строки последней страницы
+    previous = client.get('/x/logs/page', params={'eventName': event_name, 'cursor': page['prev_cursor'],
+                                                  'limit': 10}).json()
+    assert [item['id'] for item in previous['rows'][1:]] == expected[-2::-1]
+
+
+@pytest.mark.parametrize('page', [0, -1])
+def test_parsed_by_page_rejects_pages_below_one(client, page):
+    assert client.get(f'/x/logs_parsed_by_page/{page}').status_code == 404
+
+
+def test_parsed_by_page_is_an_id_range(client):
+    webhook(client, f'by_page_{uuid.uuid4().hex[:8]}')
+    [row] = client.portal.call(log_store.find, {}, True, 1)
+    page = (row['id'] - 1) // 100 + 1
+    header, *items = client.get(f'/x/logs_parsed_by_page/{page}').json()
+    ids = [item['id'] for item in items]
+    assert row['id'] in ids
+    assert all((page - 1) * 100 < log_id <= page * 100 for log_id in ids)
@@ -0,0 +1,12 @@
+from datetime import datetime, timedelta, timezone
+from partitions import partition_name, partition_start, partition_step
+
+
+def test_partition_bounds():
+    # 23:30 по Москве — 20:30 UTC того же дня
+    moment = datetime(2024, 5, 1, 23, 30, tzinfo=timezone(timedelta(hours=3)))
+    assert partition_start(moment, 'day') == datetime(2024, 5, 1, tzinfo=timezone.utc)
+    # 2024-05-01 — среда, неделя начинается с понедельника 29 апреля
+    assert partition_start(moment, 'week') == datetime(2024, 4, 29, tzinfo=timezone.utc)
+    assert partition_step('week') == timedelta(weeks=1)
+    assert partition_name(datetime(2024, 4, 29, tzinfo=timezone.utc)) == 'logs_p20240429'
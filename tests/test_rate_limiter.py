@@ -0,0 +1,87 @@
+import asyncio
+import fcntl
+import os
+import threading
+import time
+import pytest
+from rate_limiter import FileBucketStore, MemoryBucketStore, RateLimiter, parse_rule, take_token
+
+
+def test_parse_rule():
+    assert parse_rule('') is None
+    assert parse_rule('5/2') == (5.0, 2.0)
+    assert parse_rule('3') == (3.0, 1.0)
+
+
+def test_take_token_full_bucket():
+    tokens, wait = take_token(2.0, 0.0, 0.0, max_rate=2, period=1, block=True)
+    assert (tokens, wait) == (1.0, 0.0)
+
+
+def test_take_token_refills_by_elapsed_time_up_to_capacity():
+    # 0.5 с при 2 токенах в секунду — ровно один новый токен
+    assert take_token(0.0, 10.0, 10.5, max_rate=2, period=1, block=False) == (0.0, 0.0)
+    # Долгий простой не даёт больше max_rate токенов
+    tokens, _ = take_token(0.0, 0.0, 100.0, max_rate=2, period=1, block=False)
+    assert tokens == 1.0
+
+
+def test_take_token_empty_bucket_without_block():
+    assert take_token(0.25, 5.0, 5.0, max_rate=1, period=4, block=False) == (0.25, None)
+
+
+def test_take_token_empty_bucket_reserves_and_returns_wait():
+    # Токен занимается в долг, ждать до его появления: (1 - 0.25) * 4 / 1 секунд
+    tokens, wait = take_token(0.25, 5.0, 5.0, max_rate=1, period=4, block=True)
+    assert tokens == -0.75
+    assert wait == pytest.approx(3.0)
+    # Следующий в очереди ждёт ещё один полный интервал
+    _, wait = take_token(tokens, 5.0, 5.0, max_rate=1, period=4, block=True)
+    assert wait == pytest.approx(7.0)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize('backend', ['memory', 'file'])
+async def test_try_acquire_refunds_when_second_bucket_is_empty(backend, tmp_path):
+    bucket_store = MemoryBucketStore() if backend == 'memory' else FileBucketStore(str(tmp_path))
+    limiter = RateLimiter(bucket_store, domain_rule=(2, 3600), event_rule=(1, 3600))
+    assert await limiter.try_acquire(domain='a', event='ticket_created')
+    # Ведро события пустое: токен домена возвращается
+    assert not await limiter.try_acquire(domain='a', event='ticket_created')
+    assert await limiter.try_acquire(domain='a', event='ticket_updated')
+    assert not await limiter.try_acquire(domain='a', event='ticket_comment_created')
+    assert limiter.stats()['acquired'] == 2
+    assert limiter.stats()['rejected'] == 2
+
+
+@pytest.mark.anyio
+async def test_acquire_without_rules_does_not_wait():
+    limiter = RateLimiter(MemoryBucketStore(), domain_rule=None, event_rule=None)
+    await limiter.acquire(domain='a', event='ticket_created')
+    assert limiter.stats()['waited_seconds'] == 0
+
+
+@pytest.mark.anyio
+async def test_file_bucket_lock_does_not_block_event_loop(tmp_path):
+    bucket_store = FileBucketStore(str(tmp_path))
+    locked = threading.Event()
+
+    def other_worker():
+        # Ведро 0.3 секунды держит другой воркер
+        fd = os.open(bucket_store._path('domain:a'), os.O_RDWR | os.O_CREAT)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        locked.set()
+        time.sleep(0.3)
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    holder = threading.Thread(target=other_worker)
+    holder.start()
+    locked.wait()
+    take = asyncio.create_task(bucket_store.take('domain:a', 1, 1, True))
+    for _ in range(5):
+        await asyncio.sleep(0.01)
+    # Event loop продолжает работать, пока take ждёт блокировку
+    assert not take.done()
+    assert await take == 0.0
+    holder.join()
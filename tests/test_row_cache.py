@@ -0,0 +1,90 @@
+import uuid
+from datetime import datetime, timezone
+import pytest
+from row_cache import DiskRowCache, FlatRowCache, row_cache, row_key
+from test_ingest import rows_with, webhook
+
+
+def flatten_counting(calls):
+    def flatten_rows(rows):
+        if rows:
+            calls.append([row['id'] for row in rows])
+        return [{'id': row['id'], 'eventName': row['body']['eventName']} for row in rows]
+    return flatten_rows
+
+
+def row(log_id, event_name, second=0):
+    return {'id': log_id, 'timestamp': datetime(2024, 5, 1, 0, 0, second, tzinfo=timezone.utc),
+            'body': {'eventName': event_name}}
+
+
+@pytest.mark.anyio
+async def test_hits_skip_flattening():
+    cache, calls = FlatRowCache(max_bytes=1 << 20), []
+    first = await cache.flatten([row(1, 'a'), row(2, 'b')], flatten_counting(calls))
+    second = await cache.flatten([row(2, 'b'), row(3, 'c')], flatten_counting(calls))
+    assert calls == [[1, 2], [3]]
+    assert [item['eventName'] for item in first + second] == ['a', 'b', 'b', 'c']
+    # Обработчики меняют элементы страницы, кэш от этого не портится
+    second[0]['eventName'] = 'changed'
+    assert (await cache.flatten([row(2, 'b')], flatten_counting(calls)))[0]['eventName'] == 'b'
+
+
+@pytest.mark.anyio
+async def test_reused_id_with_other_timestamp_misses():
+    cache, calls = FlatRowCache(max_bytes=1 << 20), []
+    await cache.flatten([row(1, 'old', second=0)], flatten_counting(calls))
+    [item] = await cache.flatten([row(1, 'new', second=5)], flatten_counting(calls))
+    assert item['eventName'] == 'new'
+
+
+@pytest.mark.anyio
+async def test_evicts_least_recently_used():
+    cache = FlatRowCache(max_bytes=60)
+    for log_id in range(5):
+        await cache.flatten([row(log_id, 'ticket_updated')], flatten_counting([]))
+    assert cache.size <= 60
+    assert cache.stats()['evictions'] > 0
+    assert cache.get(row_key(row(4, 'ticket_updated'))) is not None
+    assert cache.get(row_key(row(0, 'ticket_updated'))) is None
+
+
+@pytest.mark.anyio
+async def test_disk_tier_is_shared_and_cleared(tmp_path):
+    path = str(tmp_path / 'rows.db')
+    calls = []
+    await FlatRowCache(1 << 20, DiskRowCache(path, 100)).flatten([row(1, 'a')], flatten_counting(calls))
+
+    # Другой воркер: память пустая, строка находится в файле
+    other = FlatRowCache(1 << 20, DiskRowCache(path, 100))
+    [item] = await other.flatten([row(1, 'a')], flatten_counting(calls))
+    assert item['eventName'] == 'a'
+    assert calls == [[1]]
+    assert other.stats()['disk_hits'] == 1
+
+    # Строка с тем же id, но другим временем, в файле не совпадает
+    [item] = await other.flatten([row(1, 'b', second=5)], flatten_counting(calls))
+    assert item['eventName'] == 'b'
+
+    await other.clear()
+    assert other.stats()['rows'] == 0
+    assert DiskRowCache(path, 100).get_many([row_key(row(1, 'a'))]) == {}
+
+
+def test_delete_clears_row_cache(client):
+    event_name = f'cached_{uuid.uuid4().hex[:8]}'
+    webhook(client, event_name)
+    [row] = rows_with(client, event_name)
+    assert client.get(f"/x/logs_after/{row['id'] - 1}").status_code == 200
+    assert row_cache.stats()['rows'] > 0
+
+    response = client.delete('/x/logs').json()
+    assert response['deleted_in_batches'] >= 1
+    assert row_cache.stats()['rows'] == 0
+    assert rows_with(client, event_name) == []
+
+    webhook(client, event_name)
+    [new_row] = rows_with(client, event_name)
+    assert new_row['id'] > row['id']
+    [header, item] = client.get(f"/x/logs_after/{new_row['id'] - 1}").json()
+    assert item['id'] == new_row['id']
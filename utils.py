@@ -1,7 +1,25 @@
 import json
+import datetime
 
 class CustomJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, bytes):
             return obj.decode('utf-8')
         return super().default(obj)
+
+def default_serializer(obj):
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+    return str(obj)
+
+def utc_now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+def format_timestamp(value):
+    # Формат, в котором timestamp всегда отдавался просмотрщику: ISO с "Z"
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc)
+            return value.replace(tzinfo=None).isoformat() + "Z"
+        return value.isoformat()
+    return value